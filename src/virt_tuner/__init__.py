@@ -23,8 +23,12 @@ Utility functions to generate tuned configuration virtual machines
 from collections import namedtuple
 import gettext
 import logging
-import itertools
-import virt_tuner.virt
+import virt_tuner.placement as placement
+import virt_tuner.registry as registry
+import virt_tuner.resctrl as resctrl
+import virt_tuner.timings as timings
+from virt_tuner.cpuset import CpuSet
+from virt_tuner.topology import Topology
 
 gettext.bindtextdomain("virt-tuner", "/usr/share/locale")
 gettext.textdomain("virt-tuner")
@@ -41,36 +45,60 @@ __version__ = "0.0.3"
 
 
 Template = namedtuple("Template", ["description", "function", "parameters"])
+Parameter = namedtuple("Parameter", ["name", "type", "description", "default"])
 
+# I/O modes of the tuned disks, both need the host page cache to be bypassed
+DISK_IO_MODES = ["native", "io_uring"]
 
-def single():
+# Maximum number of queues of a tuned disk: more would only use interrupt vectors
+MAX_DISK_QUEUES = 16
+
+# Size of the receive and transmit queues of the tuned network interfaces
+NET_QUEUE_SIZE = 1024
+
+
+@timings.timed("template")
+def single(cells=None, housekeeping=0, iothreads=0, disk_io=None, net_queues=0, llc=0):
     """
     Compute parameters for single VM per host.
+    The host topology is read from libvirt if cells is not provided.
+    The first housekeeping cores of each cell are left for the emulator and I/O threads.
+    The local virtio disks are tuned if disk_io is set, the virtio network
+    interfaces if net_queues is set and the llc fraction of the last level
+    caches is reserved for the virtual CPUs if set.
     """
-    cells = virt_tuner.virt.host_topology()
-    cpus = [cell.cpus for cell in cells]
-    cpus = [cpu for sublist in cpus for cpu in sublist]
+    if cells is None:
+        import virt_tuner.virt  # pylint: disable=import-outside-toplevel
 
-    key_fn = lambda c: "{:0>5}{:0>5}".format(c["socket_id"], c["core_id"])
+        cells = virt_tuner.virt.host_topology()
+    topology = Topology(cells)
+    cpu_cells = [cell for cell in topology.cells if cell.cpus]
+    memory_cells = [cell for cell in topology.cells if not cell.cpus]
+    guest_ids = {
+        cell.id: guest_id for guest_id, cell in enumerate(cpu_cells + memory_cells)
+    }
+    reserved = [housekeeping_cpus(topology, cell, housekeeping) for cell in cpu_cells]
+    reserved_ids = {cpu_id for cell_cpus in reserved for cpu_id in cell_cpus}
+    cpus = [i for i in range(len(topology)) if topology.cpu_id[i] not in reserved_ids]
 
     # Sort the cpus to have the consecutive IDs for the siblings:
     # QEMU needs this trick to think the two virtual cpus are located on the same core.
-    cpus = sorted(cpus, key=key_fn)
-    for id, cpu in enumerate(cpus):
-        cpu['id'] = id
+    # The index of a CPU in the sorted list is its virtual CPU ID.
+    cpus = topology.order(cpus, "socket", "core")
+    vcpus_by_cell = {cell.id: [] for cell in cpu_cells}
+    for vcpu, i in enumerate(cpus):
+        vcpus_by_cell[topology.node[i]].append(vcpu)
 
     cpu_topology = {
-        "sockets": len({c["socket_id"] for c in cpus}),
-        "cores": len({c["core_id"] for c in cpus}),
-        "threads": {
-            len(list(g)) for k, g in itertools.groupby(sorted(cpus, key=key_fn), key_fn)
-        }.pop(),
+        "sockets": len({topology.socket[i] for i in cpus}),
+        "cores": len({topology.core[i] for i in cpus}),
+        "threads": {len(group) for group in topology.groups(cpus)}.pop(),
     }
 
     # Compute the amount of 1GiB pages per cell.
     # We want an even number of pages on each cell
     # and at least 9% of the total memory amount for the host
-    cells_mem = [cell.memory for cell in cells]
+    cells_mem = [cell.memory for cell in cpu_cells]
     cells_pages = [int(mem / (1024 ** 2)) for mem in cells_mem]
     cell_pages_max = min(cells_pages)
 
@@ -78,9 +106,19 @@ def single():
     if cell_pages_max * len(cells_mem) * 1024 ** 2 / sum(cells_mem) <= 0.91:
         pages_per_cell = cell_pages_max
 
-    vm_memory = pages_per_cell * len(cells)
+    # The cells without CPUs, like CXL memory expanders, are guest cells without CPUs
+    pages = {cell.id: pages_per_cell for cell in cpu_cells}
+    pages.update({cell.id: cell_pages(cell) for cell in memory_cells})
+    vm_memory = sum(pages.values())
+    groups = placement.clusters(topology.cells)
+    policies = {
+        guest_ids[cell.id]: placement.choose(
+            topology.cells, cell, pages[cell.id] * 1024 ** 2, groups=groups
+        )
+        for cell in cpu_cells + memory_cells
+    }
 
-    return {
+    config = {
         "cpu": {
             "placement": "static",
             "maximum": cpu_topology["sockets"]
@@ -95,26 +133,331 @@ def single():
                 "x2apic": "require",
             },
             "tuning": {
-                "vcpupin": {cpu["id"]: cpu["siblings"] for cpu in cpus},
+                "vcpupin": {
+                    vcpu: topology.siblings[topology.group[i]]
+                    for vcpu, i in enumerate(cpus)
+                },
             },
             "numa": {
-                c.id: {
-                    "cpus": ",".join([str(cpu["id"]) for cpu in sorted(c.cpus, key=lambda c: c["id"])]),
-                    "memory": str(pages_per_cell) + " GiB",
-                    "distances": c.distances,
+                guest_ids[c.id]: {
+                    "cpus": str(CpuSet(vcpus_by_cell[c.id])) if c.cpus else None,
+                    "memory": str(pages[c.id]) + " GiB",
+                    "distances": guest_distances(c, guest_ids),
                 }
-                for c in cells
+                for c in cpu_cells + memory_cells
             },
         },
-        "numatune": {
-            "memory": {
-                "mode": "strict",
-                "nodeset": ",".join([str(cell.id) for cell in cells]),
+        "numatune": placement.numatune(policies),
+        "mem": {
+            "boot": str(vm_memory) + " GiB",
+            "current": str(vm_memory) + " GiB",
+            "nosharepages": True,
+            "hugepages": [{"size": "1 G"}],
+        },
+        "hypervisor_features": {"kvm-hint-dedicated": True},
+        "clock": {
+            "timers": {
+                "rtc": {"tickpolicy": "catchup"},
+                "pit": {"tickpolicy": "catchup"},
+                "hpet": {"present": False},
             },
-            "memnodes": {
-                cell.id: {"mode": "strict", "nodeset": cell.id} for cell in cells
+        },
+    }
+    add_housekeeping(config, reserved, add_storage(config, disk_io, iothreads))
+    add_network(config, net_queues, {guest_ids[cell.id]: cell for cell in cpu_cells})
+    add_resctrl(config, topology, cpus, llc)
+    return config
+
+
+def guest_distances(cell, guest_ids):
+    """
+    Get the distances of a host cell to the other host cells by guest cell ID.
+    guest_ids maps the IDs of the host cells used by the guest to their guest cell ID.
+    """
+    return {
+        type(cell_id)(guest_ids[int(cell_id)]): distance
+        for cell_id, distance in cell.distances.items()
+        if int(cell_id) in guest_ids
+    }
+
+
+def cell_pages(cell):
+    """
+    Compute the number of 1GiB pages to use on a cell, keeping 9% of its memory for the host
+    """
+    return int(cell.memory * 0.91 / (1024 ** 2))
+
+
+def housekeeping_cpus(topology, cell, count):
+    """
+    Get the sorted IDs of the CPUs of the count first cores of a topology cell.
+    All the SMT siblings of a core are reserved together.
+    """
+    if not count:
+        return []
+    cores = topology.cores(cell)
+    if count >= len(cores):
+        raise ValueError(
+            _("Cell {} has no core left for the virtual CPUs").format(cell.id)
+        )
+    return topology.ids(i for core in cores[:count] for i in core)
+
+
+def add_housekeeping(config, reserved, iothreads):
+    """
+    Pin the emulator and I/O threads of a configuration on the housekeeping CPUs.
+    reserved is the list of housekeeping CPU IDs of each cell used by the virtual machine.
+    The I/O threads are spread over the cells.
+    """
+    if iothreads:
+        config["cpu"]["iothreads"] = iothreads
+    reserved = [cell_cpus for cell_cpus in reserved if cell_cpus]
+    if not reserved:
+        return
+    tuning = config["cpu"]["tuning"]
+    tuning["emulatorpin"] = str(
+        CpuSet(cpu_id for cell_cpus in reserved for cpu_id in cell_cpus)
+    )
+    if iothreads:
+        tuning["iothreadpin"] = {
+            iothread: str(CpuSet(reserved[(iothread - 1) % len(reserved)]))
+            for iothread in range(1, iothreads + 1)
+        }
+
+
+def add_storage(config, disk_io, iothreads):
+    """
+    Tune the local virtio disks of a configuration with the disk_io I/O mode.
+    The disks are spread over the I/O threads, one per guest NUMA cell if there
+    are none yet, and get a queue per virtual CPU of a guest cell.
+    Returns the number of I/O threads of the configuration.
+    """
+    if not disk_io:
+        return iothreads
+    if disk_io not in DISK_IO_MODES:
+        raise ValueError(_("Invalid disk I/O mode: ") + disk_io)
+    cpu = config["cpu"]
+    cells = max(len(cpu.get("numa", {})), 1)
+    iothreads = iothreads or cells
+    config["storage"] = {
+        "iothreads": iothreads,
+        "queues": max(min(cpu["maximum"] // cells, MAX_DISK_QUEUES), 1),
+        "cache": "none",
+        "io": disk_io,
+    }
+    return iothreads
+
+
+def add_network(config, net_queues, cells):
+    """
+    Tune the virtio network interfaces of a configuration with a queue per virtual CPU,
+    up to net_queues. cells maps the guest NUMA cell IDs to their host topology cell:
+    the interfaces using a host network device are placed on the guest cell of its
+    host cell.
+    """
+    if not net_queues:
+        return
+    if net_queues < 0:
+        raise ValueError(_("The number of network queues has to be positive"))
+    config["network"] = {
+        "queues": min(config["cpu"]["maximum"], net_queues),
+        "rx_queue_size": NET_QUEUE_SIZE,
+        "tx_queue_size": NET_QUEUE_SIZE,
+        "nodes": {
+            nic: guest_id for guest_id, cell in cells.items() for nic in cell.nics
+        },
+    }
+
+
+def add_resctrl(config, topology, pinned, llc, vm_shares=None):
+    """
+    Allocate the llc fraction of the last level caches and memory bandwidth used by
+    the virtual CPUs of a configuration. pinned lists the topology index of the host
+    CPU of each virtual CPU and vm_shares counts the virtual machines sharing them.
+    """
+    if not llc:
+        return
+    if not 0 < llc < 1:
+        raise ValueError(_("The last level cache fraction has to be between 0 and 1"))
+    cachetune, memorytune = resctrl.allocations(topology, pinned, llc, vm_shares)
+    tuning = config["cpu"]["tuning"]
+    if cachetune:
+        tuning["cachetune"] = cachetune
+    if memorytune:
+        tuning["memorytune"] = memorytune
+
+
+def split_evenly(items, parts):
+    """
+    Split a list in parts contiguous chunks of sizes differing by one at most
+    """
+    size, remainder = divmod(len(items), parts)
+    chunks = []
+    start = 0
+    for i in range(parts):
+        end = start + size + (1 if i < remainder else 0)
+        chunks.append(items[start:end])
+        start = end
+    return chunks
+
+
+def partition_slices(topology, vms=None, layout=None, housekeeping=0):
+    """
+    Split the host into non-overlapping slices, one per virtual machine.
+
+    layout is a string like "0,1;2,3" listing the host cells of each virtual machine.
+    Otherwise the host is split into vms slices of whole cells if there are fewer
+    virtual machines than cells or of equal parts of cells if there are more.
+
+    Each slice is a list of (cell, cores, pages) tuples, where cell is a topology cell,
+    cores are the CPU indices of the slice grouped by core and pages the amount of
+    1GiB pages of the slice.
+    The housekeeping first cores of each cell are not part of any slice.
+    The cells without CPUs are only used if listed in the layout.
+    """
+    cells_by_id = {cell.id: cell for cell in topology.cells}
+    cells = sorted(
+        (cell for cell in topology.cells if cell.cpus), key=lambda cell: cell.id
+    )
+
+    def vm_cores(cell):
+        if not cell.cpus:
+            return []
+        housekeeping_cpus(topology, cell, housekeeping)
+        return topology.cores(cell)[housekeeping:]
+
+    if layout:
+        groups = [
+            [int(cell_id) for cell_id in vm.split(",")] for vm in layout.split(";")
+        ]
+        used = [cell_id for group in groups for cell_id in group]
+        unknown = [cell_id for cell_id in used if cell_id not in cells_by_id]
+        if unknown:
+            raise ValueError(_("Unknown host cells: ") + ",".join(map(str, unknown)))
+        if len(set(used)) != len(used):
+            raise ValueError(_("Host cells can be used by only one virtual machine"))
+        return [
+            [
+                (
+                    cells_by_id[cell_id],
+                    vm_cores(cells_by_id[cell_id]),
+                    cell_pages(cells_by_id[cell_id]),
+                )
+                for cell_id in group
+            ]
+            for group in groups
+        ]
+
+    if not vms or vms < 1:
+        raise ValueError(_("The number of virtual machines has to be positive"))
+
+    if vms <= len(cells):
+        if len(cells) % vms:
+            raise ValueError(
+                _("{} cells can't be split among {} virtual machines").format(
+                    len(cells), vms
+                )
+            )
+        return [
+            [(cell, vm_cores(cell), cell_pages(cell)) for cell in group]
+            for group in split_evenly(cells, vms)
+        ]
+
+    if vms % len(cells):
+        raise ValueError(
+            _("{} cells can't be split among {} virtual machines").format(
+                len(cells), vms
+            )
+        )
+    parts = vms // len(cells)
+    slices = []
+    for cell in cells:
+        cores = vm_cores(cell)
+        if len(cores) < parts:
+            raise ValueError(_("Cell {} has less than {} cores").format(cell.id, parts))
+        slices.extend(
+            [
+                [(cell, chunk, cell_pages(cell) // parts)]
+                for chunk in split_evenly(cores, parts)
+            ]
+        )
+    return slices
+
+
+def slice_cpus(vm_slice):
+    """
+    Get the CPU indices of a host slice in the order of the virtual CPUs
+    """
+    return [i for cell, cores, pages in vm_slice for core in cores for i in core]
+
+
+def partition_config(
+    topology,
+    vm_slice,
+    housekeeping=0,
+    iothreads=0,
+    disk_io=None,
+    net_queues=0,
+    llc=0,
+    vm_shares=None,
+):
+    """
+    Compute the parameters of a virtual machine running on a host slice.
+    The emulator and I/O threads are pinned on the housekeeping first cores of its cells.
+    vm_shares counts the virtual machines sharing the last level caches.
+    """
+    cpu_cores = [cores for cell, cores, pages in vm_slice if cell.cpus]
+    if len({len(cores) for cores in cpu_cores}) != 1:
+        raise ValueError(
+            _("The cells of a virtual machine need the same number of cores")
+        )
+    threads = {len(core) for cell, cores, pages in vm_slice for core in cores}
+    if len(threads) != 1:
+        raise ValueError(_("All cores need the same number of threads"))
+
+    vcpupin = {}
+    numa = {}
+    for guest_id, (cell, cores, pages) in enumerate(vm_slice):
+        first_vcpu = len(vcpupin)
+        for i in [i for core in cores for i in core]:
+            vcpupin[len(vcpupin)] = topology.siblings[topology.group[i]]
+        numa[guest_id] = {
+            "cpus": str(CpuSet(range(first_vcpu, len(vcpupin)))) if cell.cpus else None,
+            "memory": str(pages) + " GiB",
+            "distances": {
+                other_id: cell.distances.get(other.id)
+                for other_id, (other, other_cores, other_pages) in enumerate(vm_slice)
+            },
+        }
+
+    vm_memory = sum(pages for cell, cores, pages in vm_slice)
+    slice_cells = [cell for cell, cores, pages in vm_slice]
+    groups = placement.clusters(slice_cells)
+    policies = {
+        guest_id: placement.choose(slice_cells, cell, pages * 1024 ** 2, groups=groups)
+        for guest_id, (cell, cores, pages) in enumerate(vm_slice)
+    }
+
+    config = {
+        "cpu": {
+            "placement": "static",
+            "maximum": len(vcpupin),
+            "topology": {
+                "sockets": len(cpu_cores),
+                "cores": len(cpu_cores[0]),
+                "threads": threads.pop(),
+            },
+            "mode": "host-passthrough",
+            "check": "none",
+            "features": {
+                "rdtscp": "require",
+                "invtsc": "require",
+                "x2apic": "require",
             },
+            "tuning": {"vcpupin": vcpupin},
+            "numa": numa,
         },
+        "numatune": placement.numatune(policies),
         "mem": {
             "boot": str(vm_memory) + " GiB",
             "current": str(vm_memory) + " GiB",
@@ -130,12 +473,213 @@ def single():
             },
         },
     }
+    add_housekeeping(
+        config,
+        [
+            housekeeping_cpus(topology, cell, housekeeping)
+            for cell, cores, pages in vm_slice
+            if cell.cpus
+        ],
+        add_storage(config, disk_io, iothreads),
+    )
+    add_network(
+        config,
+        net_queues,
+        {guest_id: cell for guest_id, (cell, cores, pages) in enumerate(vm_slice)},
+    )
+    add_resctrl(config, topology, slice_cpus(vm_slice), llc, vm_shares)
+    return config
+
+
+def partition_configs(
+    cells,
+    vms=None,
+    layout=None,
+    housekeeping=0,
+    iothreads=0,
+    disk_io=None,
+    net_queues=0,
+    llc=0,
+):
+    """
+    Compute the parameters of all the virtual machines sharing the host.
+    The virtual machines sharing a last level cache split the llc fraction of it.
+    """
+    topology = Topology(cells)
+    slices = partition_slices(topology, vms, layout, housekeeping)
+    vm_shares = (
+        resctrl.shares(topology, [slice_cpus(vm_slice) for vm_slice in slices])
+        if llc
+        else None
+    )
+    return [
+        partition_config(
+            topology,
+            vm_slice,
+            housekeeping,
+            iothreads,
+            disk_io,
+            net_queues,
+            llc,
+            vm_shares,
+        )
+        for vm_slice in slices
+    ]
 
 
-templates = {
+@timings.timed("template")
+def partition(
+    cells=None,
+    vms=None,
+    layout=None,
+    index=0,
+    housekeeping=0,
+    iothreads=0,
+    disk_io=None,
+    net_queues=0,
+    llc=0,
+):
+    """
+    Compute parameters for one of several VMs sharing the host without overlapping resources.
+    The host topology is read from libvirt if cells is not provided.
+    """
+    if cells is None:
+        import virt_tuner.virt  # pylint: disable=import-outside-toplevel
+
+        cells = virt_tuner.virt.host_topology()
+    configs = partition_configs(
+        cells, vms, layout, housekeeping, iothreads, disk_io, net_queues, llc
+    )
+    if not 0 <= index < len(configs):
+        raise ValueError(
+            _("Virtual machine index has to be between 0 and {}").format(
+                len(configs) - 1
+            )
+        )
+    return configs[index]
+
+
+def realtime(
+    cells=None,
+    housekeeping=1,
+    iothreads=0,
+    disk_io=None,
+    net_queues=0,
+    llc=0,
+    priority=1,
+):
+    """
+    Compute parameters for a single realtime VM per host.
+    The virtual CPUs threads get the FIFO scheduler with the given priority and the
+    emulator threads stay on the housekeeping cores. The memory is locked and
+    nothing disturbs the guest: no performance monitoring unit nor memory balloon.
+    """
+    if housekeeping < 1:
+        raise ValueError(
+            _("The realtime template needs at least one housekeeping core per cell")
+        )
+    if not 1 <= priority <= 99:
+        raise ValueError(_("The realtime priority has to be between 1 and 99"))
+
+    # single() already adds the time spent to the template phase
+    config = single(cells, housekeeping, iothreads, disk_io, net_queues, llc)
+    vcpus = str(CpuSet(range(config["cpu"]["maximum"])))
+    config["cpu"]["tuning"]["vcpusched"] = {
+        vcpus: {"scheduler": "fifo", "priority": priority}
+    }
+    config["mem"]["locked"] = True
+    config["mem"]["balloon"] = False
+    config["hypervisor_features"]["pmu"] = False
+    return config
+
+
+def parse_parameters(template, values):
+    """
+    Convert the NAME=VALUE strings into the template function keyword arguments
+    """
+    parameters = {parameter.name: parameter for parameter in template.parameters}
+    kwargs = {parameter.name: parameter.default for parameter in template.parameters}
+    for value in values or []:
+        name, sep, raw_value = value.partition("=")
+        if not sep or name not in parameters:
+            raise ValueError(_("Invalid template parameter: ") + value)
+        kwargs[name] = parameters[name].type(raw_value)
+    return kwargs
+
+
+# Parameters of all the built-in templates
+COMMON_PARAMETERS = [
+    Parameter(
+        "housekeeping",
+        int,
+        _("number of cores per cell left for the emulator and I/O threads"),
+        0,
+    ),
+    Parameter("iothreads", int, _("number of I/O threads"), 0),
+    Parameter(
+        "disk_io",
+        str,
+        _("tune the local virtio disks with the native or io_uring I/O mode"),
+        None,
+    ),
+    Parameter(
+        "net_queues",
+        int,
+        _("maximum number of queues of the tuned virtio network interfaces"),
+        0,
+    ),
+    Parameter(
+        "llc",
+        float,
+        _("fraction of the last level caches and memory bandwidth to allocate"),
+        0,
+    ),
+]
+
+# Templates provided by virt-tuner itself
+builtin_templates = {
     "single": Template(
         _("Single virtual machine using almost all the host resources"),
         single,
-        [],
+        COMMON_PARAMETERS,
+    ),
+    "partition": Template(
+        _("Several virtual machines sharing the host NUMA cells without overlapping"),
+        partition,
+        [
+            Parameter(
+                "vms", int, _("number of virtual machines sharing the host"), None
+            ),
+            Parameter(
+                "layout",
+                str,
+                _("host cells of each virtual machine, like 0,1;2,3"),
+                None,
+            ),
+            Parameter("index", int, _("index of the virtual machine to tune"), 0),
+        ]
+        + COMMON_PARAMETERS,
+    ),
+    "realtime": Template(
+        _("Single realtime virtual machine for low latency workloads"),
+        realtime,
+        [
+            Parameter(
+                "housekeeping",
+                int,
+                _("number of cores per cell left for the emulator and I/O threads"),
+                1,
+            ),
+            Parameter(
+                "priority", int, _("FIFO priority of the virtual CPUs threads"), 1
+            ),
+        ]
+        + [
+            parameter
+            for parameter in COMMON_PARAMETERS
+            if parameter.name != "housekeeping"
+        ],
     ),
 }
+
+templates = registry.Registry(builtin_templates)
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+# Authors: Cedric Bosdonnat <cbosdonnat@suse.com>
+#
+# Copyright (C) 2021 SUSE, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Tune several virtual machine definitions in one run
+"""
+
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import logging
+import os
+import os.path
+from xml.etree import ElementTree
+
+import virt_tuner.xmlutil as xmlutil
+
+log = logging.getLogger(__name__)
+
+Result = namedtuple("Result", ["input", "output", "error"])
+
+
+def collect_inputs(paths):
+    """
+    Expand the input paths into the list of XML files to tune.
+    Directories are replaced by the *.xml files they contain.
+    """
+    inputs = []
+    for path in paths:
+        if os.path.isdir(path):
+            inputs.extend(
+                sorted(
+                    os.path.join(path, name)
+                    for name in os.listdir(path)
+                    if name.endswith(".xml")
+                    and os.path.isfile(os.path.join(path, name))
+                )
+            )
+        elif os.path.isfile(path):
+            inputs.append(path)
+        else:
+            raise ValueError(_("Input path has to point to a readable file: ") + path)
+    return inputs
+
+
+def output_paths(inputs, output_dir):
+    """
+    Compute the output path of each input file.
+    """
+    outputs = [os.path.join(output_dir, os.path.basename(path)) for path in inputs]
+    duplicates = {path for path in outputs if outputs.count(path) > 1}
+    if duplicates:
+        raise ValueError(
+            _("Several inputs would be written to: ") + ", ".join(sorted(duplicates))
+        )
+    return outputs
+
+
+def tune_file(input_path, output_path, plan):
+    """
+    Apply the merge plan on one definition file and write the result.
+    Errors are reported in the returned Result rather than raised.
+    """
+    try:
+        xmlutil.merge_file(input_path, output_path, plan)
+    except (OSError, ValueError, ElementTree.ParseError) as err:
+        return Result(input_path, output_path, str(err))
+    return Result(input_path, output_path, None)
+
+
+def tune_files(paths, plan, output_dir, jobs=None):
+    """
+    Apply the merge plan on the definitions found in paths using jobs processes.
+    Returns a list of Result in the order of the inputs.
+    """
+    inputs = collect_inputs(paths)
+    outputs = output_paths(inputs, output_dir)
+    os.makedirs(output_dir, exist_ok=True)
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [
+            executor.submit(tune_file, input_path, output_path, plan)
+            for input_path, output_path in zip(inputs, outputs)
+        ]
+        results = [future.result() for future in futures]
+
+    for result in results:
+        if result.error:
+            log.error("%s: %s", result.input, result.error)
+        else:
+            log.info("%s -> %s", result.input, result.output)
+    return results
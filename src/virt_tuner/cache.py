@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+# Authors: Cedric Bosdonnat <cbosdonnat@suse.com>
+#
+# Copyright (C) 2021 SUSE, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+On-disk cache of the host topology
+"""
+
+import glob
+import hashlib
+import json
+import logging
+import os
+import os.path
+import tempfile
+
+import virt_tuner.providers
+import virt_tuner.timings as timings
+from virt_tuner.topology import Cell
+
+log = logging.getLogger(__name__)
+
+BOOT_ID_FILE = "proc/sys/kernel/random/boot_id"
+
+# Files changing when CPUs, memory or huge pages are added or removed.
+# Globs are expanded relative to the root folder.
+FINGERPRINT_FILES = [
+    "sys/devices/system/cpu/online",
+    "sys/devices/system/node/online",
+    "sys/devices/system/node/has_memory",
+    "sys/devices/system/node/node*/meminfo",
+    "sys/devices/system/node/node*/hugepages/hugepages-*/nr_hugepages",
+    "sys/class/net/*/device/numa_node",
+]
+
+
+def fingerprint(root="/"):
+    """
+    Compute a fingerprint of the host resources changing on reboot or hotplug.
+    Returns None if the host doesn't provide a boot ID.
+    """
+    digest = hashlib.sha256()
+    try:
+        with open(os.path.join(root, BOOT_ID_FILE), "r") as file_handle:
+            digest.update(file_handle.read().encode())
+    except OSError:
+        return None
+
+    for pattern in FINGERPRINT_FILES:
+        for path in sorted(glob.glob(os.path.join(root, pattern))):
+            try:
+                with open(path, "r") as file_handle:
+                    content = file_handle.read()
+            except OSError:
+                continue
+            if path.endswith("meminfo"):
+                # Only the total changes on hotplug, the other values change all the time
+                content = "".join(
+                    line for line in content.splitlines() if "MemTotal" in line
+                )
+            digest.update(os.path.relpath(path, root).encode())
+            digest.update(content.encode())
+    return digest.hexdigest()
+
+
+def default_path():
+    """
+    Get the path of the cache file
+    """
+    cache_dir = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(cache_dir, "virt-tuner", "topology.json")
+
+
+def load(path, key):
+    """
+    Load the cells from the cache file if it has been stored with the same key.
+    Returns None if there is no matching cache entry.
+    """
+    try:
+        with open(path, "r") as file_handle:
+            data = json.load(file_handle)
+    except (OSError, ValueError):
+        return None
+
+    if data.get("fingerprint") != key:
+        return None
+
+    return [
+        Cell(
+            cell["id"],
+            cell["cpus"],
+            cell["memory"],
+            {int(k): v for k, v in cell["distances"].items()},
+            cell["pages"],
+            tuple(cell.get("nics", ())),
+            tuple(cell.get("caches", ())),
+            tuple(cell.get("bandwidth", ())),
+        )
+        for cell in data.get("cells", [])
+    ]
+
+
+def store(path, key, cells):
+    """
+    Store the cells in the cache file.
+    Failures to write the cache are logged but not fatal.
+    """
+    data = {"fingerprint": key, "cells": [cell._asdict() for cell in cells]}
+    tmp_path = None
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "w") as file_handle:
+            json.dump(data, file_handle)
+        os.replace(tmp_path, path)
+        tmp_path = None
+    except OSError as err:
+        log.warning(_("Failed to write topology cache: %s"), err)
+    finally:
+        # Never leave a partial temporary file when the cache wasn't replaced
+        if tmp_path is not None:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+
+
+def host_topology(provider="libvirt", refresh=False, path=None, root="/", uri=None):
+    """
+    Get the host topology from the provider or from the cache if it is still valid.
+    Setting refresh forces reading the topology from the provider and updating the cache.
+    The topology of hosts reached through a libvirt URI is not cached.
+    """
+    path = path or default_path()
+    key = fingerprint(root)
+    if key is None or uri:
+        return virt_tuner.providers.host_topology(provider, root, uri)
+    key = f"{provider}:{key}"
+
+    if not refresh:
+        cells = load(path, key)
+        if cells is not None:
+            log.debug("Using cached host topology from %s", path)
+            timings.count("topology_cache.hits")
+            return cells
+        timings.count("topology_cache.misses")
+
+    cells = virt_tuner.providers.host_topology(provider, root)
+    if cells:
+        store(path, key, cells)
+    return cells
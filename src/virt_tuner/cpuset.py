@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+# Authors: Cedric Bosdonnat <cbosdonnat@suse.com>
+#
+# Copyright (C) 2021 SUSE, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+CPU and NUMA node sets in the libvirt cpuset syntax, like "0-3,8,^2"
+"""
+
+import functools
+
+
+class CpuSet:
+    """
+    Set of CPU or NUMA node IDs stored as a bitmap.
+
+    Converting it to a string gives the libvirt cpuset syntax with the
+    consecutive IDs compressed into ranges.
+    """
+
+    __slots__ = ("bits",)
+
+    def __init__(self, ids=()):
+        bits = 0
+        for item in ids:
+            bits |= 1 << int(item)
+        self.bits = bits
+
+    @classmethod
+    def parse(cls, text):
+        """
+        Parse a cpuset string like "0-3,8,^2".
+        The exclusions apply to the IDs listed before them.
+        """
+        cpuset = cls()
+        for part in str(text).split(","):
+            part = part.strip()
+            exclude = part.startswith("^")
+            if exclude:
+                part = part[1:].strip()
+            first, sep, last = part.partition("-")
+            try:
+                first = int(first)
+                last = int(last) if sep else first
+            except ValueError:
+                raise ValueError(_("Invalid cpuset: ") + str(text)) from None
+            if first < 0 or last < first or (exclude and sep):
+                raise ValueError(_("Invalid cpuset: ") + str(text))
+            mask = ((1 << (last - first + 1)) - 1) << first
+            if exclude:
+                cpuset.bits &= ~mask
+            else:
+                cpuset.bits |= mask
+        return cpuset
+
+    def __iter__(self):
+        bits = self.bits
+        while bits:
+            lowest = bits & -bits
+            yield lowest.bit_length() - 1
+            bits ^= lowest
+
+    def __len__(self):
+        return bin(self.bits).count("1")
+
+    def __contains__(self, item):
+        return item >= 0 and bool(self.bits >> item & 1)
+
+    def __eq__(self, other):
+        return isinstance(other, CpuSet) and self.bits == other.bits
+
+    def __hash__(self):
+        return hash(self.bits)
+
+    def __or__(self, other):
+        result = CpuSet()
+        result.bits = self.bits | other.bits
+        return result
+
+    def __and__(self, other):
+        result = CpuSet()
+        result.bits = self.bits & other.bits
+        return result
+
+    def __sub__(self, other):
+        result = CpuSet()
+        result.bits = self.bits & ~other.bits
+        return result
+
+    def ranges(self):
+        """
+        Get the (first, last) tuples of the consecutive IDs
+        """
+        result = []
+        bits = self.bits
+        first = 0
+        while bits:
+            # Skip the unset bits, then count the set ones
+            shift = (bits & -bits).bit_length() - 1
+            bits >>= shift
+            first += shift
+            length = (bits ^ (bits + 1)).bit_length() - 1
+            result.append((first, first + length - 1))
+            bits >>= length
+            first += length
+        return result
+
+    def __str__(self):
+        return ",".join(
+            str(first) if first == last else f"{first}-{last}"
+            for first, last in self.ranges()
+        )
+
+    def __repr__(self):
+        return f"CpuSet('{self}')"
+
+
+@functools.lru_cache(maxsize=4096)
+def compress(text):
+    """
+    Get the shortest form of a cpuset string, or the string itself if it isn't a cpuset
+    """
+    # Most of the siblings lists are already compressed: "0,64"
+    items = text.split(",")
+    if all(item.isdecimal() for item in items):
+        ids = [int(item) for item in items]
+        if all(last > first + 1 for first, last in zip(ids, ids[1:])):
+            return text
+    try:
+        return str(CpuSet.parse(text))
+    except ValueError:
+        return text
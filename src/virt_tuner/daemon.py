@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+# Authors: Cedric Bosdonnat <cbosdonnat@suse.com>
+#
+# Copyright (C) 2021 SUSE, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Tuning daemon serving requests on a UNIX socket and its client.
+
+The requests and responses are JSON objects, one per line. A request has an
+action key, one of the keys of ACTIONS, and the parameters of the action:
+template, params as a list of NAME=VALUE strings, force to skip the checks
+of the configuration against the host before tuning, and definition. A response
+contains either the result of the action or an error message.
+"""
+
+import json
+import logging
+import os
+import signal
+import socket
+import socketserver
+import stat
+import threading
+from xml.etree import ElementTree
+
+import virt_tuner
+import virt_tuner.diff as diff
+import virt_tuner.validation as validation
+import virt_tuner.xmlutil as xmlutil
+
+log = logging.getLogger(__name__)
+
+
+def default_path():
+    """
+    Get the default path of the daemon socket
+    """
+    return os.path.join(os.environ.get("XDG_RUNTIME_DIR", "/run"), "virt-tuner.sock")
+
+
+class Server(socketserver.ThreadingUnixStreamServer):
+    """
+    Daemon keeping the host topology and the compiled templates in memory
+    """
+
+    daemon_threads = True
+
+    def __init__(self, path, topology, root=None):
+        """
+        Listen on the socket at path. topology is the function reading the host topology
+        and root the sysfs tree to read the free huge pages from.
+        """
+        self.topology = topology
+        self.root = root
+        self.cells = topology()
+        self.plans = {}
+        self.lock = threading.Lock()
+        super().__init__(path, Handler)
+
+    def server_bind(self):
+        """
+        Create the socket accessible to the user only from the start: other users
+        could connect between its creation and a chmod.
+        """
+        umask = os.umask(0o177)
+        try:
+            super().server_bind()
+        finally:
+            os.umask(umask)
+
+    def plan(self, template_name, params, check=False):
+        """
+        Get the merge plan of a template for the parameters, compiling it only once.
+        The configuration is checked against the host if check is set: the free
+        huge pages change over time, so the check isn't cached.
+        """
+        key = (template_name, tuple(params or []))
+        cached = self.plans.get(key)
+        if cached is None:
+            template = virt_tuner.templates.get(template_name)
+            if template is None:
+                raise ValueError(_("Unknown template: ") + str(template_name))
+            config = template.function(
+                self.cells, **virt_tuner.parse_parameters(template, params)
+            )
+            cached = (config, xmlutil.compile_config(config))
+            with self.lock:
+                self.plans[key] = cached
+        config, plan = cached
+        if check:
+            validation.validate(self.cells, config, root=self.root)
+        return plan
+
+    def refresh(self):
+        """
+        Read the host topology again and forget the compiled templates
+        """
+        cells = self.topology()
+        with self.lock:
+            self.cells = cells
+            self.plans = {}
+
+    def process(self, request):
+        """
+        Run the action of a request and return the response
+        """
+        if not isinstance(request, dict):
+            return {"error": _("The request has to be a JSON object")}
+        name = request.get("action", "tune")
+        action = ACTIONS.get(name) if isinstance(name, str) else None
+        if action is None:
+            return {"error": _("Unknown action: ") + str(request.get("action"))}
+        try:
+            return action(self, request)
+        except (ValueError, KeyError, ElementTree.ParseError) as err:
+            return {"error": str(err)}
+
+
+def field(request, name, kind, required=False):
+    """
+    Get a field of a request, raising a ValueError if it doesn't have the kind type.
+    The fields that aren't required may be missing or null.
+    """
+    value = request.get(name)
+    if value is None and not required:
+        return None
+    if not isinstance(value, kind):
+        raise ValueError(_("Invalid {} in the request").format(name))
+    return value
+
+
+def template_plan(server, request, check=False):
+    """
+    Get the merge plan of the template and parameters of a request
+    """
+    params = field(request, "params", list)
+    if params and not all(isinstance(param, str) for param in params):
+        raise ValueError(_("Invalid params in the request"))
+    return server.plan(field(request, "template", str), params, check)
+
+
+class Handler(socketserver.StreamRequestHandler):
+    """
+    Handler of the connections to the daemon socket
+    """
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+            except ValueError as err:
+                response = {"error": str(err)}
+            else:
+                response = self.server.process(request)
+            self.wfile.write(json.dumps(response).encode() + b"\n")
+            self.wfile.flush()
+
+
+def tune_action(server, request):
+    """
+    Tune the definition of the request, checking the host first unless forced
+    """
+    plan = template_plan(server, request, not field(request, "force", bool))
+    definition = field(request, "definition", str, required=True)
+    return {"definition": xmlutil.merge_plan(definition, plan).decode()}
+
+
+def diff_action(server, request):
+    """
+    Get the structural diff of the tuning sections of the request definition
+    """
+    plan = template_plan(server, request)
+    definition = field(request, "definition", str, required=True)
+    return {"diff": diff.diff_plan(definition, plan)}
+
+
+def plan_action(server, request):
+    """
+    Get the merge plan of the request template as JSON
+    """
+    plan = template_plan(server, request)
+    return {"plan": json.loads(xmlutil.plan_to_json(plan))}
+
+
+def refresh_action(server, request):  # pylint: disable=unused-argument
+    """
+    Read the host topology again
+    """
+    server.refresh()
+    return {}
+
+
+ACTIONS = {
+    "tune": tune_action,
+    "diff": diff_action,
+    "plan": plan_action,
+    "refresh": refresh_action,
+}
+
+
+def serve(path, topology, root=None):
+    """
+    Serve the tuning requests on the socket at path until interrupted.
+    root is the sysfs tree to read the free huge pages from.
+    """
+    # Only replace the socket of a previous daemon, not a file given by mistake
+    if os.path.lexists(path):
+        if not stat.S_ISSOCK(os.lstat(path).st_mode):
+            raise ValueError(_("{} exists and isn't a socket").format(path))
+        os.unlink(path)
+    # Stop on SIGTERM like on SIGINT to remove the socket
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    with Server(path, topology, root) as server:
+        log.info(_("Listening on %s"), path)
+        try:
+            server.serve_forever()
+        finally:
+            os.unlink(path)
+
+
+def call(path, payload):
+    """
+    Send a request to the daemon listening on the socket at path and return its response
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(path)
+        client.sendall(json.dumps(payload).encode() + b"\n")
+        with client.makefile("rb") as response:
+            return json.loads(response.readline())
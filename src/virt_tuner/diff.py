@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+# Authors: Cedric Bosdonnat <cbosdonnat@suse.com>
+#
+# Copyright (C) 2021 SUSE, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Change detection and structural diff of the tuning sections of a domain definition
+"""
+
+import copy
+import hashlib
+import json
+from xml.etree import ElementTree
+
+import virt_tuner.timings as timings
+from virt_tuner.cpuset import compress
+import virt_tuner.xmlutil as xmlutil
+
+# Children of the domain element that the templates may change
+TUNING_SECTIONS = [
+    "vcpu",
+    "iothreads",
+    "cpu",
+    "cputune",
+    "numatune",
+    "memoryBacking",
+    "clock",
+    "features",
+    "devices",
+]
+
+# Attributes identifying an element among its siblings with the same tag
+KEY_ATTRS = ["id", "vcpu", "cellid", "iothread", "name", "size"]
+
+# Attributes holding cpusets: "0,1,2,3" and "0-3" are the same value
+CPUSET_ATTRS = ["cpuset", "cpus", "nodeset", "vcpus"]
+
+
+def attributes(node):
+    """
+    Get the sorted attributes of a node with the cpusets in their shortest form
+    """
+    return sorted(
+        (name, compress(value) if name in CPUSET_ATTRS else value)
+        for name, value in node.attrib.items()
+    )
+
+
+def canonical(node):
+    """
+    Get a canonical form of a node ignoring the whitespaces, the attributes order
+    and the children order.
+    """
+    return [
+        node.tag,
+        attributes(node),
+        (node.text or "").strip(),
+        sorted((canonical(child) for child in node), key=json.dumps),
+    ]
+
+
+def tuning_sections(doc):
+    """
+    Get the tuning sections of a domain document
+    """
+    return [child for child in doc if child.tag in TUNING_SECTIONS]
+
+
+def tuning_hash(doc):
+    """
+    Compute a hash of the canonical form of the tuning sections of a domain document
+    """
+    sections = sorted(
+        (canonical(child) for child in tuning_sections(doc)), key=json.dumps
+    )
+    return hashlib.sha256(json.dumps(sections).encode()).hexdigest()
+
+
+def segments(nodes):
+    """
+    Get a dictionary of sibling nodes by their xmlutil path segment
+    """
+    result = {}
+    positions = {}
+    for node in nodes:
+        positions[node.tag] = positions.get(node.tag, 0) + 1
+        attr = next((attr for attr in KEY_ATTRS if attr in node.attrib), None)
+        segment = f"{node.tag}[@{attr}='{node.get(attr)}']" if attr else node.tag
+        if segment in result:
+            segment = f"{node.tag}[{positions[node.tag]}]"
+        result[segment] = node
+    return result
+
+
+def describe(node):
+    """
+    Get a compact one line description of a node attributes and text
+    """
+    items = [f"{name}='{value}'" for name, value in node.attrib.items()]
+    text = (node.text or "").strip()
+    if text:
+        items.append(f"'{text}'")
+    return " ".join(items)
+
+
+def diff_subtree(sign, node, path):
+    """
+    Get the diff lines of a node and its children added or removed as a whole
+    """
+    lines = [f"{sign} {path} {describe(node)}".rstrip()]
+    for segment, child in segments(node).items():
+        lines.extend(diff_subtree(sign, child, f"{path}/{segment}"))
+    return lines
+
+
+def diff_children(old_children, new_children, path):
+    """
+    Get the diff lines between two lists of sibling nodes
+    """
+    old = segments(old_children)
+    new = segments(new_children)
+    lines = []
+    for segment, old_child in old.items():
+        child_path = f"{path}/{segment}" if path else segment
+        if segment in new:
+            lines.extend(diff_nodes(old_child, new[segment], child_path))
+        else:
+            lines.extend(diff_subtree("-", old_child, child_path))
+    for segment, new_child in new.items():
+        if segment not in old:
+            child_path = f"{path}/{segment}" if path else segment
+            lines.extend(diff_subtree("+", new_child, child_path))
+    return lines
+
+
+def diff_nodes(old, new, path):
+    """
+    Get the diff lines between two nodes at the same path
+    """
+    lines = []
+    new_attributes = dict(attributes(new))
+    for name, value in attributes(old):
+        if name not in new.attrib:
+            lines.append(f"- {path}/@{name} '{old.get(name)}'")
+        elif new_attributes[name] != value:
+            lines.append(f"~ {path}/@{name} '{old.get(name)}' -> '{new.get(name)}'")
+    for name, value in new.attrib.items():
+        if name not in old.attrib:
+            lines.append(f"+ {path}/@{name} '{value}'")
+
+    old_text = (old.text or "").strip()
+    new_text = (new.text or "").strip()
+    if old_text != new_text:
+        lines.append(f"~ {path} '{old_text}' -> '{new_text}'")
+
+    return lines + diff_children(list(old), list(new), path)
+
+
+def diff_plan(def_in, plan):
+    """
+    Apply a merge plan on the input XML definition and compare the tuning sections.
+    Returns the diff lines, an empty list if the tuned definition wouldn't change.
+    """
+    with timings.phase("xml.parse"):
+        doc = ElementTree.fromstring(def_in)
+    before = copy.deepcopy(tuning_sections(doc))
+    old_hash = tuning_hash(doc)
+    with timings.phase("xml.apply"):
+        xmlutil.apply_plan(doc, plan)
+    if tuning_hash(doc) == old_hash:
+        return []
+    return diff_children(before, tuning_sections(doc), "")
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+# Authors: Cedric Bosdonnat <cbosdonnat@suse.com>
+#
+# Copyright (C) 2021 SUSE, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Offline tuning of definitions for many hosts described by their saved capabilities
+"""
+
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import logging
+import os
+import os.path
+from xml.etree import ElementTree
+
+import virt_tuner
+import virt_tuner.batch as batch
+import virt_tuner.validation as validation
+import virt_tuner.virt as virt
+import virt_tuner.xmlutil as xmlutil
+
+log = logging.getLogger(__name__)
+
+# Tuning results of a host. error is set if the template can't be satisfied on the host.
+HostResult = namedtuple("HostResult", ["host", "results", "error"])
+
+
+def collect_hosts(path):
+    """
+    Get the (host, capabilities path) of a capabilities file or of the *.xml files
+    of a directory. The host name is the file name without the .xml extension.
+    """
+    if os.path.isdir(path):
+        paths = batch.collect_inputs([path])
+    elif os.path.isfile(path):
+        paths = [path]
+    else:
+        raise ValueError(
+            _("Capabilities path has to point to a readable file: ") + path
+        )
+    return [
+        (os.path.splitext(os.path.basename(caps_path))[0], caps_path)
+        for caps_path in paths
+    ]
+
+
+def host_plan(caps_path, template_name, params, force=False):
+    """
+    Compute the merge plan of a template for the host described by a capabilities file.
+    The configuration is checked against the host unless force is set.
+    """
+    with open(caps_path, "rb") as file_handle:
+        cells = virt.parse_capabilities(file_handle.read())
+    template = virt_tuner.templates[template_name]
+    config = template.function(cells, **virt_tuner.parse_parameters(template, params))
+    if not force:
+        validation.validate(cells, config)
+    return xmlutil.compile_config(config)
+
+
+def tune_host(host, caps_path, template_name, params, inputs, output_dir, force=False):
+    """
+    Tune the inputs for one host and write them in the host folder of output_dir.
+    Errors are reported in the returned HostResult rather than raised.
+    """
+    try:
+        plan = host_plan(caps_path, template_name, params, force)
+        host_dir = os.path.join(output_dir, host)
+        os.makedirs(host_dir, exist_ok=True)
+    except (OSError, ValueError, ElementTree.ParseError) as err:
+        return HostResult(host, [], str(err))
+    # Any failure of a template or of odd capabilities only fails this host
+    except Exception as err:  # pylint: disable=broad-except
+        return HostResult(host, [], f"{type(err).__name__}: {err}")
+    return HostResult(
+        host,
+        [
+            batch.tune_file(input_path, output_path, plan)
+            for input_path, output_path in zip(
+                inputs, batch.output_paths(inputs, host_dir)
+            )
+        ],
+        None,
+    )
+
+
+def tune_fleet(
+    capabilities, paths, template_name, params, output_dir, jobs=None, force=False
+):
+    """
+    Tune the definitions found in paths for each host found in the capabilities path,
+    using jobs processes. The tuned definitions are written in output_dir/HOST/.
+    The hosts that can't honour the configuration fail unless force is set.
+    Returns a list of HostResult in the order of the hosts.
+    """
+    hosts = collect_hosts(capabilities)
+    inputs = batch.collect_inputs(paths)
+    batch.output_paths(inputs, output_dir)
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [
+            executor.submit(
+                tune_host,
+                host,
+                caps_path,
+                template_name,
+                params,
+                inputs,
+                output_dir,
+                force,
+            )
+            for host, caps_path in hosts
+        ]
+        return [future.result() for future in futures]
+
+
+def summary(host_results):
+    """
+    Get the lines of the summary of a fleet tuning, listing the failures
+    """
+    failed = [result for result in host_results if result.error]
+    lines = [
+        _("Tuned hosts: {}, failed hosts: {}").format(
+            len(host_results) - len(failed), len(failed)
+        )
+    ]
+    lines.extend(f"  {result.host}: {result.error}" for result in failed)
+    for host_result in host_results:
+        lines.extend(
+            f"  {host_result.host}: {result.input}: {result.error}"
+            for result in host_result.results
+            if result.error
+        )
+    return lines
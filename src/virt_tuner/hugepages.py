@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+# Authors: Cedric Bosdonnat <cbosdonnat@suse.com>
+#
+# Copyright (C) 2021 SUSE, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Planning and reservation of the huge pages needed by a tuned configuration
+"""
+
+from collections import namedtuple
+import logging
+import os.path
+
+import virt_tuner.sysfs as sysfs
+from virt_tuner.cpuset import CpuSet
+
+log = logging.getLogger(__name__)
+
+# Per host node status of the huge pages of one size.
+# size is in KiB, the other values are page counts.
+Reservation = namedtuple(
+    "Reservation", ["node", "size", "requested", "reserved", "free", "missing"]
+)
+
+# Size of the libvirt memory units in KiB
+UNITS = {
+    "b": 1 / 1024,
+    "bytes": 1 / 1024,
+    "KB": 1000 / 1024,
+    "k": 1,
+    "K": 1,
+    "KiB": 1,
+    "MB": 1000**2 / 1024,
+    "M": 1024,
+    "MiB": 1024,
+    "GB": 1000**3 / 1024,
+    "G": 1024**2,
+    "GiB": 1024**2,
+    "TB": 1000**4 / 1024,
+    "T": 1024**3,
+    "TiB": 1024**3,
+}
+
+
+def to_kib(value):
+    """
+    Convert a memory value like "1 G" into KiB
+    """
+    amount, unit = value.split(" ")
+    if unit not in UNITS:
+        raise ValueError(_("Unknown memory unit: ") + unit)
+    return int(float(amount) * UNITS[unit])
+
+
+def requested_pages(config):
+    """
+    Compute the number of huge pages requested per host node by a configuration.
+    Returns the page size in KiB and a dictionary of the page counts by node ID.
+    The pages of a guest cell interleaved on several nodes are split evenly.
+    """
+    hugepages = config.get("mem", {}).get("hugepages", [])
+    if not hugepages:
+        return None, {}
+    size = to_kib(hugepages[0]["size"])
+
+    memnodes = config.get("numatune", {}).get("memnodes", {})
+    requested = {}
+    for cell_id, cell in config.get("cpu", {}).get("numa", {}).items():
+        memory = cell.get("memory")
+        nodeset = memnodes.get(cell_id, {}).get("nodeset", cell_id)
+        if memory is None:
+            continue
+        nodes = list(CpuSet.parse(str(nodeset)))
+        share, remainder = divmod(-(-to_kib(memory) // size), len(nodes))
+        for index, node in enumerate(nodes):
+            pages = share + (1 if index < remainder else 0)
+            requested[node] = requested.get(node, 0) + pages
+    return size, requested
+
+
+def counter_path(node, size, name):
+    """
+    Get the path of one of the huge pages counters of a node relative to the sysfs root
+    """
+    return os.path.join(
+        sysfs.NODE_DIR, f"node{node}", "hugepages", f"hugepages-{size}kB", name
+    )
+
+
+def read_count(root, node, size, name):
+    """
+    Read one of the huge pages counters of a node from sysfs.
+    Returns None if the file doesn't exist.
+    """
+    value = sysfs.read(root, counter_path(node, size, name))
+    return None if value is None else int(value)
+
+
+def plan(cells, config, root="/"):
+    """
+    Compare the huge pages requested by the configuration with the free ones.
+    The counters are read from the sysfs tree under root if available and
+    from the cells pages otherwise, all the reserved pages being free then.
+    No sysfs tree is read if root is None.
+    Returns a list of Reservation, one per node used by the configuration.
+    """
+    size, requested = requested_pages(config)
+    cells_by_id = {cell.id: cell for cell in cells}
+    reservations = []
+    for node, count in sorted(requested.items()):
+        cell = cells_by_id.get(node)
+        cell_count = 0
+        if cell is not None:
+            cell_count = sum(
+                page["count"] for page in cell.pages if to_kib(page["size"]) == size
+            )
+        reserved = free = None
+        if root is not None:
+            reserved = read_count(root, node, size, "nr_hugepages")
+            free = read_count(root, node, size, "free_hugepages")
+        reserved = cell_count if reserved is None else reserved
+        free = reserved if free is None else free
+        reservations.append(
+            Reservation(node, size, count, reserved, free, max(count - free, 0))
+        )
+    return reservations
+
+
+def reserve(reservations, root="/"):
+    """
+    Reserve the missing huge pages by writing the per node sysfs files.
+    The kernel may not be able to allocate all of them if the memory is fragmented:
+    returns the list of Reservation still missing pages after the update.
+    """
+    failed = []
+    for item in reservations:
+        if not item.missing:
+            continue
+        path = os.path.join(root, counter_path(item.node, item.size, "nr_hugepages"))
+        log.info(
+            _("Reserving %d pages of %d KiB on node %d"),
+            item.missing,
+            item.size,
+            item.node,
+        )
+        with open(path, "w") as file_handle:
+            file_handle.write(str(item.reserved + item.missing))
+
+        # A counter that can't be read back counts as no page reserved at all
+        reserved = read_count(root, item.node, item.size, "nr_hugepages") or 0
+        if reserved < item.reserved + item.missing:
+            failed.append(
+                item._replace(missing=item.reserved + item.missing - reserved)
+            )
+    return failed
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+# Authors: Cedric Bosdonnat <cbosdonnat@suse.com>
+#
+# Copyright (C) 2021 SUSE, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Deferred loading of the modules that are slow to import
+"""
+
+import importlib.util
+import sys
+import types
+
+
+class MissingModule(types.ModuleType):
+    """
+    Placeholder of a module that isn't installed.
+    Accessing any of its attributes raises ModuleNotFoundError.
+    """
+
+    def __getattr__(self, attr):
+        raise ModuleNotFoundError(
+            f"No module named '{self.__name__}'", name=self.__name__
+        )
+
+
+def lazy_import(name):
+    """
+    Get a module that is only executed when one of its attributes is first accessed.
+    A missing module only fails when one of its attributes is accessed too.
+
+    The first access has to happen before the module is shared between threads:
+    the loading itself is not thread safe.
+    """
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        return MissingModule(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
@@ -18,15 +18,22 @@
 
 """
 Main entry point of the CLI tool
+
+The modules only needed to tune are imported in the functions using them
+to keep --help, --version and the templates list fast.
 """
 
+# pylint: disable=import-outside-toplevel
+
 import argparse
+import json
 import logging
 import os.path
 import sys
 
 import virt_tuner
-import virt_tuner.xmlutil as xmlutil
+import virt_tuner.providers as providers
+import virt_tuner.timings as timings
 
 logger = logging.getLogger("virt_tuner.main")
 
@@ -59,9 +66,273 @@ def list_templates():
     buf = _("templates:\n")
     for name, template in virt_tuner.templates.items():
         buf += f" - {name}: {template.description}\n"
+        # Don't import the plugins just to list their parameters
+        if not getattr(template, "loaded", True):
+            continue
+        for parameter in template.parameters:
+            buf += f"     {parameter.name}: {parameter.description}\n"
     return buf
 
 
+def host_topology(args):
+    """
+    Get the host topology, using the cache unless disabled in the arguments
+    """
+    if args.no_cache:
+        return providers.host_topology(args.topology, args.sysfs_root, args.connect)
+
+    import virt_tuner.cache as cache
+
+    return cache.host_topology(
+        args.topology,
+        refresh=args.refresh_topology,
+        root=args.sysfs_root,
+        uri=args.connect,
+    )
+
+
+def error_code(args):
+    """
+    Get the exit code of a failed run: with --diff and --check, 1 means that
+    definitions would be changed.
+    """
+    return 2 if args is not None and (args.diff or args.check) else 1
+
+
+def check_inputs(args):
+    """
+    Check the consistency of the inputs and outputs arguments.
+    Returns an error message or None if the arguments are fine.
+    """
+    if args.capabilities:
+        if args.socket or args.apply or args.hugepages or args.dump_plan:
+            return _(
+                "--capabilities can't be used with --socket, --apply, --hugepages "
+                "or --dump-plan"
+            )
+        if args.diff or args.check or args.output or not args.output_dir:
+            return _("--capabilities requires --output-dir")
+
+    if args.connect and args.hugepages:
+        return _("--hugepages can't be used with --connect: it uses the local sysfs")
+
+    if args.socket and (args.apply or args.output_dir or args.hugepages):
+        return _("--socket can't be used with --apply, --output-dir or --hugepages")
+
+    if args.apply:
+        if args.output or args.output_dir:
+            return _("--apply can't be used with --output or --output-dir")
+        if args.diff or args.check:
+            return _("--apply can't be used with --diff or --check")
+        return None
+
+    if args.diff or args.check:
+        if args.output or args.output_dir:
+            return _("--diff and --check can't be used with --output or --output-dir")
+        return None
+
+    if args.output_dir:
+        if args.output:
+            return _("--output and --output-dir can't be used together")
+        if "-" in args.input:
+            return _("Standard input can't be used with --output-dir")
+        return None
+
+    if len(args.input) > 1 or args.input and os.path.isdir(args.input[0]):
+        return _("Several definitions can only be tuned with --output-dir")
+    if args.input and args.input[0] != "-" and not os.path.isfile(args.input[0]):
+        return _("Input path has to point to a readable file")
+    return None
+
+
+def check_hugepages(args, cells, config):
+    """
+    Check or reserve the huge pages needed by the configuration depending on the arguments.
+    Returns False if some pages are still missing.
+    """
+    import virt_tuner.hugepages as hugepages
+
+    reservations = hugepages.plan(cells, config, args.sysfs_root)
+    if args.hugepages == "reserve":
+        reservations = hugepages.reserve(reservations, args.sysfs_root)
+
+    missing = [item for item in reservations if item.missing]
+    for item in missing:
+        logging.error(
+            _("Node %d misses %d pages of %d KiB: %d requested, %d free"),
+            item.node,
+            item.missing,
+            item.size,
+            item.requested,
+            item.free,
+        )
+    return not missing
+
+
+def check_config(args, cells, config):
+    """
+    Check that the host can honour the configuration unless forced by the arguments.
+    The huge pages are checked separately if requested in the arguments and
+    against the free pages of the local sysfs tree otherwise, or the reserved
+    ones of a remote host.
+    Returns False if some problems were found.
+    """
+    if args.force:
+        return True
+    import virt_tuner.validation as validation
+
+    root = None if args.connect else args.sysfs_root
+    problems = validation.check(cells, config, pages=not args.hugepages, root=root)
+    for problem in problems:
+        logging.error(problem)
+    return not problems
+
+
+def read_input(path):
+    """
+    Read a definition from a file or from the standard input if path is -
+    """
+    if path == "-":
+        return sys.stdin.buffer.read()
+    with open(path, "rb") as file_handle:
+        return file_handle.read()
+
+
+def check_changes(args, diff_fn):
+    """
+    Compare the tuning sections of the inputs with the tuned ones and print
+    the structural diff of the changed inputs if requested.
+    diff_fn computes the diff lines of a definition.
+    Returns 1 if at least one input would be changed.
+    """
+    import virt_tuner.batch as batch
+
+    inputs = ["-"] if args.input == ["-"] else batch.collect_inputs(args.input)
+    changed = False
+    for input_path in inputs:
+        lines = diff_fn(read_input(input_path))
+        changed = changed or bool(lines)
+        if lines and args.diff:
+            print("\n".join([f"--- {input_path}"] + lines))
+    return 1 if changed else 0
+
+
+def tune(args):
+    """
+    Compute the template configuration and apply it on the inputs
+    """
+    import virt_tuner.batch as batch
+    import virt_tuner.diff as diff
+    import virt_tuner.virt
+    import virt_tuner.xmlutil as xmlutil
+
+    if args.capabilities:
+        return tune_fleet(args)
+
+    template = virt_tuner.templates[args.template]
+    cells = host_topology(args)
+    new_config = template.function(
+        cells, **virt_tuner.parse_parameters(template, args.param)
+    )
+
+    plan = xmlutil.compile_config(new_config)
+
+    if args.dump_plan:
+        print(xmlutil.plan_to_json(plan))
+        return 0
+
+    if args.diff or args.check:
+        return check_changes(args, lambda definition: diff.diff_plan(definition, plan))
+
+    # Only check the host before writing or applying the definitions
+    if not check_config(args, cells, new_config):
+        return 1
+
+    if args.hugepages and not check_hugepages(args, cells, new_config):
+        return 1
+
+    if args.apply:
+        results = virt_tuner.virt.apply_plan(args.input, plan, args.connect, args.jobs)
+        return 1 if any(result.error for result in results) else 0
+
+    if args.output_dir:
+        results = batch.tune_files(args.input, plan, args.output_dir, args.jobs)
+        return 1 if any(result.error for result in results) else 0
+
+    # Update the VM here!
+    input_file = sys.stdin.buffer if args.input[0] == "-" else args.input[0]
+    if args.output:
+        xmlutil.merge_file(input_file, args.output, plan)
+    else:
+        xmlutil.merge_stream(input_file, sys.stdout.buffer, plan)
+        sys.stdout.buffer.flush()
+
+    return 0
+
+
+def tune_fleet(args):
+    """
+    Tune the inputs for each host of the capabilities path and print the summary
+    """
+    import virt_tuner.fleet as fleet
+
+    host_results = fleet.tune_fleet(
+        args.capabilities,
+        args.input,
+        args.template,
+        args.param or [],
+        args.output_dir,
+        args.jobs,
+        args.force,
+    )
+    print("\n".join(fleet.summary(host_results)))
+    failed = [
+        host_result
+        for host_result in host_results
+        if host_result.error or any(result.error for result in host_result.results)
+    ]
+    return 1 if failed else 0
+
+
+def forward(args):
+    """
+    Forward the tuning request to the daemon listening on the socket of the arguments
+    """
+    import virt_tuner.daemon as daemon
+    import virt_tuner.xmlutil as xmlutil
+
+    def send(action, definition=None):
+        response = daemon.call(
+            args.socket,
+            {
+                "action": action,
+                "template": args.template,
+                "params": args.param or [],
+                "force": args.force,
+                "definition": definition.decode() if definition else None,
+            },
+        )
+        if "error" in response:
+            raise ValueError(response["error"])
+        return response
+
+    if args.dump_plan:
+        print(json.dumps(send("plan")["plan"], indent=2))
+        return 0
+
+    if args.diff or args.check:
+        return check_changes(args, lambda definition: send("diff", definition)["diff"])
+
+    tuned = send("tune", read_input(args.input[0]))["definition"].encode() + b"\n"
+    if args.output:
+        with xmlutil.atomic_output(args.output) as output:
+            output.write(tuned)
+    else:
+        sys.stdout.buffer.write(tuned)
+        sys.stdout.buffer.flush()
+    return 0
+
+
 def cli(argv):
     """
     CLI tool main function.
@@ -91,47 +362,200 @@ def cli(argv):
 
     parser.add_argument(
         "--template",
-        required=True,
-        choices=virt_tuner.templates.keys(),
         help=_("the template to apply to tune the virtual machine."),
     )
+    parser.add_argument(
+        "-p",
+        "--param",
+        action="append",
+        metavar="NAME=VALUE",
+        help=_("set a template parameter. Can be repeated."),
+    )
+    parser.add_argument(
+        "-c",
+        "--connect",
+        metavar="URI",
+        help=_("libvirt connection URI to use for the host topology and --apply."),
+    )
+    parser.add_argument(
+        "--topology",
+        default="libvirt",
+        choices=providers.providers.keys(),
+        help=_("where to read the host topology from."),
+    )
+    parser.add_argument(
+        "--sysfs-root",
+        default="/",
+        help=_("folder containing the sys and proc trees to read instead of /."),
+    )
+    parser.add_argument(
+        "--capabilities",
+        metavar="PATH",
+        help=_(
+            "tune for the hosts described by saved libvirt capabilities instead of "
+            "the local one: a file or a directory with one HOST.xml file per host. "
+            "The definitions are written in OUTPUT_DIR/HOST/."
+        ),
+    )
+    parser.add_argument(
+        "--hugepages",
+        choices=["check", "reserve"],
+        help=_(
+            "check that enough huge pages are free on each host node "
+            "or reserve the missing ones."
+        ),
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help=_(
+            "tune even if the host can't honour the template configuration, "
+            "for instance without the huge pages it needs."
+        ),
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help=_("read the host topology without using the cache."),
+    )
+    parser.add_argument(
+        "--refresh-topology",
+        action="store_true",
+        help=_("read the host topology and update the cache."),
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        help=_("file where to write the tuned definition instead of standard output."),
+    )
+    parser.add_argument(
+        "--output-dir",
+        help=_(
+            "directory where to write the tuned definitions. "
+            "Required when tuning several definitions or a directory."
+        ),
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        help=_("number of parallel processes used to tune several definitions."),
+    )
+    parser.add_argument(
+        "--apply",
+        action="store_true",
+        help=_(
+            "tune and redefine the libvirt domains named by the inputs "
+            "instead of reading XML files."
+        ),
+    )
+    parser.add_argument(
+        "--dump-plan",
+        action="store_true",
+        help=_(
+            "print the merge operations computed from the template as JSON and exit."
+        ),
+    )
+    parser.add_argument(
+        "--diff",
+        action="store_true",
+        help=_(
+            "print the changes to the tuning sections of the inputs instead of the tuned "
+            "definitions. Exits with 1 if an input would be changed."
+        ),
+    )
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help=_(
+            "like --diff, but only set the exit code: 1 if a definition would be "
+            "changed, 2 on errors."
+        ),
+    )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help=_(
+            "serve the tuning requests on a UNIX socket, keeping the host topology "
+            "and the compiled templates in memory."
+        ),
+    )
+    parser.add_argument(
+        "--socket",
+        metavar="PATH",
+        help=_(
+            "path of the daemon socket. Without --daemon, the tuning is forwarded "
+            "to the daemon listening on it."
+        ),
+    )
+    parser.add_argument(
+        "--timings",
+        action="store_true",
+        help=_(
+            "print the duration of the tuning phases and some counters "
+            "as JSON on standard error."
+        ),
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="FILE",
+        help=_("profile the run with cProfile and write the stats to FILE."),
+    )
     parser.add_argument(
         "input",
         metavar="INPUT_PATH",
-        help="path to virtual machine XML to tune or '-' to read it from standard input",
+        nargs="*",
+        help=_(
+            "path to virtual machine XML to tune, directory containing XML definitions, "
+            "'-' to read it from standard input or domain name or UUID with --apply"
+        ),
     )
 
+    args = None
     try:
         args = parser.parse_args(argv)
 
         # Configure logging lovel/format
         set_logging_conf(args.loglevel)
 
+        if args.daemon:
+            import virt_tuner.daemon as daemon
+
+            daemon.serve(
+                args.socket or daemon.default_path(),
+                lambda: host_topology(args),
+                None if args.connect else args.sysfs_root,
+            )
+            return 0
+
         if not args.template or args.template not in virt_tuner.templates:
             if args.template:
                 logging.error(_("Unknown template: " + args.template))
             print(list_templates())
-            return 1
+            return error_code(args)
 
-        # Update the VM here!
-        if args.input == "-":
-            definition = sys.stdin.read()
-        elif os.path.isfile(args.input):
-            with open(args.input, "r") as file_handle:
-                definition = file_handle.read()
-        else:
-            logging.error(_("Input path has to point to a readable file"))
-            return 1
+        if not args.input and not args.dump_plan:
+            parser.error(_("the following arguments are required: INPUT_PATH"))
 
-        new_config = virt_tuner.templates[args.template].function()
-        print(xmlutil.merge_config(definition, new_config).decode())
+        error = check_inputs(args)
+        if error:
+            logging.error(error)
+            return error_code(args)
 
-        return 0
+        if args.timings:
+            timings.enable()
+
+        with timings.profile(args.profile):
+            return forward(args) if args.socket else tune(args)
     except KeyboardInterrupt:
         return 0
-    except ValueError as err:
+    # ElementTree.ParseError is a SyntaxError: no need to import ElementTree to catch it
+    except (ValueError, OSError, SyntaxError) as err:
         logging.error(err)
-        return 1
+        return error_code(args)
+    finally:
+        if timings.ENABLED:
+            timings.report()
 
 
 def main():
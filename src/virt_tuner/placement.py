@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+# Authors: Cedric Bosdonnat <cbosdonnat@suse.com>
+#
+# Copyright (C) 2021 SUSE, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Memory policy of the guest NUMA cells chosen from the host NUMA distances.
+
+The host cells whose distance is at most CLOSE_RATIO times the local distance
+form a cluster, like the sub-NUMA clusters (SNC) of a socket or a CXL memory
+expander attached to it. A guest cell backed by a sub-NUMA cluster interleaves
+its memory on the cells of the cluster having CPUs, like the whole socket
+would. Otherwise it is bound strictly to its host cell if its memory fits
+there and prefers it if not.
+
+The host cells without CPUs, like the CXL memory expanders, back guest cells
+without virtual CPUs preferring them: the guest sees the far memory as a
+separate NUMA node, like the host does.
+"""
+
+from collections import namedtuple
+import logging
+
+from virt_tuner.cpuset import CpuSet
+
+log = logging.getLogger(__name__)
+
+# Maximum ratio between the distance of two close cells and the local distance
+CLOSE_RATIO = 1.5
+
+# Distance of a cell to itself when the host doesn't report it
+LOCAL_DISTANCE = 10
+
+Policy = namedtuple("Policy", ["mode", "nodes", "reason"])
+
+
+def distances(cell):
+    """
+    Get the distances of a cell to the other cells by integer cell ID
+    """
+    return {int(cell_id): int(value) for cell_id, value in cell.distances.items()}
+
+
+def is_close(cell, other, ratio=CLOSE_RATIO, table=None):
+    """
+    Check whether two cells are close to each other in both directions.
+    table maps the cell IDs to their distances if already computed.
+    """
+    cell_distances = table[cell.id] if table else distances(cell)
+    other_distances = table[other.id] if table else distances(other)
+    if other.id not in cell_distances or cell.id not in other_distances:
+        return False
+    return (
+        max(
+            cell_distances[other.id] / cell_distances.get(cell.id, LOCAL_DISTANCE),
+            other_distances[cell.id] / other_distances.get(other.id, LOCAL_DISTANCE),
+        )
+        <= ratio
+    )
+
+
+def clusters(cells, ratio=CLOSE_RATIO):
+    """
+    Group the cells connected by close distances.
+    The cells without CPUs join the cluster of a close cell but don't connect
+    the cells close to them: a memory expander shared by two sockets doesn't
+    make them a cluster.
+    Returns the sorted lists of the cell IDs of each cluster.
+    """
+    table = {cell.id: distances(cell) for cell in cells}
+    remaining = sorted(cells, key=lambda cell: (not cell.cpus, cell.id))
+    result = []
+    while remaining:
+        cluster = [remaining.pop(0)]
+        for cell in cluster:
+            if not cell.cpus and len(cluster) > 1:
+                continue
+            close = [
+                other for other in remaining if is_close(cell, other, ratio, table)
+            ]
+            remaining = [other for other in remaining if other not in close]
+            cluster.extend(close)
+        result.append(sorted(cell.id for cell in cluster))
+    return result
+
+
+def gib(memory):
+    """
+    Format an amount of KiB in GiB for the explanations
+    """
+    return "{:g} GiB".format(round(memory / 1024**2, 1))
+
+
+def choose(cells, cell, memory, ratio=CLOSE_RATIO, groups=None):
+    """
+    Choose the memory policy of a guest cell needing memory KiB and running on
+    the host cell. cells are the host cells the guest may allocate memory on
+    and groups their clusters if already computed.
+    """
+    if not cell.cpus:
+        return Policy(
+            "preferred",
+            CpuSet([cell.id]),
+            _("host cell {} has no CPUs, prefer its far memory for the {}").format(
+                cell.id, gib(memory)
+            ),
+        )
+
+    if groups is None:
+        groups = clusters(cells, ratio)
+    cluster_ids = next((ids for ids in groups if cell.id in ids), [cell.id])
+    sub_nodes = CpuSet(
+        other.id for other in cells if other.id in cluster_ids and other.cpus
+    )
+    if len(sub_nodes) > 1:
+        return Policy(
+            "interleave",
+            sub_nodes,
+            _("host cell {} is a sub-NUMA cluster, spread the {} on cells {}").format(
+                cell.id, gib(memory), sub_nodes
+            ),
+        )
+
+    if memory <= cell.memory:
+        return Policy(
+            "strict",
+            CpuSet([cell.id]),
+            _("the {} fit in host cell {}").format(gib(memory), cell.id),
+        )
+    return Policy(
+        "preferred",
+        CpuSet([cell.id]),
+        _("the {} exceed host cell {}, the other cells provide the rest").format(
+            gib(memory), cell.id
+        ),
+    )
+
+
+def numatune(policies):
+    """
+    Compute the numatune configuration from the policy of each guest cell ID.
+    The global policy is strict only if all cells are: otherwise it would keep
+    the guest memory away from the other cells.
+    """
+    nodes = CpuSet()
+    for guest_id, policy in policies.items():
+        log.log(
+            logging.DEBUG if policy.mode == "strict" else logging.INFO,
+            _("Guest cell %s memory is %s on host cells %s: %s"),
+            guest_id,
+            policy.mode,
+            policy.nodes,
+            policy.reason,
+        )
+        nodes |= policy.nodes
+    strict = all(policy.mode == "strict" for policy in policies.values())
+    return {
+        "memory": {
+            "mode": "strict" if strict else "interleave",
+            "nodeset": str(nodes),
+        },
+        "memnodes": {
+            guest_id: {"mode": policy.mode, "nodeset": str(policy.nodes)}
+            for guest_id, policy in policies.items()
+        },
+    }
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+# Authors: Cedric Bosdonnat <cbosdonnat@suse.com>
+#
+# Copyright (C) 2021 SUSE, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Host topology providers
+"""
+
+from collections import namedtuple
+
+Provider = namedtuple("Provider", ["description", "function"])
+
+
+def libvirt_topology(root="/", uri=None):  # pylint: disable=unused-argument
+    """
+    Get the host topology from libvirt. The root folder is not used.
+    """
+    import virt_tuner.virt  # pylint: disable=import-outside-toplevel
+
+    return virt_tuner.virt.host_topology(uri)
+
+
+def sysfs_topology(root="/", uri=None):  # pylint: disable=unused-argument
+    """
+    Get the host topology from sysfs. The libvirt URI is not used.
+    """
+    import virt_tuner.sysfs  # pylint: disable=import-outside-toplevel
+
+    return virt_tuner.sysfs.host_topology(root)
+
+
+providers = {
+    "libvirt": Provider(
+        _("Read the topology from the libvirt host capabilities"),
+        libvirt_topology,
+    ),
+    "sysfs": Provider(
+        _("Read the topology from sysfs, without libvirt"),
+        sysfs_topology,
+    ),
+}
+
+
+def host_topology(provider="libvirt", root="/", uri=None):
+    """
+    Get the host topology using the named provider.
+    root is the folder containing the sys tree to read and uri the libvirt connection URI.
+    """
+    if provider not in providers:
+        raise ValueError(_("Unknown topology provider: ") + provider)
+    return providers[provider].function(root=root, uri=uri)
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+# Authors: Cedric Bosdonnat <cbosdonnat@suse.com>
+#
+# Copyright (C) 2021 SUSE, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Registry of the templates provided by virt-tuner and by plugins.
+
+A plugin is a python module defining a TEMPLATE attribute: either a
+virt_tuner.Template or the template function. The first line of the
+module docstring is the template description. Plugins are found in
+the TEMPLATES_DIR folder, named after the template, and in the
+ENTRY_POINT_GROUP entry points. They are only imported when used.
+"""
+
+import ast
+import collections.abc
+import importlib.util
+import logging
+import os
+import os.path
+
+log = logging.getLogger(__name__)
+
+ENTRY_POINT_GROUP = "virt_tuner.templates"
+TEMPLATES_DIR = os.environ.get("VIRT_TUNER_TEMPLATES_DIR", "/etc/virt-tuner/templates")
+
+
+def module_description(path):
+    """
+    Get the first line of the docstring of a python source file without importing it
+    """
+    try:
+        with open(path, "r") as file_handle:
+            docstring = ast.get_docstring(ast.parse(file_handle.read()))
+    except (OSError, SyntaxError, ValueError) as err:
+        log.debug("Failed to read the description in %s: %s", path, err)
+        return ""
+    return (docstring or "").strip().split("\n")[0]
+
+
+class LazyTemplate:
+    """
+    Template of a plugin, imported when its function or parameters are first needed
+    """
+
+    def __init__(self, description, loader):
+        """
+        loader is the function importing the plugin and returning its TEMPLATE attribute
+        """
+        self.description = description
+        self._loader = loader
+        self._template = None
+
+    @property
+    def loaded(self):
+        """
+        Whether the plugin has already been imported
+        """
+        return self._template is not None
+
+    def load(self):
+        """
+        Import the plugin if needed and return its function and parameters
+        """
+        if self._template is None:
+            try:
+                value = self._loader()
+            except Exception as err:  # pylint: disable=broad-except
+                raise ValueError(_("Failed to load template: ") + str(err)) from err
+            function = getattr(value, "function", value)
+            if not callable(function):
+                raise ValueError(_("Invalid template: ") + repr(value))
+            self._template = (function, list(getattr(value, "parameters", [])))
+        return self._template
+
+    @property
+    def function(self):
+        """
+        Template function computing the configuration
+        """
+        return self.load()[0]
+
+    @property
+    def parameters(self):
+        """
+        Parameters of the template function
+        """
+        return self.load()[1]
+
+
+def file_template(path):
+    """
+    Create the lazy template of a plugin source file
+    """
+
+    def loader():
+        name = "virt_tuner_templates." + os.path.basename(path)[: -len(".py")]
+        spec = importlib.util.spec_from_file_location(name, path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module.TEMPLATE
+
+    return LazyTemplate(module_description(path), loader)
+
+
+def entry_point_template(entry_point):
+    """
+    Create the lazy template of an entry point
+    """
+    module_name, _sep, attr = entry_point.value.partition(":")
+    module_name = module_name.strip()
+    try:
+        spec = importlib.util.find_spec(module_name)
+    except (ImportError, ValueError):
+        spec = None
+    origin = spec.origin if spec and spec.has_location else None
+    description = module_description(origin) if origin else ""
+
+    def loader():
+        module = importlib.import_module(module_name)
+        return getattr(module, attr.strip() or "TEMPLATE")
+
+    return LazyTemplate(description, loader)
+
+
+def entry_points(group):
+    """
+    Get the installed entry points of a group
+    """
+    import importlib.metadata  # pylint: disable=import-outside-toplevel
+
+    points = importlib.metadata.entry_points()
+    if hasattr(points, "select"):
+        return points.select(group=group)
+    return points.get(group, [])
+
+
+class Registry(collections.abc.Mapping):
+    """
+    Mapping of the template names to the templates.
+
+    The built-in templates come first, then the ones in the templates folder
+    and finally the ones of the entry points. Getting a template from the
+    templates folder by name doesn't need to look for all the plugins.
+    """
+
+    def __init__(self, builtins, folder=TEMPLATES_DIR, group=ENTRY_POINT_GROUP):
+        self._templates = dict(builtins)
+        self._folder = folder
+        self._group = group
+        self._discovered = False
+
+    def _folder_path(self, name):
+        if not self._folder or os.path.basename(name) != name:
+            return None
+        path = os.path.join(self._folder, name + ".py")
+        return path if os.path.isfile(path) else None
+
+    def discover(self):
+        """
+        Find all the plugins templates
+        """
+        if self._discovered:
+            return
+        self._discovered = True
+        found = {}
+        for entry_point in entry_points(self._group):
+            found.setdefault(entry_point.name, entry_point)
+        if self._folder and os.path.isdir(self._folder):
+            for filename in sorted(os.listdir(self._folder)):
+                if filename.endswith(".py"):
+                    found[filename[: -len(".py")]] = os.path.join(
+                        self._folder, filename
+                    )
+        for name, source in found.items():
+            if name in self._templates:
+                continue
+            if isinstance(source, str):
+                self._templates[name] = file_template(source)
+            else:
+                self._templates[name] = entry_point_template(source)
+
+    def __getitem__(self, name):
+        template = self._templates.get(name)
+        if template is None and not self._discovered:
+            path = self._folder_path(name)
+            if path:
+                template = self._templates[name] = file_template(path)
+            else:
+                self.discover()
+                template = self._templates.get(name)
+        if template is None:
+            raise KeyError(name)
+        return template
+
+    def __iter__(self):
+        self.discover()
+        return iter(self._templates)
+
+    def __len__(self):
+        self.discover()
+        return len(self._templates)
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+# Authors: Cedric Bosdonnat <cbosdonnat@suse.com>
+#
+# Copyright (C) 2021 SUSE, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Cache and memory bandwidth allocations of the virtual CPUs.
+
+Intel RDT and AMD QoS split the last level caches and the memory bandwidth of
+the host between classes of service. libvirt creates one for the virtual CPUs
+of each cachetune element of a domain and reserves the allocated part of the
+cache banks for it: two allocations never overlap. The memorytune elements with
+the same virtual CPUs share the class of service of the cachetune.
+
+The virtual CPUs are grouped by the domain of their host CPU: the last level
+cache bank and the memory bandwidth node serving it. Each group gets a fraction
+of its cache bank and memory bandwidth.
+"""
+
+from collections import Counter, namedtuple
+import logging
+
+from virt_tuner.cpuset import CpuSet
+
+log = logging.getLogger(__name__)
+
+# banks and nodes are the allocatable last level cache banks and memory bandwidth
+# nodes by ID. domains maps the host CPU IDs to the (bank ID, node ID) tuple of
+# their domain, with None for the resources that can't be allocated.
+Resctrl = namedtuple("Resctrl", ["banks", "nodes", "domains"])
+
+
+def allocation_control(bank):
+    """
+    Get the control allocating both code and data in a cache bank, or None
+    """
+    for control in bank["controls"]:
+        if control["type"] == "both":
+            return control
+    return None
+
+
+def last_level_caches(cells):
+    """
+    Get the allocatable cache banks of the highest level serving the cells by ID
+    """
+    banks = {
+        (bank["level"], bank["id"]): bank for cell in cells for bank in cell.caches
+    }
+    level = max((level for level, bank_id in banks), default=None)
+    result = {}
+    for (bank_level, bank_id), bank in sorted(banks.items()):
+        if bank_level != level:
+            continue
+        if allocation_control(bank):
+            result[bank_id] = bank
+        elif bank["controls"]:
+            log.debug("Cache bank %d only allocates code and data separately", bank_id)
+    return result
+
+
+def host_resctrl(topology):
+    """
+    Get the allocatable resources of the host topology
+    """
+    banks = last_level_caches(topology.cells)
+    nodes = {node["id"]: node for cell in topology.cells for node in cell.bandwidth}
+    if not banks and not nodes:
+        raise ValueError(
+            _("The host can't allocate the last level caches nor memory bandwidth")
+        )
+    bank_ids = {
+        cpu_id: bank_id
+        for bank_id, bank in banks.items()
+        for cpu_id in CpuSet.parse(bank["cpus"])
+    }
+    node_ids = {
+        cpu_id: node_id
+        for node_id, node in nodes.items()
+        for cpu_id in CpuSet.parse(node["cpus"])
+    }
+    return Resctrl(
+        banks,
+        nodes,
+        {
+            cpu_id: (bank_ids.get(cpu_id), node_ids.get(cpu_id))
+            for cpu_id in topology.cpu_id
+        },
+    )
+
+
+def vcpu_groups(host, topology, pinned):
+    """
+    Group the virtual CPUs by domain.
+    pinned lists the topology index of the host CPU of each virtual CPU.
+    The virtual CPUs on resources that can't be allocated are left out.
+    """
+    groups = {}
+    for vcpu, i in enumerate(pinned):
+        domain = host.domains[topology.cpu_id[i]]
+        if domain != (None, None):
+            groups.setdefault(domain, []).append(vcpu)
+    return groups
+
+
+def shares(topology, vms):
+    """
+    Count the virtual machines using each domain.
+    vms lists the topology indexes of the host CPUs of the virtual CPUs of each machine.
+    """
+    host = host_resctrl(topology)
+    return Counter(
+        domain for pinned in vms for domain in vcpu_groups(host, topology, pinned)
+    )
+
+
+def cache_size(bank, fraction):
+    """
+    Compute the size in KiB of an allocation of a fraction of a cache bank
+    """
+    control = allocation_control(bank)
+    granularity = control["granularity"]
+    size = int(round(bank["size"] * fraction, 6)) // granularity * granularity
+    if size < control["min"]:
+        raise ValueError(
+            _("Cache bank {} is too small to allocate {:.1%} of it").format(
+                bank["id"], fraction
+            )
+        )
+    return size
+
+
+def bandwidth(node, fraction):
+    """
+    Compute the percentage of an allocation of a fraction of the memory bandwidth.
+    The bandwidth is only throttled: the minimum is used for smaller fractions.
+    """
+    granularity = node["granularity"]
+    percent = int(round(fraction * 100, 6)) // granularity * granularity
+    return max(percent, node["min"])
+
+
+def allocations(topology, pinned, fraction, vm_shares=None):
+    """
+    Compute the cachetune and memorytune configurations of a virtual machine.
+
+    pinned lists the topology index of the host CPU of each virtual CPU.
+    The virtual machine gets fraction of the last level cache bank and memory
+    bandwidth of each domain of its host CPUs, divided by the number of
+    virtual machines using the domain in vm_shares.
+    Both configurations map the virtual CPUs cpusets to the allocations by
+    cache bank or memory bandwidth node ID.
+    """
+    host = host_resctrl(topology)
+    groups = vcpu_groups(host, topology, pinned)
+    vm_shares = vm_shares or Counter(groups.keys())
+
+    # The default class of service of the host processes needs one too.
+    # A maxAllocs of 0 means the host doesn't report the limit of the control.
+    max_allocs = [
+        allocation_control(bank)["max_allocs"] for bank in host.banks.values()
+    ] + [node["max_allocs"] for node in host.nodes.values()]
+    limit = min([count for count in max_allocs if count], default=0)
+    if limit and sum(vm_shares.values()) >= limit:
+        raise ValueError(
+            _("The host has only {} classes of service for the allocations").format(
+                limit - 1
+            )
+        )
+
+    cachetune = {}
+    memorytune = {}
+    for domain, vcpus in groups.items():
+        bank_id, node_id = domain
+        share = fraction / vm_shares[domain]
+        vcpus = str(CpuSet(vcpus))
+        if bank_id is not None:
+            bank = host.banks[bank_id]
+            cachetune[vcpus] = {
+                bank_id: {
+                    "level": bank["level"],
+                    "type": "both",
+                    "size": f"{cache_size(bank, share)} KiB",
+                }
+            }
+        if node_id is not None:
+            memorytune[vcpus] = {node_id: bandwidth(host.nodes[node_id], share)}
+    return cachetune, memorytune
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+# Authors: Cedric Bosdonnat <cbosdonnat@suse.com>
+#
+# Copyright (C) 2021 SUSE, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Functions reading the host topology from sysfs without libvirt
+"""
+
+import glob
+import logging
+import os.path
+import re
+
+import virt_tuner.timings as timings
+from virt_tuner.topology import Cell
+
+log = logging.getLogger(__name__)
+
+NODE_DIR = "sys/devices/system/node"
+CPU_DIR = "sys/devices/system/cpu"
+NET_DIR = "sys/class/net"
+
+
+def read(root, path):
+    """
+    Read the stripped content of a sysfs file relative to root.
+    Returns None if the file doesn't exist.
+    """
+    try:
+        with open(os.path.join(root, path), "r") as file_handle:
+            return file_handle.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def parse_cpulist(value):
+    """
+    Parse a kernel CPU list like 0-3,8 into the sorted list of CPU IDs.
+    """
+    cpus = []
+    for item in (value or "").split(","):
+        if not item:
+            continue
+        bounds = item.split("-")
+        cpus.extend(range(int(bounds[0]), int(bounds[-1]) + 1))
+    return sorted(cpus)
+
+
+def cpu_topology(root, cpu_id):
+    """
+    Read the topology of a CPU in the same format than libvirt capabilities.
+    """
+    topology_dir = os.path.join(CPU_DIR, f"cpu{cpu_id}", "topology")
+    cpu = {"id": str(cpu_id)}
+    for key, filename in [
+        ("socket_id", "physical_package_id"),
+        ("die_id", "die_id"),
+        ("core_id", "core_id"),
+        ("siblings", "thread_siblings_list"),
+    ]:
+        value = read(root, os.path.join(topology_dir, filename))
+        if value is not None:
+            cpu[key] = value
+    return cpu
+
+
+def node_memory(root, node_dir):
+    """
+    Get the total memory of a NUMA node in KiB
+    """
+    meminfo = read(root, os.path.join(node_dir, "meminfo")) or ""
+    matcher = re.search(r"MemTotal:\s+(\d+) kB", meminfo)
+    return int(matcher.group(1)) if matcher else 0
+
+
+def node_pages(root, node_dir, memory):
+    """
+    Get the pages count of a NUMA node in the same format than libvirt capabilities.
+    Like libvirt, the memory reserved for huge pages is not counted in the small pages.
+    """
+    huge_pages = []
+    for path in glob.glob(os.path.join(root, node_dir, "hugepages", "hugepages-*kB")):
+        size = int(re.search(r"hugepages-(\d+)kB$", path).group(1))
+        count = int(read(root, os.path.join(path, "nr_hugepages")) or 0)
+        huge_pages.append((size, count))
+    huge_pages.sort()
+
+    page_size = os.sysconf("SC_PAGE_SIZE") // 1024
+    reserved = sum(size * count for size, count in huge_pages)
+    return [
+        {"size": f"{size} KiB", "count": count}
+        for size, count in [(page_size, (memory - reserved) // page_size)] + huge_pages
+    ]
+
+
+def nic_nodes(root):
+    """
+    Get the NUMA node of the network interfaces backed by a device by name.
+    A bridge is on the node of its ports if they are all on the same one.
+    """
+    nodes = {}
+    bridges = {}
+    for path in sorted(glob.glob(os.path.join(root, NET_DIR, "*"))):
+        name = os.path.basename(path)
+        node = read(root, os.path.join(NET_DIR, name, "device", "numa_node"))
+        if node is not None and int(node) >= 0:
+            nodes[name] = int(node)
+        ports = glob.glob(os.path.join(path, "brif", "*"))
+        if ports:
+            bridges[name] = [os.path.basename(port) for port in ports]
+
+    for bridge, ports in bridges.items():
+        port_nodes = {nodes.get(port) for port in ports}
+        if len(port_nodes) == 1 and None not in port_nodes:
+            nodes[bridge] = port_nodes.pop()
+    return nodes
+
+
+@timings.timed("sysfs.read")
+def host_topology(root="/"):
+    """
+    Extract the host topology from sysfs.
+    The root parameter allows reading a sysfs tree located in another folder.
+    """
+    node_ids = sorted(
+        int(os.path.basename(path)[4:])
+        for path in glob.glob(os.path.join(root, NODE_DIR, "node[0-9]*"))
+    )
+    if not node_ids:
+        log.error(_("No NUMA node found in %s"), os.path.join(root, NODE_DIR))
+
+    nics = nic_nodes(root)
+    cells = []
+    for node_id in node_ids:
+        node_dir = os.path.join(NODE_DIR, f"node{node_id}")
+        memory = node_memory(root, node_dir)
+        distances = (read(root, os.path.join(node_dir, "distance")) or "").split()
+        cells.append(
+            Cell(
+                node_id,
+                [
+                    cpu_topology(root, cpu_id)
+                    for cpu_id in parse_cpulist(
+                        read(root, os.path.join(node_dir, "cpulist"))
+                    )
+                ],
+                memory,
+                {
+                    sibling_id: int(distance)
+                    for sibling_id, distance in zip(node_ids, distances)
+                },
+                node_pages(root, node_dir, memory),
+                tuple(sorted(name for name, node in nics.items() if node == node_id)),
+            )
+        )
+    return cells
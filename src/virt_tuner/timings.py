@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+# Authors: Cedric Bosdonnat <cbosdonnat@suse.com>
+#
+# Copyright (C) 2021 SUSE, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Lightweight instrumentation of the tuning phases.
+
+Nothing is recorded unless enabled by calling enable() or by setting the
+VIRT_TUNER_TIMINGS environment variable. Hot code paths check ENABLED
+before calling count() to avoid even the function call when disabled.
+"""
+
+import collections
+import contextlib
+import functools
+import json
+import os
+import sys
+import time
+
+ENABLED = os.environ.get("VIRT_TUNER_TIMINGS", "") not in ["", "0"]
+
+_NULL_CONTEXT = contextlib.nullcontext()
+_phases = collections.defaultdict(float)
+_counters = collections.Counter()
+
+
+def enable():
+    """
+    Start recording the phases durations and counters
+    """
+    global ENABLED  # pylint: disable=global-statement
+    ENABLED = True
+
+
+def reset():
+    """
+    Forget the recorded values
+    """
+    _phases.clear()
+    _counters.clear()
+
+
+@contextlib.contextmanager
+def _timed_phase(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _phases[name] += time.perf_counter() - start
+
+
+def phase(name):
+    """
+    Context manager adding the duration of its block to the named phase
+    """
+    if not ENABLED:
+        return _NULL_CONTEXT
+    return _timed_phase(name)
+
+
+def timed(name):
+    """
+    Decorator adding the duration of the function calls to the named phase
+    """
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return function(*args, **kwargs)
+            with _timed_phase(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def count(name, value=1):
+    """
+    Increment a counter
+    """
+    if ENABLED:
+        _counters[name] += value
+
+
+def results():
+    """
+    Get the recorded phases durations in milliseconds and the counters
+    """
+    return {
+        "phases": {name: round(value * 1000, 3) for name, value in _phases.items()},
+        "counters": dict(_counters),
+    }
+
+
+def report(stream=None):
+    """
+    Write the recorded values as JSON on stream, standard error by default
+    """
+    stream = stream or sys.stderr
+    json.dump(results(), stream, sort_keys=True)
+    stream.write("\n")
+
+
+@contextlib.contextmanager
+def profile(path):
+    """
+    Context manager profiling its block with cProfile and dumping the stats to path.
+    Nothing is profiled if path is empty.
+    """
+    if not path:
+        yield
+        return
+
+    import cProfile  # pylint: disable=import-outside-toplevel
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+# Authors: Cedric Bosdonnat <cbosdonnat@suse.com>
+#
+# Copyright (C) 2021 SUSE, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Compact representation of the host topology used by the templates.
+
+The logical CPUs are stored in parallel integer arrays: the CPU with index i
+has the ID cpu_id[i], is in the NUMA cell node[i], etc. The CPUs of a cell
+have contiguous indices.
+"""
+
+from array import array
+from collections import namedtuple
+
+from virt_tuner.cpuset import compress
+
+# NUMA cell of the host as provided by the topology providers.
+# nics lists the host network interfaces whose PCI device is on the cell, when known.
+# caches and bandwidth list the cache banks and memory bandwidth nodes serving
+# CPUs of the cell, in the format of virt.cache_banks() and virt.bandwidth_nodes().
+Cell = namedtuple(
+    "Cell",
+    ["id", "cpus", "memory", "distances", "pages", "nics", "caches", "bandwidth"],
+    defaults=[(), (), ()],
+)
+
+
+class CompactCell:
+    """
+    NUMA cell of a Topology
+    """
+
+    __slots__ = (
+        "id",
+        "memory",
+        "distances",
+        "pages",
+        "nics",
+        "caches",
+        "bandwidth",
+        "start",
+        "end",
+    )
+
+    def __init__(
+        self, cell_id, memory, distances, pages, nics, caches, bandwidth, start, end
+    ):
+        self.id = cell_id  # pylint: disable=invalid-name
+        self.memory = memory
+        self.distances = distances
+        self.pages = pages
+        self.nics = nics
+        self.caches = caches
+        self.bandwidth = bandwidth
+        self.start = start
+        self.end = end
+
+    @property
+    def cpus(self):
+        """
+        Range of the indices of the cell CPUs in the topology arrays
+        """
+        return range(self.start, self.end)
+
+
+class Topology:
+    """
+    Host CPUs stored as integer arrays.
+
+    group[i] is the index of the SMT siblings group of the CPU in the siblings list,
+    holding the compressed libvirt siblings cpuset of each group.
+    """
+
+    __slots__ = (
+        "cells",
+        "cpu_id",
+        "socket",
+        "die",
+        "core",
+        "node",
+        "group",
+        "siblings",
+    )
+
+    def __init__(self, cells):
+        """
+        Convert a list of Cell with the CPUs described like in the libvirt capabilities
+        """
+        self.cells = []
+        self.cpu_id = array("l")
+        self.socket = array("l")
+        self.die = array("l")
+        self.core = array("l")
+        self.node = array("l")
+        self.group = array("l")
+        self.siblings = []
+
+        groups = {}
+        for cell in cells:
+            start = len(self.cpu_id)
+            for cpu in cell.cpus:
+                cpu_id = int(cpu["id"])
+                key = (
+                    cell.id,
+                    int(cpu.get("socket_id", 0)),
+                    int(cpu.get("die_id", 0)),
+                    int(cpu.get("core_id", cpu_id)),
+                )
+                group = groups.get(key)
+                if group is None:
+                    group = groups[key] = len(self.siblings)
+                    self.siblings.append(compress(cpu.get("siblings") or str(cpu_id)))
+                self.cpu_id.append(cpu_id)
+                self.node.append(key[0])
+                self.socket.append(key[1])
+                self.die.append(key[2])
+                self.core.append(key[3])
+                self.group.append(group)
+            self.cells.append(
+                CompactCell(
+                    cell.id,
+                    cell.memory,
+                    cell.distances,
+                    cell.pages,
+                    cell.nics,
+                    cell.caches,
+                    cell.bandwidth,
+                    start,
+                    len(self.cpu_id),
+                )
+            )
+
+    def __len__(self):
+        return len(self.cpu_id)
+
+    def order(self, indices, *keys):
+        """
+        Sort CPU indices by the values of the arrays named by keys.
+        The sort is stable: CPUs with the same values keep their order.
+        """
+        columns = [getattr(self, key) for key in keys]
+        if len(columns) == 1:
+            return sorted(indices, key=columns[0].__getitem__)
+        return sorted(indices, key=lambda i: tuple(column[i] for column in columns))
+
+    def groups(self, indices):
+        """
+        Group CPU indices by SMT siblings group.
+        The groups are in the order of their first CPU and keep the order of the CPUs.
+        """
+        groups = {}
+        group = self.group
+        for i in indices:
+            groups.setdefault(group[i], []).append(i)
+        return list(groups.values())
+
+    def cores(self, cell):
+        """
+        Get the CPU indices of a cell grouped by core.
+        The cores are sorted by socket, die and core IDs and their CPUs by ID.
+        """
+        return self.groups(self.order(cell.cpus, "socket", "die", "core", "cpu_id"))
+
+    def ids(self, indices):
+        """
+        Get the sorted IDs of the CPUs at the given indices
+        """
+        cpu_id = self.cpu_id
+        return sorted(cpu_id[i] for i in indices)
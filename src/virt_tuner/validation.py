@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+# Authors: Cedric Bosdonnat <cbosdonnat@suse.com>
+#
+# Copyright (C) 2021 SUSE, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Checks that the host can honour a tuned configuration.
+
+The templates compute the configuration from the host topology, but nothing
+guarantees that the host can run it: the huge pages may not be reserved or
+the cores may not all have the same number of threads. Each check returns the
+list of the problems it found so that they can all be reported at once.
+"""
+
+import virt_tuner.hugepages as hugepages
+from virt_tuner.cpuset import CpuSet
+from virt_tuner.topology import Topology
+
+
+def check_vcpus(topology, config):
+    """
+    Check that the virtual CPUs match the guest topology and are all pinned
+    on existing host CPUs, without more virtual CPUs than pinned host CPUs.
+    """
+    problems = []
+    cpu = config.get("cpu", {})
+    vcpupin = cpu.get("tuning", {}).get("vcpupin", {})
+    maximum = int(cpu.get("maximum") or len(vcpupin))
+
+    cpu_topology = cpu.get("topology")
+    if maximum and cpu_topology:
+        topology_cpus = 1
+        for key in ["sockets", "cores", "threads"]:
+            topology_cpus *= int(cpu_topology.get(key, 1))
+        if topology_cpus != maximum:
+            problems.append(
+                _("The guest CPU topology has {} CPUs instead of {}").format(
+                    topology_cpus, maximum
+                )
+            )
+
+    if not vcpupin:
+        return problems
+    vcpus = CpuSet(range(maximum))
+    pinned_vcpus = CpuSet(vcpupin)
+    if vcpus - pinned_vcpus:
+        problems.append(_("Virtual CPUs {} aren't pinned").format(vcpus - pinned_vcpus))
+    if pinned_vcpus - vcpus:
+        problems.append(
+            _("Virtual CPUs {} are pinned but don't exist").format(pinned_vcpus - vcpus)
+        )
+
+    host_cpus = CpuSet(topology.cpu_id)
+    pinned_cpus = CpuSet()
+    for cpuset in vcpupin.values():
+        pinned_cpus |= CpuSet.parse(cpuset)
+    if pinned_cpus - host_cpus:
+        problems.append(
+            _("Host CPUs {} are pinned but don't exist").format(pinned_cpus - host_cpus)
+        )
+    pinned_cpus &= host_cpus
+    if maximum > len(pinned_cpus):
+        problems.append(
+            _("{} virtual CPUs are pinned on only {} host CPUs").format(
+                maximum, len(pinned_cpus)
+            )
+        )
+    return problems
+
+
+def check_threads(topology, config):
+    """
+    Check that each host core used by the pinning runs as many virtual CPUs
+    as the threads per core of the guest topology.
+    The virtual CPUs pinned on CPUs of several cores are not counted.
+    """
+    cpu = config.get("cpu", {})
+    vcpupin = cpu.get("tuning", {}).get("vcpupin", {})
+    groups = {topology.cpu_id[i]: topology.group[i] for i in range(len(topology))}
+    vcpus_per_core = {}
+    for cpuset in vcpupin.values():
+        cores = {groups.get(cpu_id) for cpu_id in CpuSet.parse(cpuset)}
+        if len(cores) == 1 and None not in cores:
+            core = cores.pop()
+            vcpus_per_core[core] = vcpus_per_core.get(core, 0) + 1
+
+    counts = sorted(set(vcpus_per_core.values()))
+    threads = cpu.get("topology", {}).get("threads")
+    if len(counts) > 1:
+        return [
+            _("The host cores run {} virtual CPUs: the threads per core differ").format(
+                " or ".join(map(str, counts))
+            )
+        ]
+    if counts and threads and counts[0] != int(threads):
+        return [
+            _("The host cores run {} virtual CPUs for {} threads per core").format(
+                counts[0], threads
+            )
+        ]
+    return []
+
+
+def check_hugepages(topology, config, root=None):
+    """
+    Check that each host cell has the free huge pages the configuration needs.
+    The free pages are read from the sysfs tree under root if given and available,
+    the pages reserved on the cells are used otherwise, like for remote hosts.
+    """
+    cells = {cell.id for cell in topology.cells}
+    problems = []
+    for item in hugepages.plan(topology.cells, config, root):
+        if item.node not in cells:
+            problems.append(_("Host cell {} doesn't exist").format(item.node))
+        elif item.missing:
+            problems.append(
+                _("Host cell {} has {} free huge pages of {} KiB instead of {}").format(
+                    item.node, item.free, item.size, item.requested
+                )
+            )
+    return problems
+
+
+def check(cells, config, pages=True, root=None):
+    """
+    Run all the checks of a configuration computed for the host cells.
+    The huge pages are not checked if pages is False, for instance if they are
+    reserved later. root is the sysfs tree to read the free huge pages from.
+    Returns the list of the problems found.
+    """
+    topology = Topology(cells)
+    problems = check_vcpus(topology, config) + check_threads(topology, config)
+    if pages:
+        problems += check_hugepages(topology, config, root)
+    return problems
+
+
+def validate(cells, config, pages=True, root=None):
+    """
+    Raise a ValueError listing all the problems of a configuration if any
+    """
+    problems = check(cells, config, pages, root)
+    if problems:
+        raise ValueError(
+            _("The host can't honour the configuration: ") + "; ".join(problems)
+        )
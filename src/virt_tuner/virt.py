@@ -21,28 +21,119 @@ Functions interacting with libvirt
 """
 
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 import logging
+import re
 from xml.etree import ElementTree
-import libvirt
+
+import virt_tuner.diff as diff
+from virt_tuner.cpuset import CpuSet
+from virt_tuner.lazy import lazy_import
+import virt_tuner.timings as timings
+from virt_tuner.topology import Cell
+import virt_tuner.xmlutil as xmlutil
+
+# The binding is only loaded when connecting: importing it takes long
+libvirt = lazy_import("libvirt")
 
 log = logging.getLogger(__name__)
 
-Cell = namedtuple("Cell", ["id", "cpus", "memory", "distances", "pages"])
+DomainResult = namedtuple("DomainResult", ["domain", "error"])
+
+UUID_RE = re.compile(r"[0-9a-fA-F]{8}-?([0-9a-fA-F]{4}-?){3}[0-9a-fA-F]{12}")
+
+# Size of the units of the cache sizes in the capabilities in KiB
+CACHE_UNITS = {"B": 1 / 1024, "KiB": 1, "MiB": 1024, "GiB": 1024**2}
 
 
-def host_topology():
+def cache_size(node, attr):
     """
-    Extract topology from the host capabilities.
+    Get a cache size attribute of a capabilities node in KiB
+    """
+    value = node.get(attr)
+    if value is None:
+        return None
+    return int(int(value) * CACHE_UNITS[node.get("unit", "B")])
+
+
+def cache_banks(caps):
+    """
+    Extract the cache banks of a host capabilities document.
+    The sizes are in KiB and the controls list the allocation capabilities of the bank.
+    """
+    banks = []
+    for bank in caps.findall("host/cache/bank"):
+        controls = []
+        for control in bank.findall("control"):
+            granularity = cache_size(control, "granularity")
+            controls.append(
+                {
+                    "type": control.get("type"),
+                    "granularity": granularity,
+                    "min": cache_size(control, "min") or granularity,
+                    "max_allocs": int(control.get("maxAllocs", 0)),
+                }
+            )
+        banks.append(
+            {
+                "id": int(bank.get("id")),
+                "level": int(bank.get("level")),
+                "type": bank.get("type"),
+                "size": cache_size(bank, "size"),
+                "cpus": bank.get("cpus"),
+                "controls": controls,
+            }
+        )
+    return banks
+
+
+def bandwidth_nodes(caps):
     """
-    cnx = libvirt.open()
+    Extract the memory bandwidth allocation nodes of a host capabilities document.
+    The granularity and min values are percentages of the bandwidth.
+    """
+    nodes = []
+    for node in caps.findall("host/memory_bandwidth/node"):
+        control = node.find("control")
+        if control is None:
+            continue
+        granularity = int(control.get("granularity"))
+        nodes.append(
+            {
+                "id": int(node.get("id")),
+                "cpus": node.get("cpus"),
+                "granularity": granularity,
+                "min": int(control.get("min", granularity)),
+                "max_allocs": int(control.get("maxAllocs", 0)),
+            }
+        )
+    return nodes
+
+
+def serving(items, cpu_ids):
+    """
+    Get the cache banks or memory bandwidth nodes serving one of the CPU IDs
+    """
+    return tuple(item for item in items if CpuSet.parse(item["cpus"]) & cpu_ids)
+
+
+@timings.timed("capabilities.parse")
+def parse_capabilities(capabilities):
+    """
+    Extract the list of NUMA cells from a host capabilities XML document.
+    """
+    caps = ElementTree.fromstring(capabilities)
+    cell_nodes = caps.findall(".//topology/cells/cell")
+    banks = cache_banks(caps)
+    nodes = bandwidth_nodes(caps)
     cells = []
-    try:
-        caps = ElementTree.fromstring(cnx.getCapabilities())
-        cell_nodes = caps.findall(".//topology/cells/cell")
-        cells = [
+    for node in cell_nodes:
+        cpus = [cpu.attrib for cpu in node.findall("cpus/cpu")]
+        cpu_ids = CpuSet(cpu["id"] for cpu in cpus)
+        cells.append(
             Cell(
                 int(node.get("id")),
-                [cpu.attrib for cpu in node.findall("cpus/cpu")],
+                cpus,
                 int(node.find("memory").text),  # libvirt always outputs memory in KiB
                 {
                     int(dist.get("id")): int(dist.get("value"))
@@ -55,12 +146,98 @@ def host_topology():
                     }
                     for page in node.findall("pages")
                 ],
+                (),
+                serving(banks, cpu_ids),
+                serving(nodes, cpu_ids),
             )
-            for node in cell_nodes
-        ]
+        )
+    return cells
+
+
+def host_topology(uri=None):
+    """
+    Extract topology from the host capabilities.
+    """
+    with timings.phase("libvirt.connect"):
+        cnx = libvirt.open(uri)
+    cells = []
+    try:
+        with timings.phase("libvirt.capabilities"):
+            capabilities = cnx.getCapabilities()
+        cells = parse_capabilities(capabilities)
     except libvirt.libvirtError as err:
         log.error(err)
     finally:
         cnx.close()
 
     return cells
+
+
+def lookup_domain(cnx, domain):
+    """
+    Get a libvirt domain from its name or UUID
+    """
+    if UUID_RE.fullmatch(domain):
+        try:
+            return cnx.lookupByUUIDString(domain)
+        except libvirt.libvirtError:
+            pass
+    return cnx.lookupByName(domain)
+
+
+def tune_domain(cnx, domain, plan):
+    """
+    Apply a merge plan on the persistent definition of a domain and redefine it.
+    The domain is not redefined if its tuning sections are left unchanged.
+    Returns whether the domain has been redefined.
+    """
+    dom = lookup_domain(cnx, domain)
+    # Keep the secure parts like the graphics passwords in the new definition
+    with timings.phase("libvirt.domain_xml"):
+        definition = dom.XMLDesc(
+            libvirt.VIR_DOMAIN_XML_INACTIVE | libvirt.VIR_DOMAIN_XML_SECURE
+        )
+    with timings.phase("xml.parse"):
+        doc = ElementTree.fromstring(definition)
+    old_hash = diff.tuning_hash(doc)
+    with timings.phase("xml.apply"):
+        xmlutil.apply_plan(doc, plan)
+    if diff.tuning_hash(doc) == old_hash:
+        return False
+    with timings.phase("xml.serialize"):
+        tuned = ElementTree.tostring(doc, "utf-8").decode()
+    with timings.phase("libvirt.define"):
+        cnx.defineXML(tuned)
+    return True
+
+
+def tune_domains(cnx, domains, plan, jobs=None):
+    """
+    Apply a merge plan on several domains defined on the libvirt connection.
+    The domains are updated concurrently by up to jobs threads sharing the connection.
+    Returns a list of DomainResult in the order of the domains.
+    """
+
+    def tune(domain):
+        try:
+            changed = tune_domain(cnx, domain, plan)
+        except (libvirt.libvirtError, ValueError, ElementTree.ParseError) as err:
+            log.error("%s: %s", domain, err)
+            return DomainResult(domain, str(err))
+        log.info(_("%s: updated") if changed else _("%s: unchanged"), domain)
+        return DomainResult(domain, None)
+
+    with ThreadPoolExecutor(max_workers=jobs or 4) as executor:
+        return list(executor.map(tune, domains))
+
+
+def apply_plan(domains, plan, uri=None, jobs=None):
+    """
+    Apply a merge plan on several domains using a single libvirt connection.
+    """
+    with timings.phase("libvirt.connect"):
+        cnx = libvirt.open(uri)
+    try:
+        return tune_domains(cnx, domains, plan, jobs)
+    finally:
+        cnx.close()
@@ -1,30 +1,182 @@
 """
 XML utility functions
 """
-from xml.etree import ElementTree
+from collections import namedtuple
+import contextlib
+import functools
+import json
+import os
+import os.path
 import re
+import stat
+import tempfile
+import weakref
+from xml.etree import ElementTree
+
+import virt_tuner.timings as timings
+
+Segment = namedtuple("Segment", ["tag", "attr", "value", "position"])
+
+SEGMENT_RE = re.compile(
+    r"(?P<tag>[\w.-]+)(?:\[(?:(?:@(?P<attr>\w+)=['\"](?P<value>[^'\"]+)['\"])|(?P<position>[0-9]+))\])?"
+)
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_segment(segment):
+    """
+    Parse a path segment like tag, tag[@attr='value'] or tag[N] into a Segment.
+    """
+    matcher = SEGMENT_RE.fullmatch(segment)
+    if not matcher:
+        return Segment(segment, None, None, None)
+    position = matcher.group("position")
+    return Segment(
+        matcher.group("tag"),
+        matcher.group("attr"),
+        matcher.group("value"),
+        int(position) if position else None,
+    )
+
+
+class NodeIndex:
+    """
+    Index of the children of the document nodes by tag and attribute value.
+
+    The children of a parent are scanned only once per (tag, attribute) pair.
+    The nodes created or removed by this module are kept in sync in the index.
+    Nodes are referenced by their id to avoid keeping the document alive.
+    """
+
+    def __init__(self):
+        self._children = {}
+        self._parents = {}
+
+    def find(self, parent, tag, attr, value):
+        """
+        Get the first child of parent with the tag and attribute value
+        """
+        parent_entries = self._children.setdefault(id(parent), {})
+        entries = parent_entries.get((tag, attr))
+        if timings.ENABLED:
+            timings.count("xml.index_scans" if entries is None else "xml.index_hits")
+        if entries is None:
+            entries = {}
+            for child in parent.iterfind(tag):
+                entries.setdefault(child.get(attr) if attr else None, child)
+                self._parents[id(child)] = id(parent)
+            parent_entries[(tag, attr)] = entries
+        return entries.get(value)
+
+    def add(self, parent, child):
+        """
+        Register a new child of parent
+        """
+        self._parents[id(child)] = id(parent)
+        for (tag, attr), entries in self._children.get(id(parent), {}).items():
+            if tag == child.tag:
+                entries.setdefault(child.get(attr) if attr else None, child)
+
+    def remove(self, parent, child):
+        """
+        Forget about a child removed from parent and all its descendants:
+        their ids may be reused by new nodes.
+        """
+        for node in child.iter():
+            self._parents.pop(id(node), None)
+            self._children.pop(id(node), None)
+        parent_entries = self._children.get(id(parent), {})
+        for key in [key for key in parent_entries if key[0] == child.tag]:
+            del parent_entries[key]
+
+    def attribute_changed(self, node, attr):
+        """
+        Drop the index entries depending on the value of a node attribute
+        """
+        parent_id = self._parents.get(id(node))
+        if parent_id is not None:
+            self._children.get(parent_id, {}).pop((node.tag, attr), None)
+
+
+_indexes = weakref.WeakKeyDictionary()
+
+
+def get_index(doc):
+    """
+    Get the node index of a document, creating it if needed.
+    """
+    index = _indexes.get(doc)
+    if index is None:
+        index = NodeIndex()
+        _indexes[doc] = index
+    return index
+
+
+def find_child(index, node, item):
+    """
+    Get the first child of node matching the path segment item, or None.
+    """
+    segment = parse_segment(item)
+    if segment.position is not None:
+        child = node.find(item)
+        if child is not None:
+            index.add(node, child)
+        return child
+    return index.find(node, segment.tag, segment.attr, segment.value)
+
+
+def find_node(doc, path):
+    """
+    Get the node corresponding to a given path without creating it.
+    Returns None if the node doesn't exist.
+    """
+    if timings.ENABLED:
+        timings.count("xml.paths_resolved")
+    index = get_index(doc)
+    node = doc
+    for item in path:
+        node = find_child(index, node, item)
+        if node is None:
+            return None
+    return node
 
 
 def get_node(doc, path):
     """
     Get the node corresponding to a given path. The path is an array of tag names.
     """
+    if timings.ENABLED:
+        timings.count("xml.paths_resolved")
+    index = get_index(doc)
     node = doc
-    for segment in path:
-        child = node.find(segment)
+    for item in path:
+        child = find_child(index, node, item)
         if child is None:
-            matcher = re.fullmatch(
-                r"(?P<tag>\w+)\[(?:(?:@(?P<attr>\w+)=['\"](?P<value>[^'\"]+)['\"])|[0-9]+)\]",
-                segment,
-            )
-            tag = matcher.group("tag") if matcher else segment
-            child = ElementTree.SubElement(node, tag)
-            if matcher and matcher.group("attr"):
-                child.set(matcher.group("attr"), matcher.group("value"))
+            if timings.ENABLED:
+                timings.count("xml.nodes_created")
+            segment = parse_segment(item)
+            child = ElementTree.SubElement(node, segment.tag)
+            if segment.attr:
+                child.set(segment.attr, segment.value)
+            index.add(node, child)
         node = child
     return node
 
 
+def remove_node(doc, path):
+    """
+    Remove the node corresponding to a given path if it exists.
+    """
+    # The child is looked up in the document index: an index of the parent
+    # element wouldn't see the nodes removed and created through the document.
+    index = get_index(doc)
+    parent = find_node(doc, path[:-1])
+    child = find_child(index, parent, path[-1]) if parent is not None else None
+    if child is not None:
+        parent.remove(child)
+        index.remove(parent, child)
+
+
 def serialize(value):
     """
     Serialize a value for libvirt's xml
@@ -34,101 +186,442 @@ def serialize(value):
     return str(value)
 
 
-def set_attribute(doc, path, attr, value):
+# A merge plan is a sequence of operations to apply on a document.
+# action is one of the keys of ACTIONS, path is a tuple of path segments,
+# name is the attribute to change if any and value the serialized value if any.
+# The disks and interfaces actions values are the JSON storage and network configurations.
+Operation = namedtuple("Operation", ["action", "path", "name", "value"])
+
+
+def apply_set(doc, operation):
     """
-    Set the attribute of a node if defined.
+    Set the attribute of a node, creating the node if needed
+    """
+    node = get_node(doc, operation.path)
+    node.set(operation.name, operation.value)
+    get_index(doc).attribute_changed(node, operation.name)
+
+
+def apply_text(doc, operation):
+    """
+    Set the text content of a node, creating the node if needed
+    """
+    get_node(doc, operation.path).text = operation.value
+
+
+def apply_unset(doc, operation):
+    """
+    Remove the attribute of a node if it exists
+    """
+    node = find_node(doc, operation.path)
+    if node is not None:
+        node.attrib.pop(operation.name, None)
+        get_index(doc).attribute_changed(node, operation.name)
+
+
+def apply_ensure(doc, operation):
+    """
+    Create the node if it doesn't exist yet
+    """
+    get_node(doc, operation.path)
+
+
+def apply_remove(doc, operation):
+    """
+    Remove the node if it exists
+    """
+    remove_node(doc, operation.path)
+
+
+# Disk sources whose driver can use cache='none' and the native or io_uring I/O modes
+LOCAL_DISK_TYPES = ["file", "block", "volume"]
+
+
+def device_driver(index, device, attrib):
+    """
+    Get the driver child of a device, creating it with the attrib attributes if needed
+    """
+    driver = device.find("driver")
+    if driver is None:
+        driver = ElementTree.SubElement(device, "driver", attrib)
+        index.add(device, driver)
+    return driver
+
+
+def disk_bus(disk):
+    """
+    Get the bus of a local disk that the storage stage knows how to tune, or None
+    """
+    target = disk.find("target")
+    driver = disk.find("driver")
+    if (
+        disk.get("device", "disk") != "disk"
+        or disk.get("type", "file") not in LOCAL_DISK_TYPES
+        or target is None
+        or (driver is not None and driver.get("name", "qemu") != "qemu")
+    ):
+        return None
+    bus = target.get("bus")
+    return bus if bus in ["virtio", "scsi"] else None
+
+
+def apply_disks(doc, operation):
+    """
+    Tune the local virtio-blk and SCSI disks and the virtio-scsi controllers of a document.
+    The value of the operation is the JSON storage configuration.
+    Each virtio-blk disk and virtio-scsi controller gets its I/O thread and queues,
+    the other devices are left untouched.
+    """
+    devices = find_node(doc, operation.path)
+    if devices is None:
+        return
+    index = get_index(doc)
+    settings = json.loads(operation.value)
+    queue_owners = []
+    scsi_disks = False
+    for disk in devices.iterfind("disk"):
+        bus = disk_bus(disk)
+        if bus is None:
+            continue
+        driver = device_driver(index, disk, {"name": "qemu"})
+        for name in ["cache", "io"]:
+            if settings.get(name):
+                driver.set(name, settings[name])
+        if bus == "virtio":
+            queue_owners.append(driver)
+        else:
+            scsi_disks = True
+
+    if scsi_disks:
+        for controller in devices.iterfind("controller[@type='scsi']"):
+            if controller.get("model") == "virtio-scsi":
+                queue_owners.append(device_driver(index, controller, {}))
+
+    iothreads = settings.get("iothreads")
+    for i, driver in enumerate(queue_owners):
+        if iothreads:
+            driver.set("iothread", str(i % iothreads + 1))
+        if settings.get("queues"):
+            driver.set("queues", str(settings["queues"]))
+
+
+# Interface types using the vhost-net backend
+VHOST_INTERFACE_TYPES = ["network", "bridge", "direct", "ethernet"]
+
+
+def pci_controllers(devices):
+    """
+    Get the PCI controllers of a document devices by index
+    """
+    return {
+        int(controller.get("index", "0")): controller
+        for controller in devices.iterfind("controller[@type='pci']")
+    }
+
+
+def pci_bus(device):
+    """
+    Get the PCI bus number of a device address, or None if it has no PCI address
+    """
+    address = device.find("address")
+    if address is None or address.get("type") != "pci":
+        return None
+    return int(address.get("bus", "0"), 0)
+
+
+def bus_node(controllers, bus):
+    """
+    Get the guest NUMA node of the PCIe expander bus a PCI bus is connected to, or None
+    """
+    seen = set()
+    while bus in controllers and bus not in seen:
+        seen.add(bus)
+        controller = controllers[bus]
+        if controller.get("model") == "pcie-expander-bus":
+            return controller.findtext("target/node")
+        bus = pci_bus(controller)
+    return None
+
+
+def set_pci_address(index, device, bus, slot=0):
+    """
+    Replace the address of a device by a PCI one on bus
+    """
+    address = device.find("address")
+    if address is not None:
+        device.remove(address)
+        index.remove(device, address)
+    address = ElementTree.SubElement(
+        device,
+        "address",
+        {
+            "type": "pci",
+            "domain": "0x0000",
+            "bus": f"0x{bus:02x}",
+            "slot": f"0x{slot:02x}",
+            "function": "0x0",
+        },
+    )
+    index.add(device, address)
+
+
+def add_pci_controller(index, devices, controller_index, model):
+    """
+    Add a PCI controller to the devices
+    """
+    controller = ElementTree.SubElement(
+        devices,
+        "controller",
+        {"type": "pci", "index": str(controller_index), "model": model},
+    )
+    index.add(devices, controller)
+    return controller
+
+
+def place_interface(index, devices, interface, node):
+    """
+    Plug an interface in a root port of the PCIe expander bus of a guest NUMA node,
+    creating them if needed. Only the machines with PCIe, like q35, are handled.
+    """
+    controllers = pci_controllers(devices)
+    if not any(ctrl.get("model") == "pcie-root" for ctrl in controllers.values()):
+        return
+    if bus_node(controllers, pci_bus(interface)) == str(node):
+        return
+
+    expander = next(
+        (
+            ctrl_index
+            for ctrl_index, ctrl in controllers.items()
+            if ctrl.get("model") == "pcie-expander-bus"
+            and ctrl.findtext("target/node") == str(node)
+        ),
+        None,
+    )
+    if expander is None:
+        expander = max(controllers) + 1
+        controllers[expander] = add_pci_controller(
+            index, devices, expander, "pcie-expander-bus"
+        )
+        target = ElementTree.SubElement(controllers[expander], "target")
+        ElementTree.SubElement(target, "node").text = str(node)
+
+    slot = len([ctrl for ctrl in controllers.values() if pci_bus(ctrl) == expander])
+    port = max(controllers) + 1
+    set_pci_address(
+        index,
+        add_pci_controller(index, devices, port, "pcie-root-port"),
+        expander,
+        slot,
+    )
+    set_pci_address(index, interface, port)
+
+
+def apply_interfaces(doc, operation):
+    """
+    Tune the virtio network interfaces of a document.
+    The value of the operation is the JSON network configuration.
+    The interfaces using a host device listed in its nodes are placed on the
+    guest NUMA node of that device, the other devices are left untouched.
+    """
+    devices = find_node(doc, operation.path)
+    if devices is None:
+        return
+    index = get_index(doc)
+    settings = json.loads(operation.value)
+    for interface in list(devices.iterfind("interface")):
+        model = interface.find("model")
+        driver = interface.find("driver")
+        kind = interface.get("type")
+        if model is None or model.get("type") != "virtio":
+            continue
+        if kind in VHOST_INTERFACE_TYPES:
+            if driver is not None and driver.get("name", "vhost") != "vhost":
+                continue
+            driver = device_driver(index, interface, {"name": "vhost"})
+            names = ["queues", "rx_queue_size"]
+        elif kind == "vhostuser":
+            driver = device_driver(index, interface, {})
+            names = ["queues", "rx_queue_size", "tx_queue_size"]
+        else:
+            continue
+        for name in names:
+            if settings.get(name):
+                driver.set(name, str(settings[name]))
+
+        source = interface.find("source")
+        if source is not None:
+            device = source.get("dev") or source.get("bridge")
+            node = settings.get("nodes", {}).get(device)
+            if node is not None:
+                place_interface(index, devices, interface, node)
+
+
+ACTIONS = {
+    "set": apply_set,
+    "text": apply_text,
+    "unset": apply_unset,
+    "ensure": apply_ensure,
+    "remove": apply_remove,
+    "disks": apply_disks,
+    "interfaces": apply_interfaces,
+}
+
+
+def apply_plan(doc, plan):
+    """
+    Apply the operations of a merge plan on an ElementTree document
+    """
+    for operation in plan:
+        ACTIONS[operation.action](doc, operation)
+
+
+def attribute_ops(path, attr, value):
+    """
+    Generate the operations setting the attribute of a node if defined.
     """
     if value is not None:
-        node = get_node(doc, path)
-        node.set(attr, serialize(value))
+        yield Operation("set", tuple(path), attr, serialize(value))
 
 
-def set_text(doc, path, value):
+def text_ops(path, value):
     """
-    Set the text content of a node if defined.
+    Generate the operations setting the text content of a node if defined.
     """
     if value is not None:
-        node = get_node(doc, path)
-        node.text = serialize(value)
+        yield Operation("text", tuple(path), None, serialize(value))
 
 
-def set_mem(doc, path, value):
+def mem_ops(path, value):
     """
-    Set a memory value as node text with its unit
+    Generate the operations setting a memory value as node text with its unit
     """
     if value:
         parts = value.split(" ")
         if len(parts) == 2:
-            set_text(doc, path, parts[0])
-            set_attribute(doc, path, "unit", parts[1])
+            yield from text_ops(path, parts[0])
+            yield from attribute_ops(path, "unit", parts[1])
 
 
-def set_mem_attr(doc, path, attr, value):
+def mem_attr_ops(path, attr, value):
     """
-    Set a memory value as attribute with its unit
+    Generate the operations setting a memory value as attribute with its unit
     """
     if value:
         parts = value.split(" ")
         if len(parts) == 2:
-            set_attribute(doc, path, attr, parts[0])
-            set_attribute(doc, path, "unit", parts[1])
+            yield from attribute_ops(path, attr, parts[0])
+            yield from attribute_ops(path, "unit", parts[1])
 
 
-def merge_cpu_config(doc, config):
+def set_attribute(doc, path, attr, value):
     """
-    Merge the cpu configuration with the input XML definition ElementTree document
+    Set the attribute of a node if defined.
+    """
+    apply_plan(doc, attribute_ops(path, attr, value))
+
+
+def set_text(doc, path, value):
+    """
+    Set the text content of a node if defined.
+    """
+    apply_plan(doc, text_ops(path, value))
+
+
+def set_mem(doc, path, value):
+    """
+    Set a memory value as node text with its unit
+    """
+    apply_plan(doc, mem_ops(path, value))
+
+
+def set_mem_attr(doc, path, attr, value):
+    """
+    Set a memory value as attribute with its unit
     """
-    set_attribute(doc, ["vcpu"], "placement", config.get("placement"))
-    set_text(doc, ["vcpu"], config.get("maximum"))
+    apply_plan(doc, mem_attr_ops(path, attr, value))
+
+
+def compile_cpu_config(config):
+    """
+    Generate the operations merging the cpu configuration
+    """
+    yield from attribute_ops(["vcpu"], "placement", config.get("placement"))
+    yield from text_ops(["vcpu"], config.get("maximum"))
 
     for attribute in ["sockets", "cores", "threads"]:
-        set_attribute(
-            doc,
+        yield from attribute_ops(
             ["cpu", "topology"],
             attribute,
             config.get("topology", {}).get(attribute),
         )
 
-    set_attribute(doc, ["cpu"], "mode", config.get("mode"))
+    yield from attribute_ops(["cpu"], "mode", config.get("mode"))
     if config.get("mode") in ["host-model", "host-passthrough"]:
-        cpu_node = doc.find("cpu")
-        if cpu_node is not None:
-            cpu_node.attrib.pop("match", None)
-    set_attribute(doc, ["cpu"], "check", config.get("check"))
+        yield Operation("unset", ("cpu",), "match", None)
+    yield from attribute_ops(["cpu"], "check", config.get("check"))
+
+    for feature, policy in config.get("features", {}).items():
+        yield from attribute_ops(
+            ["cpu", f"feature[@name='{feature}']"], "policy", policy
+        )
 
-    for feature, policy in config.get("features", []).items():
-        set_attribute(doc, ["cpu", f"feature[@name='{feature}']"], "policy", policy)
+    yield from text_ops(["iothreads"], config.get("iothreads"))
 
-    for vcpu_id, vcpuset in config.get("tuning", {}).get("vcpupin", {}).items():
-        set_attribute(
-            doc, ["cputune", f"vcpupin[@vcpu='{vcpu_id}']"], "cpuset", vcpuset
+    tuning = config.get("tuning", {})
+    for vcpu_id, vcpuset in tuning.get("vcpupin", {}).items():
+        yield from attribute_ops(
+            ["cputune", f"vcpupin[@vcpu='{vcpu_id}']"], "cpuset", vcpuset
         )
+    yield from attribute_ops(
+        ["cputune", "emulatorpin"], "cpuset", tuning.get("emulatorpin")
+    )
+    for iothread_id, cpuset in tuning.get("iothreadpin", {}).items():
+        yield from attribute_ops(
+            ["cputune", f"iothreadpin[@iothread='{iothread_id}']"], "cpuset", cpuset
+        )
+    for vcpus, vcpusched in tuning.get("vcpusched", {}).items():
+        for attribute, value in vcpusched.items():
+            yield from attribute_ops(
+                ["cputune", f"vcpusched[@vcpus='{vcpus}']"], attribute, value
+            )
+    for vcpus, caches in tuning.get("cachetune", {}).items():
+        for cache_id, cache in caches.items():
+            cache_path = [
+                "cputune",
+                f"cachetune[@vcpus='{vcpus}']",
+                f"cache[@id='{cache_id}']",
+            ]
+            yield from attribute_ops(cache_path, "level", cache.get("level"))
+            yield from attribute_ops(cache_path, "type", cache.get("type"))
+            yield from mem_attr_ops(cache_path, "size", cache.get("size"))
+    for vcpus, nodes in tuning.get("memorytune", {}).items():
+        for node_id, node_bandwidth in nodes.items():
+            yield from attribute_ops(
+                ["cputune", f"memorytune[@vcpus='{vcpus}']", f"node[@id='{node_id}']"],
+                "bandwidth",
+                node_bandwidth,
+            )
 
     for cell_id, numa in config.get("numa", {}).items():
         numa_path = ["cpu", "numa", f"cell[@id='{cell_id}']"]
-        set_attribute(doc, numa_path, "cpus", numa.get("cpus"))
-        memory = numa.get("memory")
-        if memory:
-            (memory, unit) = memory.split(" ")
-            set_attribute(doc, numa_path, "memory", memory)
-            set_attribute(doc, numa_path, "unit", unit)
+        yield from attribute_ops(numa_path, "cpus", numa.get("cpus"))
+        yield from mem_attr_ops(numa_path, "memory", numa.get("memory"))
 
         for sibling_id, distance in numa.get("distances", {}).items():
-            set_attribute(
-                doc,
+            yield from attribute_ops(
                 numa_path + ["distances", f"sibling[@id='{sibling_id}']"],
                 "value",
                 distance,
             )
 
 
-def merge_numatune_config(doc, config):
+def compile_numatune_config(config):
     """
-    Merge the NUMA tune configuration with the input XML definition ElementTree document
+    Generate the operations merging the NUMA tune configuration
     """
     for attribute in ["mode", "nodeset"]:
-        set_attribute(
-            doc,
+        yield from attribute_ops(
             ["numatune", "memory"],
             attribute,
             config.get("memory", {}).get(attribute),
@@ -136,52 +629,205 @@ def merge_numatune_config(doc, config):
 
     for node_id, memnode in config.get("memnodes", {}).items():
         for attribute, value in memnode.items():
-            set_attribute(
-                doc, ["numatune", f"memnode[@cellid='{node_id}']"], attribute, value
+            yield from attribute_ops(
+                ["numatune", f"memnode[@cellid='{node_id}']"], attribute, value
             )
 
 
-def merge_memory_config(doc, config):
+def compile_memory_config(config):
     """
-    Merge the memory configuration with the input XML definition ElementTree document
+    Generate the operations merging the memory configuration
     """
-    set_mem(doc, ["memory"], config.get("boot"))
-    set_mem(doc, ["currentMemory"], config.get("current"))
+    yield from mem_ops(["memory"], config.get("boot"))
+    yield from mem_ops(["currentMemory"], config.get("current"))
 
-    if config.get("nosharepages"):
-        get_node(doc, ["memoryBacking", "nosharepages"])
-    elif config.get("nosharepages") is not None:
-        backing_node = doc.find("memoryBacking")
-        if backing_node is not None:
-            child_node = backing_node.find("nosharepages")
-            if child_node is not None:
-                backing_node.remove(child_node)
+    for flag in ["nosharepages", "locked"]:
+        if config.get(flag):
+            yield Operation("ensure", ("memoryBacking", flag), None, None)
+        elif config.get(flag) is not None:
+            yield Operation("remove", ("memoryBacking", flag), None, None)
+
+    if config.get("balloon") is False:
+        # Recreate the balloon to drop the settings that don't apply to the none model
+        yield Operation("remove", ("devices", "memballoon"), None, None)
+        yield from attribute_ops(["devices", "memballoon"], "model", "none")
 
     for i, page in enumerate(config.get("hugepages", [])):
-        set_mem_attr(
-            doc,
+        yield from mem_attr_ops(
             ["memoryBacking", "hugepages", f"page[{i + 1}]"],
             "size",
             page.get("size"),
         )
 
 
-def merge_config(def_in, config):
+def compile_features_config(config):
     """
-    Merge the computed configuration with the input XML definition
+    Generate the operations merging the hypervisor features configuration
     """
-    doc = ElementTree.fromstring(def_in)
-
-    merge_cpu_config(doc, config.get("cpu", {}))
-    merge_numatune_config(doc, config.get("numatune", {}))
-    merge_memory_config(doc, config.get("mem", {}))
+    if config.get("kvm-hint-dedicated"):
+        yield from attribute_ops(["features", "kvm", "hint-dedicated"], "state", "on")
+    if config.get("pmu") is not None:
+        yield from attribute_ops(
+            ["features", "pmu"], "state", "on" if config["pmu"] else "off"
+        )
 
-    if config.get("hypervisor_features", {}).get("kvm-hint-dedicated"):
-        set_attribute(doc, ["features", "kvm", "hint-dedicated"], "state", "on")
 
-    for timer_name, timer in config.get("clock", {}).get("timers", {}).items():
+def compile_clock_config(config):
+    """
+    Generate the operations merging the clock configuration
+    """
+    for timer_name, timer in config.get("timers", {}).items():
         for attribute, value in timer.items():
-            set_attribute(
-                doc, ["clock", f"timer[@name='{timer_name}']"], attribute, value
+            yield from attribute_ops(
+                ["clock", f"timer[@name='{timer_name}']"], attribute, value
             )
-    return ElementTree.tostring(doc, "utf-8")
+
+
+def compile_storage_config(config):
+    """
+    Generate the operation tuning the disks.
+    The disks depend on the document: they are only looked for when applying the plan.
+    """
+    if config:
+        yield Operation("disks", ("devices",), None, json.dumps(config, sort_keys=True))
+
+
+def compile_network_config(config):
+    """
+    Generate the operation tuning the network interfaces, found when applying the plan
+    """
+    if config:
+        yield Operation(
+            "interfaces", ("devices",), None, json.dumps(config, sort_keys=True)
+        )
+
+
+# Configuration keys and the functions compiling them, in the merge order
+STAGES = [
+    ("cpu", compile_cpu_config),
+    ("numatune", compile_numatune_config),
+    ("mem", compile_memory_config),
+    ("hypervisor_features", compile_features_config),
+    ("clock", compile_clock_config),
+    ("storage", compile_storage_config),
+    ("network", compile_network_config),
+]
+
+
+@timings.timed("xml.compile")
+def compile_config(config):
+    """
+    Compile the computed configuration into a merge plan.
+    The plan can be applied on any number of documents.
+    """
+    return tuple(
+        operation
+        for key, compiler in STAGES
+        for operation in compiler(config.get(key, {}))
+    )
+
+
+def plan_to_json(plan):
+    """
+    Serialize a merge plan to JSON
+    """
+    return json.dumps([operation._asdict() for operation in plan], indent=2)
+
+
+def plan_from_json(data):
+    """
+    Load a merge plan serialized with plan_to_json()
+    """
+    return tuple(
+        Operation(item["action"], tuple(item["path"]), item["name"], item["value"])
+        for item in json.loads(data)
+    )
+
+
+def merge_cpu_config(doc, config):
+    """
+    Merge the cpu configuration with the input XML definition ElementTree document
+    """
+    apply_plan(doc, compile_cpu_config(config))
+
+
+def merge_numatune_config(doc, config):
+    """
+    Merge the NUMA tune configuration with the input XML definition ElementTree document
+    """
+    apply_plan(doc, compile_numatune_config(config))
+
+
+def merge_memory_config(doc, config):
+    """
+    Merge the memory configuration with the input XML definition ElementTree document
+    """
+    apply_plan(doc, compile_memory_config(config))
+
+
+def merge_plan(def_in, plan):
+    """
+    Apply a merge plan on the input XML definition
+    """
+    with timings.phase("xml.parse"):
+        doc = ElementTree.fromstring(def_in)
+    with timings.phase("xml.apply"):
+        apply_plan(doc, plan)
+    with timings.phase("xml.serialize"):
+        return ElementTree.tostring(doc, "utf-8")
+
+
+def merge_stream(input_file, output, plan):
+    """
+    Parse the XML definition from a file object or path, apply a merge plan on it
+    and write the result to the binary output stream.
+    """
+    with timings.phase("xml.parse"):
+        tree = ElementTree.parse(input_file)
+    with timings.phase("xml.apply"):
+        apply_plan(tree.getroot(), plan)
+    with timings.phase("xml.serialize"):
+        tree.write(output, encoding="utf-8")
+    output.write(b"\n")
+
+
+@contextlib.contextmanager
+def atomic_output(path):
+    """
+    Context manager providing a binary stream to write a file.
+    The data is written to a temporary file renamed to path only on success.
+    An existing file keeps its permissions.
+    """
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(path)), prefix=".virt-tuner-"
+    )
+    try:
+        with os.fdopen(fd, "wb") as file_handle:
+            yield file_handle
+        try:
+            mode = stat.S_IMODE(os.stat(path).st_mode)
+        except FileNotFoundError:
+            umask = os.umask(0)
+            os.umask(umask)
+            mode = 0o666 & ~umask
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def merge_file(input_file, output_path, plan):
+    """
+    Apply a merge plan on the XML definition read from input_file
+    and atomically write the result to output_path.
+    """
+    with atomic_output(output_path) as output:
+        merge_stream(input_file, output, plan)
+
+
+def merge_config(def_in, config):
+    """
+    Merge the computed configuration with the input XML definition
+    """
+    return merge_plan(def_in, compile_config(config))
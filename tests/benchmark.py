@@ -0,0 +1,131 @@
+"""
+Benchmark of the tuning phases on synthetic hosts of growing sizes.
+
+Run it with: PYTHONPATH=src python3 tests/benchmark.py
+"""
+
+from collections import namedtuple
+import math
+import sys
+import time
+import tracemalloc
+from xml.etree import ElementTree
+
+import virt_tuner
+import virt_tuner.virt
+import virt_tuner.xmlutil
+
+import synthetic
+
+Measure = namedtuple("Measure", ["phase", "cpus", "seconds", "peak"])
+
+# Growth exponent above which a phase is considered superlinear
+SUPERLINEAR_THRESHOLD = 1.4
+
+# Hosts of growing sizes: (cells, cores per cell, threads per core)
+SIZES = [(2, 16, 2), (4, 32, 2), (8, 32, 2), (16, 32, 2), (32, 32, 2)]
+
+
+def phases(caps, domain):
+    """
+    Generate the (name, function) of the tuning phases.
+    Each function takes the result of the previous phase.
+    """
+    yield "parse", lambda _: virt_tuner.virt.parse_capabilities(caps)
+    yield "template", virt_tuner.single
+    yield "compile", virt_tuner.xmlutil.compile_config
+
+    def merge(plan):
+        doc = ElementTree.fromstring(domain)
+        virt_tuner.xmlutil.apply_plan(doc, plan)
+        return doc
+
+    yield "merge", merge
+    yield "serialize", lambda doc: ElementTree.tostring(doc, "utf-8")
+
+
+def measure(cells, cores, threads, repeat=3):
+    """
+    Measure the wall time and peak memory of each phase for one host size.
+    The time is the best of repeat runs, the memory is measured in a separate run
+    since tracing the allocations slows everything down.
+    """
+    caps = synthetic.capabilities_xml(cells, cores, threads)
+    domain = synthetic.domain_xml(disks=16, interfaces=4)
+    cpus = cells * cores * threads
+
+    timings = {}
+    for _ in range(repeat):
+        value = None
+        for name, function in phases(caps, domain):
+            start = time.perf_counter()
+            value = function(value)
+            elapsed = time.perf_counter() - start
+            timings[name] = min(timings.get(name, elapsed), elapsed)
+
+    peaks = {}
+    value = None
+    tracemalloc.start()
+    for name, function in phases(caps, domain):
+        tracemalloc.reset_peak()
+        value = function(value)
+        peaks[name] = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return [Measure(name, cpus, timings[name], peaks[name]) for name in timings.keys()]
+
+
+def growth_exponent(measures):
+    """
+    Compute the exponent k of the best fit of seconds = a * cpus ^ k.
+    """
+    points = [(math.log(m.cpus), math.log(max(m.seconds, 1e-7))) for m in measures]
+    mean_x = sum(x for x, y in points) / len(points)
+    mean_y = sum(y for x, y in points) / len(points)
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / sum(
+        (x - mean_x) ** 2 for x, y in points
+    )
+
+
+def run(sizes=None, repeat=3):
+    """
+    Measure all the phases on all the host sizes.
+    Returns the list of measures and the growth exponent of each phase.
+    """
+    measures = [
+        measure_item
+        for cells, cores, threads in sizes or SIZES
+        for measure_item in measure(cells, cores, threads, repeat)
+    ]
+    exponents = {
+        phase: growth_exponent([m for m in measures if m.phase == phase])
+        for phase in dict.fromkeys(m.phase for m in measures)
+    }
+    return measures, exponents
+
+
+def main():
+    """
+    Print the benchmark results and fail if a phase grows superlinearly
+    """
+    measures, exponents = run()
+    print(f"{'phase':<10} {'cpus':>6} {'time (ms)':>10} {'peak (KiB)':>11}")
+    for item in measures:
+        print(
+            f"{item.phase:<10} {item.cpus:>6} {item.seconds * 1000:>10.2f} "
+            f"{item.peak // 1024:>11}"
+        )
+
+    failed = False
+    print()
+    for phase, exponent in exponents.items():
+        flag = ""
+        if exponent > SUPERLINEAR_THRESHOLD:
+            flag = " SUPERLINEAR"
+            failed = True
+        print(f"{phase:<10} growth exponent {exponent:.2f}{flag}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,147 @@
+"""
+Generators of synthetic host capabilities and domain definitions for tests and benchmarks
+"""
+
+from virt_tuner.cpuset import CpuSet
+
+GIB = 1024**2
+
+
+def capabilities_xml(
+    cells=2,
+    cores=24,
+    threads=2,
+    cells_per_socket=1,
+    memory=32 * GIB,
+    huge_pages=0,
+    resctrl=False,
+):
+    """
+    Generate a libvirt capabilities document.
+
+    Each of the cells has cores cores with threads threads each and memory KiB of RAM.
+    Cells sharing a socket are at distance 11 from each other, other cells at 21.
+    The CPU IDs are numbered like on Linux: the first thread of every core comes first.
+    Each socket has a 32MiB last level cache, allocatable like its memory bandwidth
+    if resctrl is set.
+    """
+    total_cores = cells * cores
+    buf = [
+        "<capabilities>",
+        "  <host>",
+        "    <cpu>",
+        "      <arch>x86_64</arch>",
+        f"      <topology sockets='1' cores='{cores}' threads='{threads}'/>",
+        "    </cpu>",
+        "    <topology>",
+        f"      <cells num='{cells}'>",
+    ]
+    for cell in range(cells):
+        socket = cell // cells_per_socket
+        buf += [
+            f"        <cell id='{cell}'>",
+            f"          <memory unit='KiB'>{memory}</memory>",
+            "          <pages unit='KiB' size='4'>"
+            f"{(memory - huge_pages * GIB) // 4}</pages>",
+            "          <pages unit='KiB' size='2048'>0</pages>",
+            f"          <pages unit='KiB' size='1048576'>{huge_pages}</pages>",
+            "          <distances>",
+        ]
+        for other in range(cells):
+            if other == cell:
+                distance = 10
+            elif other // cells_per_socket == socket:
+                distance = 11
+            else:
+                distance = 21
+            buf.append(f"            <sibling id='{other}' value='{distance}'/>")
+        buf += ["          </distances>", f"          <cpus num='{cores * threads}'>"]
+        for core in range(cores):
+            core_index = cell * cores + core
+            siblings = [core_index + thread * total_cores for thread in range(threads)]
+            core_id = (cell % cells_per_socket) * cores + core
+            for cpu_id in siblings:
+                buf.append(
+                    f"            <cpu id='{cpu_id}' socket_id='{socket}' die_id='0' "
+                    f"core_id='{core_id}' siblings='{','.join(map(str, siblings))}'/>"
+                )
+        buf += ["          </cpus>", "        </cell>"]
+    buf += ["      </cells>", "    </topology>"]
+
+    sockets = {}
+    for cell in range(cells):
+        sockets.setdefault(cell // cells_per_socket, []).extend(
+            core_index + thread * total_cores
+            for core_index in range(cell * cores, (cell + 1) * cores)
+            for thread in range(threads)
+        )
+    buf.append("    <cache>")
+    for socket, cpus in sockets.items():
+        cpus = CpuSet(cpus)
+        buf.append(
+            f"      <bank id='{socket}' level='3' type='both' size='32' unit='MiB' "
+            f"cpus='{cpus}'>"
+        )
+        if resctrl:
+            buf.append(
+                "        <control granularity='2048' unit='KiB' type='both' "
+                "maxAllocs='16'/>"
+            )
+        buf.append("      </bank>")
+    buf.append("    </cache>")
+    if resctrl:
+        buf.append("    <memory_bandwidth>")
+        for socket, cpus in sockets.items():
+            cpus = CpuSet(cpus)
+            buf += [
+                f"      <node id='{socket}' cpus='{cpus}'>",
+                "        <control granularity='10' min='10' maxAllocs='8'/>",
+                "      </node>",
+            ]
+        buf.append("    </memory_bandwidth>")
+    buf += ["  </host>", "</capabilities>"]
+    return "\n".join(buf)
+
+
+def domain_xml(name="vm", disks=4, interfaces=2, metadata_size=0):
+    """
+    Generate a domain definition with disks virtio disks, interfaces virtio interfaces
+    and a metadata blob of metadata_size bytes.
+    """
+    buf = [
+        "<domain type='kvm'>",
+        f"  <name>{name}</name>",
+        "  <memory unit='KiB'>4194304</memory>",
+        "  <vcpu placement='static'>2</vcpu>",
+    ]
+    if metadata_size:
+        buf.append(
+            "  <metadata><blob xmlns='urn:test'>"
+            f"{'x' * metadata_size}</blob></metadata>"
+        )
+    buf += [
+        "  <os><type arch='x86_64' machine='q35'>hvm</type></os>",
+        "  <cpu mode='custom' match='exact' check='none'>",
+        "    <model fallback='forbid'>qemu64</model>",
+        "  </cpu>",
+        "  <devices>",
+    ]
+    for disk in range(disks):
+        buf += [
+            "    <disk type='file' device='disk'>",
+            "      <driver name='qemu' type='qcow2'/>",
+            f"      <source file='/var/lib/libvirt/images/{name}-{disk}.qcow2'/>",
+            f"      <target dev='vd{chr(ord('a') + disk % 26)}{disk // 26 or ''}'"
+            " bus='virtio'/>",
+            "    </disk>",
+        ]
+    for interface in range(interfaces):
+        buf += [
+            "    <interface type='network'>",
+            f"      <mac address='52:54:00:00:{interface // 256:02x}:{interface % 256:02x}'/>",
+            "      <source network='default'/>",
+            "      <model type='virtio'/>",
+            "    </interface>",
+        ]
+    buf += ["  </devices>", "</domain>"]
+    return "\n".join(buf)
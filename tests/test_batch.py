@@ -0,0 +1,84 @@
+"""
+Test functions for the virt_tuner.batch module
+"""
+
+import os.path
+from xml.etree import ElementTree
+
+import pytest
+
+import virt_tuner.batch
+import virt_tuner.xmlutil
+
+DOMAIN = """<domain>
+  <name>{}</name>
+  <cpu mode='custom' match='exact' check='none'/>
+</domain>"""
+
+CONFIG = {
+    "cpu": {
+        "placement": "static",
+        "maximum": 4,
+        "mode": "host-passthrough",
+        "features": {"x2apic": "require"},
+    },
+    "mem": {"boot": "4 GiB"},
+}
+
+
+@pytest.fixture(name="inputs")
+def fixture_inputs(tmp_path):
+    """
+    Create a directory with a few domain definitions, one of them broken
+    """
+    input_dir = tmp_path / "in"
+    input_dir.mkdir()
+    for name in ["vm1", "vm2"]:
+        (input_dir / f"{name}.xml").write_text(DOMAIN.format(name))
+    (input_dir / "broken.xml").write_text("<domain>")
+    (input_dir / "README").write_text("not a definition")
+    return input_dir
+
+
+def test_collect_inputs(inputs):
+    """
+    Test the collect_inputs() function
+    """
+    vm1 = os.path.join(str(inputs), "vm1.xml")
+    assert virt_tuner.batch.collect_inputs([str(inputs)]) == [
+        os.path.join(str(inputs), name) for name in ["broken.xml", "vm1.xml", "vm2.xml"]
+    ]
+    assert virt_tuner.batch.collect_inputs([vm1]) == [vm1]
+
+    with pytest.raises(ValueError):
+        virt_tuner.batch.collect_inputs([os.path.join(str(inputs), "missing.xml")])
+
+
+def test_output_paths_duplicates(tmp_path):
+    """
+    Test that output_paths() refuses to overwrite its own outputs
+    """
+    with pytest.raises(ValueError):
+        virt_tuner.batch.output_paths(["a/vm.xml", "b/vm.xml"], str(tmp_path))
+
+
+def test_tune_files(inputs, tmp_path):
+    """
+    Test the tune_files() function
+    """
+    output_dir = tmp_path / "out"
+    plan = virt_tuner.xmlutil.compile_config(CONFIG)
+    results = virt_tuner.batch.tune_files([str(inputs)], plan, str(output_dir), 2)
+
+    assert [(os.path.basename(r.input), r.error is None) for r in results] == [
+        ("broken.xml", False),
+        ("vm1.xml", True),
+        ("vm2.xml", True),
+    ]
+    assert not (output_dir / "broken.xml").exists()
+
+    tuned = ElementTree.parse(str(output_dir / "vm2.xml")).getroot()
+    assert tuned.find("name").text == "vm2"
+    assert tuned.find("vcpu").text == "4"
+    assert tuned.find("cpu").get("mode") == "host-passthrough"
+    assert tuned.find("memory").text == "4"
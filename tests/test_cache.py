@@ -0,0 +1,142 @@
+"""
+Test functions for the virt_tuner.cache module
+"""
+
+from unittest.mock import patch
+
+import pytest
+
+import virt_tuner.cache
+import virt_tuner.virt
+
+CELLS = [
+    virt_tuner.virt.Cell(
+        0,
+        [
+            {"id": "0", "socket_id": "0", "core_id": "0", "siblings": "0,1"},
+            {"id": "1", "socket_id": "0", "core_id": "0", "siblings": "0,1"},
+        ],
+        32646592,
+        {0: 10, 1: 21},
+        [{"size": "4 KiB", "count": 8161648}],
+        ("eth0",),
+        (
+            {
+                "id": 0,
+                "level": 3,
+                "type": "both",
+                "size": 36608,
+                "cpus": "0-1",
+                "controls": [
+                    {"type": "both", "granularity": 3328, "min": 3328, "max_allocs": 16}
+                ],
+            },
+        ),
+        ({"id": 0, "cpus": "0-1", "granularity": 10, "min": 10, "max_allocs": 8},),
+    ),
+    virt_tuner.virt.Cell(
+        1,
+        [
+            {"id": "2", "socket_id": "1", "core_id": "0", "siblings": "2,3"},
+            {"id": "3", "socket_id": "1", "core_id": "0", "siblings": "2,3"},
+        ],
+        32982940,
+        {0: 21, 1: 10},
+        [{"size": "4 KiB", "count": 8245735}],
+    ),
+]
+
+
+@pytest.fixture(name="root")
+def fixture_root(tmp_path):
+    """
+    Create a fake /proc and /sys tree
+    """
+    (tmp_path / "proc/sys/kernel/random").mkdir(parents=True)
+    (tmp_path / "proc/sys/kernel/random/boot_id").write_text("1234\n")
+    (tmp_path / "sys/devices/system/cpu").mkdir(parents=True)
+    (tmp_path / "sys/devices/system/cpu/online").write_text("0-3\n")
+    for node in range(2):
+        node_dir = tmp_path / f"sys/devices/system/node/node{node}"
+        (node_dir / "hugepages/hugepages-1048576kB").mkdir(parents=True)
+        (node_dir / "hugepages/hugepages-1048576kB/nr_hugepages").write_text("0\n")
+        (node_dir / "meminfo").write_text(
+            f"Node {node} MemTotal:       32646592 kB\n"
+            f"Node {node} MemFree:        1234 kB\n"
+        )
+    (tmp_path / "sys/devices/system/node/online").write_text("0-1\n")
+    return tmp_path
+
+
+def test_fingerprint(root):
+    """
+    Test the fingerprint() function changes on hotplug only
+    """
+    key = virt_tuner.cache.fingerprint(str(root))
+    assert key is not None
+
+    (root / "sys/devices/system/node/node0/meminfo").write_text(
+        "Node 0 MemTotal:       32646592 kB\nNode 0 MemFree:        4321 kB\n"
+    )
+    assert virt_tuner.cache.fingerprint(str(root)) == key
+
+    (root / "sys/devices/system/cpu/online").write_text("0-2\n")
+    assert virt_tuner.cache.fingerprint(str(root)) != key
+
+
+def test_fingerprint_no_boot_id(tmp_path):
+    """
+    Test the fingerprint() function on a host without boot ID
+    """
+    assert virt_tuner.cache.fingerprint(str(tmp_path)) is None
+
+
+def test_host_topology(root, tmp_path):
+    """
+    Test the cache.host_topology() function
+    """
+    cache_path = str(tmp_path / "cache/topology.json")
+    with patch("virt_tuner.virt.host_topology") as topology_mock:
+        topology_mock.return_value = CELLS
+
+        assert virt_tuner.cache.host_topology(path=cache_path, root=str(root)) == CELLS
+        assert virt_tuner.cache.host_topology(path=cache_path, root=str(root)) == CELLS
+        assert topology_mock.call_count == 1
+
+        virt_tuner.cache.host_topology(refresh=True, path=cache_path, root=str(root))
+        assert topology_mock.call_count == 2
+
+        (
+            root
+            / "sys/devices/system/node/node1/hugepages/hugepages-1048576kB/nr_hugepages"
+        ).write_text("8\n")
+        virt_tuner.cache.host_topology(path=cache_path, root=str(root))
+        assert topology_mock.call_count == 3
+
+
+def test_host_topology_error(root, tmp_path):
+    """
+    Test that empty topologies from libvirt errors are not cached
+    """
+    cache_path = tmp_path / "topology.json"
+    with patch("virt_tuner.virt.host_topology") as topology_mock:
+        topology_mock.return_value = []
+
+        assert (
+            virt_tuner.cache.host_topology(path=str(cache_path), root=str(root)) == []
+        )
+        assert not cache_path.exists()
+
+
+def test_store_error(tmp_path):
+    """
+    Test that no temporary file is left when the cache can't be written
+    """
+    cache_path = tmp_path / "cache" / "topology.json"
+    with patch("json.dump", side_effect=TypeError("not serializable")):
+        with pytest.raises(TypeError):
+            virt_tuner.cache.store(str(cache_path), "key", CELLS)
+    assert list((tmp_path / "cache").iterdir()) == []
+
+    virt_tuner.cache.store(str(cache_path), "key", CELLS)
+    assert list((tmp_path / "cache").iterdir()) == [cache_path]
@@ -0,0 +1,63 @@
+"""
+Test functions for the virt_tuner.cpuset module
+"""
+
+import pytest
+
+from virt_tuner.cpuset import CpuSet, compress
+
+
+@pytest.mark.parametrize(
+    "text, ids, expected",
+    [
+        ("0,1,2,3", [0, 1, 2, 3], "0-3"),
+        ("0,2", [0, 2], "0,2"),
+        ("7, 0-3 ,5", [0, 1, 2, 3, 5, 7], "0-3,5,7"),
+        ("0-7,^3,^5", [0, 1, 2, 4, 6, 7], "0-2,4,6-7"),
+        ("^2,2", [2], "2"),
+        ("0-95", list(range(96)), "0-95"),
+    ],
+)
+def test_parse(text, ids, expected):
+    """
+    Test parsing and formatting cpusets
+    """
+    cpuset = CpuSet.parse(text)
+    assert list(cpuset) == ids
+    assert len(cpuset) == len(ids)
+    assert str(cpuset) == expected
+    assert cpuset == CpuSet(ids)
+
+
+def test_operators():
+    """
+    Test the union, intersection and difference of cpusets
+    """
+    first = CpuSet.parse("0-3")
+    second = CpuSet.parse("2-5")
+    assert str(first | second) == "0-5"
+    assert str(first & second) == "2-3"
+    assert str(first - second) == "0-1"
+    assert not first & CpuSet.parse("8")
+
+
+@pytest.mark.parametrize("text", ["", "a", "3-1", "-1", "^1-3", "1,,2"])
+def test_parse_errors(text):
+    """
+    Test parsing invalid cpusets
+    """
+    with pytest.raises(ValueError):
+        CpuSet.parse(text)
+
+
+def test_set_operations():
+    """
+    Test the membership and union of cpusets
+    """
+    cpuset = CpuSet([1, 2]) | CpuSet.parse("4-5")
+    assert str(cpuset) == "1-2,4-5"
+    assert 4 in cpuset
+    assert 3 not in cpuset
+    assert -1 not in cpuset
+    assert compress("0,1,3") == "0-1,3"
+    assert compress("auto") == "auto"
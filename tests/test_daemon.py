@@ -0,0 +1,145 @@
+"""
+Test functions for the virt_tuner.daemon module
+"""
+
+import json
+import os
+import stat
+import threading
+
+import pytest
+
+import virt_tuner
+import virt_tuner.daemon
+import virt_tuner.virt
+import virt_tuner.xmlutil
+
+import synthetic
+
+
+@pytest.fixture(name="server")
+def fixture_server(tmp_path):
+    """
+    Run a daemon on a socket in a temporary folder in a thread
+    """
+    calls = []
+
+    def topology():
+        calls.append(1)
+        return virt_tuner.virt.parse_capabilities(
+            synthetic.capabilities_xml(cells=2, cores=4, huge_pages=29)
+        )
+
+    server = virt_tuner.daemon.Server(str(tmp_path / "socket"), topology)
+    server.topology_calls = calls
+    thread = threading.Thread(
+        target=server.serve_forever, kwargs={"poll_interval": 0.01}
+    )
+    thread.start()
+    yield server
+    server.shutdown()
+    thread.join()
+    server.server_close()
+
+
+def test_tune(server):
+    """
+    Test tuning a definition through the daemon
+    """
+    definition = synthetic.domain_xml()
+    response = virt_tuner.daemon.call(
+        server.server_address, {"template": "single", "definition": definition}
+    )
+    expected = virt_tuner.xmlutil.merge_config(
+        definition, virt_tuner.single(server.cells)
+    )
+    assert response == {"definition": expected.decode()}
+
+    response = virt_tuner.daemon.call(
+        server.server_address,
+        {"action": "diff", "template": "single", "definition": expected.decode()},
+    )
+    assert response == {"diff": []}
+    assert list(server.plans) == [("single", ())]
+
+
+def test_socket(server, tmp_path):
+    """
+    Test that only the user can connect and that serve() doesn't remove other files
+    """
+    assert stat.S_IMODE(os.stat(server.server_address).st_mode) == 0o600
+
+    path = tmp_path / "file"
+    path.write_text("data")
+    with pytest.raises(ValueError):
+        virt_tuner.daemon.serve(str(path), list)
+    assert path.read_text() == "data"
+
+
+def test_plan(server):
+    """
+    Test getting the merge plan of a template with parameters
+    """
+    response = virt_tuner.daemon.call(
+        server.server_address,
+        {"action": "plan", "template": "partition", "params": ["vms=2", "index=1"]},
+    )
+    plan = virt_tuner.xmlutil.plan_from_json(json.dumps(response["plan"]))
+    assert plan == virt_tuner.xmlutil.compile_config(
+        virt_tuner.partition(server.cells, vms=2, index=1)
+    )
+
+
+def test_refresh(server):
+    """
+    Test reading the topology again and dropping the compiled templates
+    """
+    virt_tuner.daemon.call(
+        server.server_address, {"action": "plan", "template": "single"}
+    )
+    assert virt_tuner.daemon.call(server.server_address, {"action": "refresh"}) == {}
+    assert server.topology_calls == [1, 1]
+    assert server.plans == {}
+
+
+def test_check(server):
+    """
+    Test that the host is only checked before tuning unless forced
+    """
+    server.cells = virt_tuner.virt.parse_capabilities(
+        synthetic.capabilities_xml(cells=2, cores=4)
+    )
+    request = {"template": "single", "definition": synthetic.domain_xml()}
+    response = virt_tuner.daemon.call(
+        server.server_address, dict(request, action="plan")
+    )
+    assert "plan" in response
+    response = virt_tuner.daemon.call(server.server_address, request)
+    assert "Host cell 0 has 0 free huge pages" in response["error"]
+    response = virt_tuner.daemon.call(server.server_address, dict(request, force=True))
+    assert "definition" in response
+
+
+@pytest.mark.parametrize(
+    "request_data",
+    [
+        {"action": "unknown"},
+        {"template": "unknown", "definition": "<domain/>"},
+        {"template": "partition", "params": ["vms=3"], "definition": "<domain/>"},
+        {"template": "single", "definition": "<domain>"},
+        {"template": "single"},
+        {"template": "single", "definition": None},
+        {"action": "diff", "template": "single", "definition": 1},
+        {"template": ["single"], "definition": "<domain/>"},
+        {"template": "partition", "params": "vms=2", "definition": "<domain/>"},
+        {"template": "partition", "params": [2], "definition": "<domain/>"},
+        {"action": ["tune"]},
+        ["tune"],
+    ],
+)
+def test_errors(server, request_data):
+    """
+    Test the errors are reported in the responses
+    """
+    response = virt_tuner.daemon.call(server.server_address, request_data)
+    assert list(response) == ["error"]
@@ -0,0 +1,89 @@
+"""
+Test functions for the virt_tuner.diff module
+"""
+
+from xml.etree import ElementTree
+
+import virt_tuner.diff
+import virt_tuner.xmlutil
+
+DOMAIN = """<domain type='kvm'>
+  <name>vm</name>
+  <vcpu placement='static'>2</vcpu>
+  <cputune>
+    <vcpupin vcpu='0' cpuset='0'/>
+    <vcpupin vcpu='1' cpuset='1'/>
+  </cputune>
+  <clock offset='utc'/>
+</domain>"""
+
+
+def test_tuning_hash():
+    """
+    Test that the hash ignores formatting, order, the cpusets syntax
+    and the non tuning sections
+    """
+    other = """<domain type='kvm'><name>other</name><clock offset='utc'/>
+<cputune><vcpupin cpuset='1' vcpu='1'/><vcpupin cpuset='0' vcpu='0'/></cputune>
+<vcpu placement='static'> 2 </vcpu></domain>"""
+    assert virt_tuner.diff.tuning_hash(
+        ElementTree.fromstring(DOMAIN)
+    ) == virt_tuner.diff.tuning_hash(ElementTree.fromstring(other))
+
+    compressed = DOMAIN.replace("cpuset='1'", "cpuset='0-1'")
+    expanded = DOMAIN.replace("cpuset='1'", "cpuset='0,1'")
+    assert virt_tuner.diff.tuning_hash(
+        ElementTree.fromstring(compressed)
+    ) == virt_tuner.diff.tuning_hash(ElementTree.fromstring(expanded))
+
+    cachetune = "<cputune><cachetune vcpus='{}'/>"
+    compressed = DOMAIN.replace("<cputune>", cachetune.format("0-3"))
+    expanded = DOMAIN.replace("<cputune>", cachetune.format("0,1,2,3"))
+    assert virt_tuner.diff.tuning_hash(
+        ElementTree.fromstring(compressed)
+    ) == virt_tuner.diff.tuning_hash(ElementTree.fromstring(expanded))
+
+    changed = DOMAIN.replace("cpuset='1'", "cpuset='2'")
+    assert virt_tuner.diff.tuning_hash(
+        ElementTree.fromstring(DOMAIN)
+    ) != virt_tuner.diff.tuning_hash(ElementTree.fromstring(changed))
+
+
+def test_diff_plan():
+    """
+    Test the structural diff of a tuned definition
+    """
+    plan = virt_tuner.xmlutil.compile_config(
+        {
+            "cpu": {
+                "maximum": 3,
+                "tuning": {"vcpupin": {0: "0", 1: "4", 2: "5"}},
+                "features": {"x2apic": "require"},
+            }
+        }
+    )
+    assert virt_tuner.diff.diff_plan(DOMAIN, plan) == [
+        "~ vcpu '2' -> '3'",
+        "~ cputune/vcpupin[@vcpu='1']/@cpuset '1' -> '4'",
+        "+ cputune/vcpupin[@vcpu='2'] vcpu='2' cpuset='5'",
+        "+ cpu",
+        "+ cpu/feature[@name='x2apic'] name='x2apic' policy='require'",
+    ]
+
+
+def test_diff_plan_unchanged():
+    """
+    Test that no diff is reported when the plan doesn't change anything
+    """
+    plan = virt_tuner.xmlutil.compile_config(
+        {"cpu": {"maximum": 2, "tuning": {"vcpupin": {0: "0", 1: "1"}}}}
+    )
+    assert virt_tuner.diff.diff_plan(DOMAIN, plan) == []
+
+
+def test_segments():
+    """
+    Test naming the sibling nodes without identifying attribute by position
+    """
+    node = ElementTree.fromstring("<features><kvm/><pae/><kvm/></features>")
+    assert list(virt_tuner.diff.segments(node)) == ["kvm", "pae", "kvm[2]"]
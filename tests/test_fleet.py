@@ -0,0 +1,129 @@
+"""
+Test functions for the virt_tuner.fleet module
+"""
+
+from unittest.mock import patch
+from xml.etree import ElementTree
+
+import pytest
+
+import virt_tuner
+import virt_tuner.fleet
+import virt_tuner.main
+
+import synthetic
+
+
+@pytest.fixture(name="fleet")
+def fixture_fleet(tmp_path):
+    """
+    Create the capabilities of a few hosts with their huge pages reserved
+    and a folder of definitions
+    """
+    caps_dir = tmp_path / "caps"
+    caps_dir.mkdir()
+    for host, cells in [("host1", 2), ("host2", 4), ("odd", 3)]:
+        (caps_dir / f"{host}.xml").write_text(
+            synthetic.capabilities_xml(cells=cells, cores=4, huge_pages=29)
+        )
+    (caps_dir / "broken.xml").write_text("<capabilities>")
+
+    input_dir = tmp_path / "in"
+    input_dir.mkdir()
+    for name in ["vm1", "vm2"]:
+        (input_dir / f"{name}.xml").write_text(synthetic.domain_xml(name))
+    return tmp_path
+
+
+def test_collect_hosts(fleet):
+    """
+    Test finding the hosts of a capabilities file or folder
+    """
+    caps_dir = fleet / "caps"
+    hosts = virt_tuner.fleet.collect_hosts(str(caps_dir))
+    assert [host for host, path in hosts] == ["broken", "host1", "host2", "odd"]
+    assert virt_tuner.fleet.collect_hosts(str(caps_dir / "odd.xml")) == [
+        ("odd", str(caps_dir / "odd.xml"))
+    ]
+    with pytest.raises(ValueError):
+        virt_tuner.fleet.collect_hosts(str(caps_dir / "missing.xml"))
+
+
+def test_tune_fleet(fleet):
+    """
+    Test tuning definitions for several hosts, some of them failing
+    """
+    output_dir = fleet / "out"
+    host_results = virt_tuner.fleet.tune_fleet(
+        str(fleet / "caps"),
+        [str(fleet / "in")],
+        "partition",
+        ["vms=2"],
+        str(output_dir),
+        jobs=2,
+    )
+    assert [(result.host, result.error is None) for result in host_results] == [
+        ("broken", False),
+        ("host1", True),
+        ("host2", True),
+        ("odd", False),
+    ]
+    assert "3 cells can't be split among 2" in host_results[3].error
+    assert not (output_dir / "odd").exists()
+
+    tuned = ElementTree.parse(str(output_dir / "host2" / "vm2.xml")).getroot()
+    assert tuned.find("name").text == "vm2"
+    assert tuned.find("vcpu").text == "16"
+    tuned = ElementTree.parse(str(output_dir / "host1" / "vm1.xml")).getroot()
+    assert tuned.find("vcpu").text == "8"
+
+    lines = virt_tuner.fleet.summary(host_results)
+    assert lines[0] == "Tuned hosts: 2, failed hosts: 2"
+    assert [line.split(":")[0] for line in lines[1:]] == ["  broken", "  odd"]
+
+
+def test_tune_host_unexpected_error(fleet):
+    """
+    Test that any error of a template only fails its host
+    """
+
+    def failing(cells):
+        raise KeyError(len(cells))
+
+    template = virt_tuner.Template("Failing template", failing, [])
+    with patch("virt_tuner.templates", {"failing": template}):
+        host_result = virt_tuner.fleet.tune_host(
+            "host1",
+            str(fleet / "caps" / "host1.xml"),
+            "failing",
+            [],
+            [str(fleet / "in" / "vm1.xml")],
+            str(fleet / "out"),
+        )
+    assert host_result == virt_tuner.fleet.HostResult("host1", [], "KeyError: 2")
+
+
+def test_cli(fleet, capsys):
+    """
+    Test the fleet mode of the command line
+    """
+    argv = [
+        "--template",
+        "single",
+        "--capabilities",
+        str(fleet / "caps" / "host2.xml"),
+        str(fleet / "in" / "vm1.xml"),
+    ]
+    assert virt_tuner.main.cli(argv) == 1
+    assert virt_tuner.main.cli(argv + ["--output-dir", str(fleet / "out")]) == 0
+    assert capsys.readouterr().out == "Tuned hosts: 1, failed hosts: 0\n"
+    assert (fleet / "out" / "host2" / "vm1.xml").exists()
+
+    # The hosts without the huge pages fail unless forced
+    (fleet / "caps" / "host2.xml").write_text(
+        synthetic.capabilities_xml(cells=4, cores=4)
+    )
+    argv += ["--output-dir", str(fleet / "out")]
+    assert virt_tuner.main.cli(argv) == 1
+    assert "Host cell 3 has 0 free huge pages" in capsys.readouterr().out
+    assert virt_tuner.main.cli(argv + ["--force"]) == 0
@@ -0,0 +1,142 @@
+"""
+Test functions for the virt_tuner.hugepages module
+"""
+
+from unittest.mock import patch
+
+import pytest
+
+import virt_tuner
+import virt_tuner.hugepages
+import virt_tuner.main
+from virt_tuner.hugepages import Reservation
+from virt_tuner.topology import Cell
+
+GIB = 1024**2
+
+
+def make_cells(huge_pages):
+    """
+    Create 2 cells of 8 CPUs and 32GiB with huge_pages 1GiB pages reserved on each
+    """
+    return [
+        Cell(
+            cell_id,
+            [
+                {
+                    "id": str(cell_id * 8 + cpu),
+                    "socket_id": str(cell_id),
+                    "core_id": str(cpu % 4),
+                    "siblings": f"{cell_id * 8 + cpu % 4},{cell_id * 8 + cpu % 4 + 4}",
+                }
+                for cpu in range(8)
+            ],
+            32 * GIB,
+            {0: 10 if cell_id == 0 else 21, 1: 21 if cell_id == 0 else 10},
+            [
+                {"size": "4 KiB", "count": (32 - huge_pages) * GIB // 4},
+                {"size": "2048 KiB", "count": 0},
+                {"size": "1048576 KiB", "count": huge_pages},
+            ],
+        )
+        for cell_id in range(2)
+    ]
+
+
+def write_counters(root, node, reserved, free):
+    """
+    Write the 1GiB huge pages counters of a node in a fake sysfs tree
+    """
+    path = root / virt_tuner.hugepages.counter_path(node, GIB, "")
+    path.mkdir(parents=True)
+    (path / "nr_hugepages").write_text(f"{reserved}\n")
+    (path / "free_hugepages").write_text(f"{free}\n")
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [("1 G", GIB), ("2048 KiB", 2048), ("4 M", 4096), ("1 GB", 976562)],
+)
+def test_to_kib(value, expected):
+    """
+    Test converting the memory values to KiB
+    """
+    assert virt_tuner.hugepages.to_kib(value) == expected
+
+
+def test_to_kib_error():
+    """
+    Test converting a memory value with an unknown unit
+    """
+    with pytest.raises(ValueError):
+        virt_tuner.hugepages.to_kib("1 X")
+
+
+def test_requested_pages():
+    """
+    Test computing the pages requested by the partition template configurations
+    """
+    cells = make_cells(0)
+    config = virt_tuner.partition(cells, vms=2, index=1)
+    assert virt_tuner.hugepages.requested_pages(config) == (GIB, {1: 29})
+
+    assert virt_tuner.hugepages.requested_pages({"mem": {}}) == (None, {})
+
+
+def test_plan_cells(tmp_path):
+    """
+    Test planning the reservations from the cells pages when sysfs has no counter
+    """
+    cells = make_cells(20)
+    config = virt_tuner.single(cells)
+    assert virt_tuner.hugepages.plan(cells, config, str(tmp_path)) == [
+        Reservation(0, GIB, 29, 20, 20, 9),
+        Reservation(1, GIB, 29, 20, 20, 9),
+    ]
+
+
+def test_plan_sysfs(tmp_path):
+    """
+    Test planning the reservations from the sysfs counters
+    """
+    write_counters(tmp_path, 0, 30, 30)
+    write_counters(tmp_path, 1, 30, 10)
+    cells = make_cells(0)
+    config = virt_tuner.single(cells)
+    assert virt_tuner.hugepages.plan(cells, config, str(tmp_path)) == [
+        Reservation(0, GIB, 29, 30, 30, 0),
+        Reservation(1, GIB, 29, 30, 10, 19),
+    ]
+
+
+def test_reserve(tmp_path):
+    """
+    Test writing the reservations in sysfs
+    """
+    write_counters(tmp_path, 0, 30, 30)
+    write_counters(tmp_path, 1, 30, 10)
+    reservations = [
+        Reservation(0, GIB, 29, 30, 30, 0),
+        Reservation(1, GIB, 29, 30, 10, 19),
+    ]
+    assert virt_tuner.hugepages.reserve(reservations, str(tmp_path)) == []
+
+    counter = tmp_path / virt_tuner.hugepages.counter_path(1, GIB, "nr_hugepages")
+    assert counter.read_text() == "49"
+    counter = tmp_path / virt_tuner.hugepages.counter_path(0, GIB, "nr_hugepages")
+    assert counter.read_text() == "30\n"
+
+    with patch("virt_tuner.hugepages.read_count", return_value=None):
+        assert virt_tuner.hugepages.reserve(reservations[1:], str(tmp_path)) == [
+            Reservation(1, GIB, 29, 30, 10, 49)
+        ]
+
+
+@pytest.mark.parametrize("mode", ["check", "reserve"])
+def test_cli_connect(mode, caplog):
+    """
+    Test that the local huge pages aren't checked nor reserved for a remote host
+    """
+    argv = ["--template", "single", "--connect", "qemu+ssh://host/system"]
+    assert virt_tuner.main.cli(argv + ["--hugepages", mode, "--dump-plan"]) == 1
+    assert "--hugepages can't be used with --connect" in caplog.text
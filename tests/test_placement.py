@@ -0,0 +1,98 @@
+"""
+Test functions for the virt_tuner.placement module
+"""
+
+import pytest
+
+import virt_tuner.hugepages
+from virt_tuner.cpuset import CpuSet
+from virt_tuner.placement import Policy, choose, clusters, numatune
+from virt_tuner.topology import Cell
+
+GIB = 1024**2
+
+# Two sockets with two sub-NUMA clusters each and a CXL memory expander on socket 0
+DISTANCES = [
+    [10, 12, 21, 21, 14],
+    [12, 10, 21, 21, 14],
+    [21, 21, 10, 12, 24],
+    [21, 21, 12, 10, 24],
+    [14, 14, 24, 24, 10],
+]
+
+
+def make_cells(memories):
+    """
+    Create the cells of the DISTANCES host with memories GiB each.
+    The CXL memory expander has no CPU.
+    """
+    return [
+        Cell(
+            cell_id,
+            [{"id": str(cell_id)}] if cell_id < 4 else [],
+            memory * GIB,
+            {str(other_id): value for other_id, value in enumerate(row)},
+            [],
+        )
+        for cell_id, (memory, row) in enumerate(zip(memories, DISTANCES))
+    ]
+
+
+def test_clusters():
+    """
+    Test grouping the close cells
+    """
+    assert clusters(make_cells([16] * 5)) == [[0, 1, 4], [2, 3]]
+    assert clusters(make_cells([16] * 5), ratio=1.3) == [[0, 1], [2, 3], [4]]
+
+    # A memory expander shared by both sockets doesn't join them
+    cells = make_cells([16] * 5)
+    cells[4] = cells[4]._replace(distances={"0": 14, "2": 14, "4": 10})
+    cells[0] = cells[0]._replace(distances={**cells[0].distances, "4": 14})
+    cells[2] = cells[2]._replace(distances={**cells[2].distances, "4": 14})
+    assert clusters(cells) == [[0, 1, 4], [2, 3]]
+
+
+@pytest.mark.parametrize(
+    "ratio, cell_id, memory, mode, nodes",
+    [
+        (1.1, 0, 16, "strict", "0"),
+        (1.1, 2, 40, "preferred", "2"),
+        (1.5, 0, 16, "interleave", "0-1"),
+        (1.5, 4, 32, "preferred", "4"),
+    ],
+    ids=["fits", "too big", "sub-numa", "far memory"],
+)
+def test_choose(ratio, cell_id, memory, mode, nodes):
+    """
+    Test choosing the policy of a guest cell
+    """
+    cells = make_cells([16, 16, 16, 16, 32])
+    policy = choose(cells, cells[cell_id], memory * GIB, ratio)
+    assert (policy.mode, str(policy.nodes)) == (mode, nodes)
+    assert policy.reason
+
+
+def test_numatune():
+    """
+    Test the numatune configuration of mixed policies
+    """
+    policies = {
+        0: Policy("strict", CpuSet([0]), ""),
+        1: Policy("interleave", CpuSet([1, 4]), ""),
+    }
+    config = numatune(policies)
+    assert config == {
+        "memory": {"mode": "interleave", "nodeset": "0-1,4"},
+        "memnodes": {
+            0: {"mode": "strict", "nodeset": "0"},
+            1: {"mode": "interleave", "nodeset": "1,4"},
+        },
+    }
+    assert virt_tuner.hugepages.requested_pages(
+        {
+            "cpu": {"numa": {0: {"memory": "4 GiB"}, 1: {"memory": "5 GiB"}}},
+            "numatune": config,
+            "mem": {"hugepages": [{"size": "1 G"}]},
+        }
+    ) == (GIB, {0: 4, 1: 3, 4: 2})
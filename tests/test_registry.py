@@ -0,0 +1,110 @@
+"""
+Test functions for the virt_tuner.registry module
+"""
+
+import sys
+from collections import namedtuple
+import textwrap
+
+import pytest
+
+import virt_tuner
+import virt_tuner.registry
+
+EntryPoint = namedtuple("EntryPoint", ["name", "value"])
+
+PLUGIN = '''
+"""
+Tune the clock only
+
+More details.
+"""
+import virt_tuner
+
+
+def clock(cells, offset="utc"):
+    """
+    Set the clock offset
+    """
+    return {{"clock": {{"offset": offset}}}}
+
+
+TEMPLATE = {template}
+'''
+
+
+def write_plugin(folder, name, template="clock"):
+    """
+    Write a plugin module in folder
+    """
+    folder.mkdir(exist_ok=True)
+    (folder / f"{name}.py").write_text(
+        textwrap.dedent(PLUGIN.format(template=template))
+    )
+
+
+@pytest.fixture(name="entry_points")
+def fixture_entry_points(monkeypatch, tmp_path):
+    """
+    Install a fake entry point for a plugin module
+    """
+    write_plugin(tmp_path / "plugins", "vt_plugin_clock")
+    monkeypatch.syspath_prepend(str(tmp_path / "plugins"))
+    points = [EntryPoint("ep-clock", "vt_plugin_clock:clock")]
+    monkeypatch.setattr(virt_tuner.registry, "entry_points", lambda group: points)
+    yield points
+    sys.modules.pop("vt_plugin_clock", None)
+
+
+@pytest.mark.usefixtures("entry_points")
+def test_discover(tmp_path):
+    """
+    Test listing the templates without importing the plugins
+    """
+    write_plugin(tmp_path / "templates", "local")
+    registry = virt_tuner.registry.Registry(
+        virt_tuner.builtin_templates, folder=str(tmp_path / "templates")
+    )
+    assert list(registry) == ["single", "partition", "realtime", "ep-clock", "local"]
+    assert registry["local"].description == "Tune the clock only"
+    assert registry["ep-clock"].description == "Tune the clock only"
+    assert not registry["local"].loaded
+    assert "../templates/local" not in registry
+    assert "vt_plugin_clock" not in sys.modules
+
+    assert registry["ep-clock"].function(None, offset="localtime") == {
+        "clock": {"offset": "localtime"}
+    }
+    assert registry["ep-clock"].loaded
+    assert "vt_plugin_clock" in sys.modules
+
+
+def test_folder_lookup(tmp_path, monkeypatch):
+    """
+    Test getting a template of the folder without looking for the entry points
+    """
+
+    def fail(group):
+        raise AssertionError("entry points searched")
+
+    monkeypatch.setattr(virt_tuner.registry, "entry_points", fail)
+    write_plugin(
+        tmp_path,
+        "local",
+        'virt_tuner.Template("", clock, '
+        '[virt_tuner.Parameter("offset", str, "clock offset", "utc")])',
+    )
+    registry = virt_tuner.registry.Registry({}, folder=str(tmp_path))
+    template = registry["local"]
+    assert [parameter.name for parameter in template.parameters] == ["offset"]
+
+
+@pytest.mark.parametrize("template", ["missing", "42"])
+def test_load_errors(tmp_path, template):
+    """
+    Test the errors of plugins without a valid template
+    """
+    write_plugin(tmp_path, "broken", template)
+    registry = virt_tuner.registry.Registry({}, folder=str(tmp_path), group="none")
+    with pytest.raises(ValueError):
+        registry["broken"].load()
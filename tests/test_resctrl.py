@@ -0,0 +1,114 @@
+"""
+Test functions for the virt_tuner.resctrl module
+"""
+
+from collections import Counter
+
+import pytest
+
+import virt_tuner
+import virt_tuner.resctrl
+import virt_tuner.virt
+from virt_tuner.topology import Topology
+
+import synthetic
+
+
+def make_topology(resctrl=True, **kwargs):
+    """
+    Create the topology of a synthetic host with 2 sockets of 4 cores with 2 threads
+    """
+    return Topology(
+        virt_tuner.virt.parse_capabilities(
+            synthetic.capabilities_xml(cells=2, cores=4, resctrl=resctrl, **kwargs)
+        )
+    )
+
+
+def test_host_resctrl():
+    """
+    Test finding the last level cache bank and memory bandwidth node of the CPUs
+    """
+    host = virt_tuner.resctrl.host_resctrl(make_topology())
+    assert list(host.banks) == [0, 1]
+    assert list(host.nodes) == [0, 1]
+    assert host.domains[0] == (0, 0)
+    assert host.domains[12] == (1, 1)
+
+    with pytest.raises(ValueError):
+        virt_tuner.resctrl.host_resctrl(make_topology(resctrl=False))
+
+
+def test_allocations():
+    """
+    Test computing the allocations of virtual CPUs spread over both sockets
+    """
+    topology = make_topology()
+    cachetune, memorytune = virt_tuner.resctrl.allocations(
+        topology, list(range(len(topology))), 0.5
+    )
+    assert cachetune == {
+        "0-7": {0: {"level": 3, "type": "both", "size": "16384 KiB"}},
+        "8-15": {1: {"level": 3, "type": "both", "size": "16384 KiB"}},
+    }
+    assert memorytune == {"0-7": {0: 50}, "8-15": {1: 50}}
+
+
+@pytest.mark.parametrize(
+    "fraction, size, bandwidth",
+    [(0.3, 8192, 30), (0.25, 8192, 20), (0.07, 2048, 10)],
+    ids=["rounded", "granularity", "minimum"],
+)
+def test_allocation_sizes(fraction, size, bandwidth):
+    """
+    Test rounding the allocations to the granularity of the controls
+    """
+    host = virt_tuner.resctrl.host_resctrl(make_topology())
+    assert virt_tuner.resctrl.cache_size(host.banks[0], fraction) == size
+    assert virt_tuner.resctrl.bandwidth(host.nodes[0], fraction) == bandwidth
+
+
+def test_allocation_errors():
+    """
+    Test the allocations the host can't provide
+    """
+    topology = make_topology()
+    with pytest.raises(ValueError):
+        virt_tuner.resctrl.allocations(topology, [0, 1], 0.05)
+    with pytest.raises(ValueError):
+        virt_tuner.resctrl.allocations(topology, [0, 1], 0.5, Counter({(0, 0): 16}))
+
+    # The controls without maxAllocs don't lift the limit of the others
+    caps = synthetic.capabilities_xml(cells=2, cores=4, resctrl=True)
+    topology = Topology(
+        virt_tuner.virt.parse_capabilities(caps.replace(" maxAllocs='8'", ""))
+    )
+    with pytest.raises(ValueError, match="15 classes of service"):
+        virt_tuner.resctrl.allocations(topology, [0, 1], 0.5, Counter({(0, 0): 16}))
+
+
+def test_partition_llc():
+    """
+    Test splitting the last level caches between the virtual machines sharing them
+    """
+    cells = virt_tuner.virt.parse_capabilities(
+        synthetic.capabilities_xml(cells=2, cores=4, resctrl=True)
+    )
+    configs = virt_tuner.partition_configs(cells, vms=4, housekeeping=1, llc=0.5)
+    tunings = [config["cpu"]["tuning"] for config in configs]
+    assert [tuning["cachetune"] for tuning in tunings] == [
+        {"0-3": {0: {"level": 3, "type": "both", "size": "8192 KiB"}}},
+        {"0-1": {0: {"level": 3, "type": "both", "size": "8192 KiB"}}},
+        {"0-3": {1: {"level": 3, "type": "both", "size": "8192 KiB"}}},
+        {"0-1": {1: {"level": 3, "type": "both", "size": "8192 KiB"}}},
+    ]
+    assert [tuning["memorytune"] for tuning in tunings] == [
+        {"0-3": {0: 20}},
+        {"0-1": {0: 20}},
+        {"0-3": {1: 20}},
+        {"0-1": {1: 20}},
+    ]
+
+    assert "cachetune" not in virt_tuner.single(cells)["cpu"]["tuning"]
+    with pytest.raises(ValueError):
+        virt_tuner.single(cells, llc=1)
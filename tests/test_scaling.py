@@ -0,0 +1,56 @@
+"""
+Tests of the synthetic topologies and of the scaling of the tuning phases
+"""
+
+import pytest
+
+import virt_tuner
+import virt_tuner.virt
+
+import benchmark
+import synthetic
+
+
+@pytest.mark.parametrize(
+    "cells, cores, threads, cells_per_socket",
+    [(1, 4, 1, 1), (2, 24, 2, 1), (4, 8, 4, 2), (32, 64, 2, 2)],
+)
+def test_synthetic_capabilities(cells, cores, threads, cells_per_socket):
+    """
+    Test the generated capabilities describe the requested topology
+    """
+    topology = virt_tuner.virt.parse_capabilities(
+        synthetic.capabilities_xml(cells, cores, threads, cells_per_socket)
+    )
+    assert len(topology) == cells
+    assert {len(cell.cpus) for cell in topology} == {cores * threads}
+
+    config = virt_tuner.single(topology)
+    assert config["cpu"]["maximum"] == cells * cores * threads
+    assert config["cpu"]["topology"] == {
+        "sockets": cells // cells_per_socket,
+        "cores": cores * cells_per_socket,
+        "threads": threads,
+    }
+
+
+@pytest.mark.benchmark
+def test_scaling():
+    """
+    Check that no tuning phase grows superlinearly with the number of CPUs
+    """
+    measures, exponents = benchmark.run([(2, 16, 2), (8, 32, 2), (32, 32, 2)], 5)
+
+    assert {m.phase for m in measures} == {
+        "parse",
+        "template",
+        "compile",
+        "merge",
+        "serialize",
+    }
+    superlinear = {
+        phase: exponent
+        for phase, exponent in exponents.items()
+        if exponent > benchmark.SUPERLINEAR_THRESHOLD
+    }
+    assert not superlinear
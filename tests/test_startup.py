@@ -0,0 +1,112 @@
+"""
+Regression tests of the startup time of the CLI tool
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+import virt_tuner
+import virt_tuner.lazy
+
+# Cumulated import time of virt_tuner.main in microseconds, only checked in the
+# bench environment. Loading libvirt, ElementTree or multiprocessing exceeds it.
+IMPORT_BUDGET = 75000
+
+# Modules that are only needed to tune definitions
+HEAVY_MODULES = [
+    "libvirt",
+    "xml.etree.ElementTree",
+    "multiprocessing",
+    "socketserver",
+    "virt_tuner.virt",
+    "virt_tuner.xmlutil",
+]
+
+
+def run_python(code, *options):
+    """
+    Run python code in a new interpreter with the source folder in the path
+    """
+    env = dict(os.environ)
+    src_dir = os.path.dirname(os.path.dirname(os.path.abspath(virt_tuner.__file__)))
+    env["PYTHONPATH"] = os.pathsep.join(
+        [src_dir] + [path for path in [env.get("PYTHONPATH")] if path]
+    )
+    return subprocess.run(
+        [sys.executable, *options, "-c", code],
+        env=env,
+        capture_output=True,
+        check=True,
+        text=True,
+    )
+
+
+def import_time():
+    """
+    Measure the cumulated import time of virt_tuner.main in microseconds
+    """
+    process = run_python("import virt_tuner.main", "-X", "importtime")
+    for line in process.stderr.splitlines():
+        fields = [field.strip() for field in line.split("|")]
+        if len(fields) == 3 and fields[2] == "virt_tuner.main":
+            return int(fields[1])
+    raise AssertionError("virt_tuner.main not found in the import times")
+
+
+@pytest.mark.benchmark
+def test_import_time():
+    """
+    Test that importing the CLI module stays within the budget.
+    The best of three runs is used to reduce the noise.
+    """
+    import_time()
+    assert min(import_time() for _ in range(3)) < IMPORT_BUDGET
+
+
+@pytest.mark.parametrize("argv", [None, ["--version"], ["--help"], []])
+def test_fast_paths(argv):
+    """
+    Test that importing the CLI module, the version, help and templates list
+    don't load the tuning modules
+    """
+    code = f"""
+import json, sys
+import virt_tuner.main
+try:
+    if {argv!r} is not None:
+        virt_tuner.main.cli({argv!r})
+except SystemExit:
+    pass
+print(json.dumps(sorted(sys.modules)), file=sys.stderr)
+"""
+    modules = json.loads(run_python(code).stderr.splitlines()[-1])
+    assert [module for module in HEAVY_MODULES if module in modules] == []
+
+
+def test_lazy_missing_module():
+    """
+    Test that a missing lazily imported module only fails when it is used
+    """
+    module = virt_tuner.lazy.lazy_import("virt_tuner_missing_module")
+    assert "virt_tuner_missing_module" not in sys.modules
+    with pytest.raises(ModuleNotFoundError):
+        module.open()
+
+
+def test_without_libvirt():
+    """
+    Test that the sysfs provider, the topology cache and the fleet mode load without
+    the libvirt binding
+    """
+    code = """
+import json, sys
+sys.modules["libvirt"] = None
+import virt_tuner.cache, virt_tuner.fleet, virt_tuner.sysfs
+print(json.dumps(sorted(sys.modules)), file=sys.stderr)
+"""
+    modules = json.loads(run_python(code).stderr.splitlines()[-1])
+    assert "virt_tuner.topology" in modules
@@ -0,0 +1,170 @@
+"""
+Test functions for the virt_tuner.sysfs module
+"""
+
+import os
+
+import pytest
+
+import virt_tuner.main
+import virt_tuner.providers
+import virt_tuner.sysfs
+
+import synthetic
+
+
+def write(root, path, content):
+    """
+    Write a file in the fake sysfs tree, creating its parent folders
+    """
+    full_path = root / path
+    full_path.parent.mkdir(parents=True, exist_ok=True)
+    full_path.write_text(content + "\n")
+
+
+@pytest.fixture(name="root")
+def fixture_root(tmp_path):
+    """
+    Create a fake sysfs tree for a 2 nodes host with 2 cores of 2 threads per node
+    """
+    nodes = {0: [0, 1, 4, 5], 1: [2, 3, 6, 7]}
+    distances = {0: "10 21", 1: "21 10"}
+    for node_id, cpus in nodes.items():
+        node_dir = f"sys/devices/system/node/node{node_id}"
+        write(
+            tmp_path, f"{node_dir}/cpulist", f"{cpus[0]}-{cpus[1]},{cpus[2]}-{cpus[3]}"
+        )
+        write(tmp_path, f"{node_dir}/distance", distances[node_id])
+        write(
+            tmp_path,
+            f"{node_dir}/meminfo",
+            f"Node {node_id} MemTotal:       8388608 kB\n"
+            f"Node {node_id} MemFree:        1048576 kB",
+        )
+        write(tmp_path, f"{node_dir}/hugepages/hugepages-2048kB/nr_hugepages", "0")
+        write(
+            tmp_path,
+            f"{node_dir}/hugepages/hugepages-1048576kB/nr_hugepages",
+            str(node_id + 1),
+        )
+        for cpu in cpus:
+            topology_dir = f"sys/devices/system/cpu/cpu{cpu}/topology"
+            write(tmp_path, f"{topology_dir}/physical_package_id", str(node_id))
+            write(tmp_path, f"{topology_dir}/die_id", "0")
+            write(tmp_path, f"{topology_dir}/core_id", str(cpu % 2))
+            write(
+                tmp_path,
+                f"{topology_dir}/thread_siblings_list",
+                f"{cpu % 4},{cpu % 4 + 4}",
+            )
+    write(tmp_path, "sys/devices/system/node/online", "0-1")
+    return tmp_path
+
+
+def test_parse_cpulist():
+    """
+    Test the parse_cpulist() function
+    """
+    assert virt_tuner.sysfs.parse_cpulist("0-2,8,10-11") == [
+        0,
+        1,
+        2,
+        8,
+        10,
+        11,
+    ]
+    assert virt_tuner.sysfs.parse_cpulist("") == []
+
+
+def test_host_topology(root):
+    """
+    Test the sysfs.host_topology() function
+    """
+    page_size = os.sysconf("SC_PAGE_SIZE") // 1024
+    topology = virt_tuner.providers.host_topology("sysfs", str(root))
+
+    assert [cell.id for cell in topology] == [0, 1]
+    assert [cpu["id"] for cpu in topology[1].cpus] == ["2", "3", "6", "7"]
+    assert topology[1].cpus[2] == {
+        "id": "6",
+        "socket_id": "1",
+        "die_id": "0",
+        "core_id": "0",
+        "siblings": "2,6",
+    }
+    assert topology[0].memory == 8388608
+    assert topology[1].distances == {0: 21, 1: 10}
+    assert topology[1].pages == [
+        {"size": f"{page_size} KiB", "count": (8388608 - 2 * 1048576) // page_size},
+        {"size": "2048 KiB", "count": 0},
+        {"size": "1048576 KiB", "count": 2},
+    ]
+
+
+def test_host_topology_empty(tmp_path):
+    """
+    Test the sysfs.host_topology() function on a tree without NUMA nodes
+    """
+    assert virt_tuner.sysfs.host_topology(str(tmp_path)) == []
+
+
+def test_nic_nodes(root):
+    """
+    Test finding the NUMA node of the network interfaces and bridges
+    """
+    for name, node in [("eth0", "1"), ("eth1", "1"), ("eth2", "0"), ("usb0", "-1")]:
+        write(root, f"sys/class/net/{name}/device/numa_node", node)
+    for bridge, ports in [("br0", ["eth0", "eth1"]), ("br1", ["eth1", "eth2"])]:
+        for port in ports:
+            write(root, f"sys/class/net/{bridge}/brif/{port}/port_no", "1")
+    (root / "sys/class/net/lo").mkdir()
+
+    assert virt_tuner.sysfs.nic_nodes(str(root)) == {
+        "br0": 1,
+        "eth0": 1,
+        "eth1": 1,
+        "eth2": 0,
+    }
+    topology = virt_tuner.sysfs.host_topology(str(root))
+    assert [cell.nics for cell in topology] == [("eth2",), ("br0", "eth0", "eth1")]
+
+
+def test_cli_check(root, caplog):
+    """
+    Test that the host is only checked before writing the tuned definition
+    """
+    (root / "vm.xml").write_text(synthetic.domain_xml())
+    argv = ["--template", "single", "--topology", "sysfs", "--sysfs-root", str(root)]
+    argv += ["--no-cache"]
+    assert virt_tuner.main.cli(argv + ["--dump-plan"]) == 0
+    assert virt_tuner.main.cli(argv + ["--check", str(root / "vm.xml")]) == 1
+    assert not caplog.records
+
+    argv += ["--output", str(root / "tuned.xml"), str(root / "vm.xml")]
+    assert virt_tuner.main.cli(argv) == 1
+    assert "Host cell 0 has 1 free huge pages" in caplog.text
+    assert not (root / "tuned.xml").exists()
+    assert virt_tuner.main.cli(argv + ["--force"]) == 0
+    assert (root / "tuned.xml").exists()
+
+
+def test_cli_check_codes(root):
+    """
+    Test the exit codes of --check: changes and errors are told apart
+    """
+    (root / "vm.xml").write_text(synthetic.domain_xml())
+    (root / "broken.xml").write_text("<domain>")
+    argv = ["--template", "single", "--topology", "sysfs", "--sysfs-root", str(root)]
+    argv += ["--no-cache", "--force"]
+    assert (
+        virt_tuner.main.cli(
+            argv + ["-o", str(root / "tuned.xml"), str(root / "vm.xml")]
+        )
+        == 0
+    )
+
+    assert virt_tuner.main.cli(argv + ["--check", str(root / "tuned.xml")]) == 0
+    assert virt_tuner.main.cli(argv + ["--check", str(root / "vm.xml")]) == 1
+    assert virt_tuner.main.cli(argv + ["--check", str(root / "broken.xml")]) == 2
+    assert virt_tuner.main.cli(argv + ["--check", str(root / "missing.xml")]) == 2
+    assert virt_tuner.main.cli(argv + ["--diff", str(root / "broken.xml")]) == 2
@@ -0,0 +1,71 @@
+"""
+Test functions for the virt_tuner.timings module
+"""
+
+import io
+import json
+
+import pytest
+
+import virt_tuner.timings
+import virt_tuner.xmlutil
+
+
+@pytest.fixture(name="enabled")
+def fixture_enabled(monkeypatch):
+    """
+    Enable the instrumentation for one test
+    """
+    virt_tuner.timings.reset()
+    monkeypatch.setattr(virt_tuner.timings, "ENABLED", True)
+    yield
+    virt_tuner.timings.reset()
+
+
+def test_disabled(monkeypatch):
+    """
+    Test that nothing is recorded when disabled
+    """
+    virt_tuner.timings.reset()
+    monkeypatch.setattr(virt_tuner.timings, "ENABLED", False)
+    with virt_tuner.timings.phase("test"):
+        virt_tuner.timings.count("test")
+    assert virt_tuner.timings.results() == {"phases": {}, "counters": {}}
+
+
+@pytest.mark.usefixtures("enabled")
+def test_report():
+    """
+    Test recording the phases and counters of a merge
+    """
+    virt_tuner.xmlutil.merge_config(
+        "<domain/>", {"cpu": {"tuning": {"vcpupin": {0: "0", 1: "1"}}}}
+    )
+    output = io.StringIO()
+    virt_tuner.timings.report(output)
+    results = json.loads(output.getvalue())
+
+    assert set(results["phases"]) == {
+        "xml.compile",
+        "xml.parse",
+        "xml.apply",
+        "xml.serialize",
+    }
+    assert results["counters"] == {
+        "xml.paths_resolved": 2,
+        "xml.nodes_created": 3,
+        "xml.index_scans": 2,
+        "xml.index_hits": 2,
+    }
+
+
+def test_profile(tmp_path):
+    """
+    Test the profile() context manager
+    """
+    with virt_tuner.timings.profile(str(tmp_path / "stats")):
+        virt_tuner.xmlutil.merge_config("<domain/>", {})
+    assert (tmp_path / "stats").stat().st_size > 0
+
+    with virt_tuner.timings.profile(None):
+        pass
@@ -0,0 +1,67 @@
+"""
+Test functions for the virt_tuner.topology module
+"""
+
+from virt_tuner.topology import Cell, Topology
+
+
+def make_topology():
+    """
+    Create a topology of 2 cells with 2 cores of 2 threads each,
+    listing the CPUs in a different order than the cores
+    """
+    return Topology(
+        [
+            Cell(
+                cell_id,
+                [
+                    {
+                        "id": str(cell_id * 2 + core + thread * 4),
+                        "socket_id": str(cell_id),
+                        "core_id": str(1 - core),
+                        "siblings": f"{cell_id * 2 + core},{cell_id * 2 + core + 4}",
+                    }
+                    for thread in range(2)
+                    for core in range(2)
+                ],
+                1024,
+                {0: 10, 1: 20},
+                [],
+            )
+            for cell_id in range(2)
+        ]
+    )
+
+
+def test_arrays():
+    """
+    Test the conversion of the cells into arrays
+    """
+    topology = make_topology()
+    assert len(topology) == 8
+    assert list(topology.cpu_id) == [0, 1, 4, 5, 2, 3, 6, 7]
+    assert list(topology.node) == [0, 0, 0, 0, 1, 1, 1, 1]
+    assert list(topology.core) == [1, 0, 1, 0, 1, 0, 1, 0]
+    assert list(topology.group) == [0, 1, 0, 1, 2, 3, 2, 3]
+    assert topology.siblings == ["0,4", "1,5", "2,6", "3,7"]
+    assert [list(cell.cpus) for cell in topology.cells] == [[0, 1, 2, 3], [4, 5, 6, 7]]
+
+
+def test_order_groups():
+    """
+    Test sorting and grouping the CPUs
+    """
+    topology = make_topology()
+    indices = topology.order(range(len(topology)), "socket", "core")
+    assert indices == [1, 3, 0, 2, 5, 7, 4, 6]
+    assert topology.groups(indices) == [[1, 3], [0, 2], [5, 7], [4, 6]]
+
+
+def test_cores():
+    """
+    Test getting the cores of a cell
+    """
+    topology = make_topology()
+    cores = topology.cores(topology.cells[1])
+    assert cores == [[5, 7], [4, 6]]
+    assert topology.ids(cores[0]) == [3, 7]
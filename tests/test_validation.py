@@ -0,0 +1,95 @@
+"""
+Test functions for the virt_tuner.validation module
+"""
+
+import pytest
+
+import virt_tuner
+import virt_tuner.hugepages
+import virt_tuner.validation
+import virt_tuner.virt
+
+import synthetic
+
+
+def make_cells(huge_pages=29):
+    """
+    Create the cells of a synthetic host with 2 cells of 4 cores with 2 threads
+    """
+    return virt_tuner.virt.parse_capabilities(
+        synthetic.capabilities_xml(cells=2, cores=4, huge_pages=huge_pages)
+    )
+
+
+def test_check_valid():
+    """
+    Test that the configurations of the built-in templates pass the checks
+    """
+    cells = make_cells()
+    assert virt_tuner.validation.check(cells, virt_tuner.single(cells)) == []
+    for config in virt_tuner.partition_configs(cells, vms=4, housekeeping=1):
+        assert virt_tuner.validation.check(cells, config) == []
+
+
+def test_check_hugepages(tmp_path):
+    """
+    Test checking the huge pages free on each cell
+    """
+    cells = make_cells(huge_pages=16)
+    config = virt_tuner.single(cells)
+    assert virt_tuner.validation.check(cells, config) == [
+        "Host cell 0 has 16 free huge pages of 1048576 KiB instead of 29",
+        "Host cell 1 has 16 free huge pages of 1048576 KiB instead of 29",
+    ]
+    assert virt_tuner.validation.check(cells, config, pages=False) == []
+    with pytest.raises(ValueError):
+        virt_tuner.validation.validate(cells, config)
+
+    # The reserved pages already used by running guests are not free
+    cells = make_cells()
+    for node, free in enumerate([29, 10]):
+        path = tmp_path / virt_tuner.hugepages.counter_path(node, 1024**2, "")
+        path.mkdir(parents=True)
+        (path / "nr_hugepages").write_text("29\n")
+        (path / "free_hugepages").write_text(f"{free}\n")
+    assert virt_tuner.validation.check(cells, config) == []
+    assert virt_tuner.validation.check(cells, config, root=str(tmp_path)) == [
+        "Host cell 1 has 10 free huge pages of 1048576 KiB instead of 29",
+    ]
+
+
+def test_check_mixed_threads():
+    """
+    Test that a host with mixed SMT cores is reported
+    """
+    cells = make_cells()
+    # Disable the second thread of the first core: CPU 8 is the sibling of CPU 0
+    cpus = [cpu for cpu in cells[0].cpus if cpu["id"] != "8"]
+    cpus[0] = dict(cpus[0], siblings="0")
+    cells[0] = cells[0]._replace(cpus=cpus)
+
+    problems = virt_tuner.validation.check(cells, virt_tuner.single(cells))
+    assert "The host cores run 1 or 2 virtual CPUs: the threads per core differ" in (
+        problems
+    )
+
+
+def test_check_vcpus():
+    """
+    Test checking the virtual CPUs against the pinning and the guest topology
+    """
+    config = {
+        "cpu": {
+            "maximum": 4,
+            "topology": {"sockets": 1, "cores": 1, "threads": 2},
+            "tuning": {"vcpupin": {0: "0,8", 1: "0,8", 2: "99", 5: "1"}},
+        },
+    }
+    assert virt_tuner.validation.check(make_cells(), config) == [
+        "The guest CPU topology has 2 CPUs instead of 4",
+        "Virtual CPUs 3 aren't pinned",
+        "Virtual CPUs 5 are pinned but don't exist",
+        "Host CPUs 99 are pinned but don't exist",
+        "4 virtual CPUs are pinned on only 3 host CPUs",
+        "The host cores run 1 or 2 virtual CPUs: the threads per core differ",
+    ]
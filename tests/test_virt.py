@@ -2,8 +2,14 @@
 Test functions for the virt_tuner.virt module
 """
 
-from unittest.mock import MagicMock
+from unittest.mock import patch
+from xml.etree import ElementTree
+
+import libvirt
+import pytest
+
 import virt_tuner.virt
+import virt_tuner.xmlutil
 
 CAPS = """
 <capabilities>
@@ -146,9 +152,21 @@ CAPS = """
       </cells>
     </topology>
     <cache>
-      <bank id='0' level='3' type='both' size='36608' unit='KiB' cpus='0-23,48-71'/>
-      <bank id='1' level='3' type='both' size='36608' unit='KiB' cpus='24-47,72-95'/>
+      <bank id='0' level='3' type='both' size='36608' unit='KiB' cpus='0-23,48-71'>
+        <control granularity='3328' unit='KiB' type='both' maxAllocs='16'/>
+      </bank>
+      <bank id='1' level='3' type='both' size='36608' unit='KiB' cpus='24-47,72-95'>
+        <control granularity='3328' unit='KiB' type='both' maxAllocs='16'/>
+      </bank>
     </cache>
+    <memory_bandwidth>
+      <node id='0' cpus='0-23,48-71'>
+        <control granularity='10' min='10' maxAllocs='8'/>
+      </node>
+      <node id='1' cpus='24-47,72-95'>
+        <control granularity='10' min='10' maxAllocs='8'/>
+      </node>
+    </memory_bandwidth>
   </host>
 </capabilities>
 """
@@ -158,11 +176,10 @@ def test_host_topology():
     """
     test the virt.host_topology() function
     """
-    libvirt_mock = MagicMock()
-    libvirt_mock.open.return_value.getCapabilities.return_value = CAPS
-    virt_tuner.virt.libvirt = libvirt_mock
+    with patch("virt_tuner.virt.libvirt") as libvirt_mock:
+        libvirt_mock.open.return_value.getCapabilities.return_value = CAPS
+        topology = virt_tuner.virt.host_topology()
 
-    topology = virt_tuner.virt.host_topology()
     assert len(topology) == 2
     assert len(topology[0].cpus) == 48
     assert topology[0].id == 0
@@ -179,3 +196,65 @@ def test_host_topology():
         {"size": "2048 KiB", "count": 0},
         {"size": "1048576 KiB", "count": 0},
     ]
+    assert topology[1].caches == (
+        {
+            "id": 1,
+            "level": 3,
+            "type": "both",
+            "size": 36608,
+            "cpus": "24-47,72-95",
+            "controls": [
+                {"type": "both", "granularity": 3328, "min": 3328, "max_allocs": 16}
+            ],
+        },
+    )
+    assert topology[1].bandwidth == (
+        {
+            "id": 1,
+            "cpus": "24-47,72-95",
+            "granularity": 10,
+            "min": 10,
+            "max_allocs": 8,
+        },
+    )
+
+
+@pytest.fixture(name="cnx")
+def fixture_cnx():
+    """
+    Open a connection to the libvirt test driver
+    """
+    cnx = libvirt.open("test:///default")
+    yield cnx
+    cnx.close()
+
+
+def test_tune_domains(cnx):
+    """
+    Test the virt.tune_domains() function against the libvirt test driver
+    """
+    plan = virt_tuner.xmlutil.compile_config(
+        {"cpu": {"maximum": 2, "features": {"x2apic": "require"}}}
+    )
+    uuid = cnx.lookupByName("test").UUIDString()
+
+    results = virt_tuner.virt.tune_domains(cnx, [uuid, "missing"], plan)
+
+    assert results[0] == virt_tuner.virt.DomainResult(uuid, None)
+    assert results[1].domain == "missing"
+    assert results[1].error is not None
+
+    definition = ElementTree.fromstring(
+        cnx.lookupByName("test").XMLDesc(libvirt.VIR_DOMAIN_XML_INACTIVE)
+    )
+    assert definition.find("vcpu").text == "2"
+    assert definition.find("cpu/feature[@name='x2apic']").get("policy") == "require"
+
+
+def test_tune_domain_unchanged(cnx):
+    """
+    Test that tune_domain() doesn't redefine a domain already tuned
+    """
+    plan = virt_tuner.xmlutil.compile_config({"cpu": {"maximum": 4}})
+    assert virt_tuner.virt.tune_domain(cnx, "test", plan)
+    assert not virt_tuner.virt.tune_domain(cnx, "test", plan)
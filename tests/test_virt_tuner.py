@@ -5,6 +5,8 @@ Tests for the virt_tuner module
 from unittest.mock import patch
 import pytest
 import virt_tuner
+import virt_tuner.virt
+from virt_tuner.topology import Cell
 
 
 @pytest.mark.parametrize(
@@ -20,7 +22,7 @@ def test_single(cell_mems, expected_cell_pages):
     Test the virt_tuner.single() function
     """
     cells = [
-        virt_tuner.virt.Cell(
+        Cell(
             0,
             [
                 {"id": 0, "socket_id": 0, "core_id": 0, "siblings": "0,2"},
@@ -36,7 +38,7 @@ def test_single(cell_mems, expected_cell_pages):
                 {"size": "1048576 KiB", "count": 0},
             ],
         ),
-        virt_tuner.virt.Cell(
+        Cell(
             1,
             [
                 {"id": 4, "socket_id": 1, "core_id": 0, "siblings": "4,6"},
@@ -52,7 +54,7 @@ def test_single(cell_mems, expected_cell_pages):
                 {"size": "1048576 KiB", "count": 0},
             ],
         ),
-        virt_tuner.virt.Cell(
+        Cell(
             2,
             [
                 {"id": 8, "socket_id": 2, "core_id": 0, "siblings": "8,10"},
@@ -68,7 +70,7 @@ def test_single(cell_mems, expected_cell_pages):
                 {"size": "1048576 KiB", "count": 0},
             ],
         ),
-        virt_tuner.virt.Cell(
+        Cell(
             3,
             [
                 {"id": 12, "socket_id": 3, "core_id": 0, "siblings": "12,14"},
@@ -123,22 +125,22 @@ def test_single(cell_mems, expected_cell_pages):
                 },
                 "numa": {
                     0: {
-                        "cpus": "0,1,2,3",
+                        "cpus": "0-3",
                         "memory": str(expected_cell_pages) + " GiB",
                         "distances": {"0": 10, "1": 20, "2": 20, "3": 20},
                     },
                     1: {
-                        "cpus": "4,5,6,7",
+                        "cpus": "4-7",
                         "memory": str(expected_cell_pages) + " GiB",
                         "distances": {"0": 20, "1": 10, "2": 20, "3": 20},
                     },
                     2: {
-                        "cpus": "8,9,10,11",
+                        "cpus": "8-11",
                         "memory": str(expected_cell_pages) + " GiB",
                         "distances": {"0": 20, "1": 20, "2": 10, "3": 20},
                     },
                     3: {
-                        "cpus": "12,13,14,15",
+                        "cpus": "12-15",
                         "memory": str(expected_cell_pages) + " GiB",
                         "distances": {"0": 20, "1": 20, "2": 20, "3": 10},
                     },
@@ -147,13 +149,13 @@ def test_single(cell_mems, expected_cell_pages):
             "numatune": {
                 "memory": {
                     "mode": "strict",
-                    "nodeset": "0,1,2,3",
+                    "nodeset": "0-3",
                 },
                 "memnodes": {
-                    0: {"mode": "strict", "nodeset": 0},
-                    1: {"mode": "strict", "nodeset": 1},
-                    2: {"mode": "strict", "nodeset": 2},
-                    3: {"mode": "strict", "nodeset": 3},
+                    0: {"mode": "strict", "nodeset": "0"},
+                    1: {"mode": "strict", "nodeset": "1"},
+                    2: {"mode": "strict", "nodeset": "2"},
+                    3: {"mode": "strict", "nodeset": "3"},
                 },
             },
             "hypervisor_features": {"kvm-hint-dedicated": True},
@@ -171,3 +173,292 @@ def test_single(cell_mems, expected_cell_pages):
                 },
             },
         }
+
+
+def make_cells(count, cores, memory=16 * 1024**2):
+    """
+    Create count cells of cores cores with 2 threads each
+    """
+    threads_offset = count * cores
+    return [
+        Cell(
+            cell_id,
+            [
+                {
+                    "id": str(cpu_id + thread * threads_offset),
+                    "socket_id": str(cell_id),
+                    "core_id": str(core),
+                    "siblings": f"{cpu_id},{cpu_id + threads_offset}",
+                }
+                for core, cpu_id in enumerate(
+                    range(cell_id * cores, (cell_id + 1) * cores)
+                )
+                for thread in range(2)
+            ],
+            memory,
+            {other: 10 if other == cell_id else 21 for other in range(count)},
+            [{"size": "4 KiB", "count": memory // 4}],
+        )
+        for cell_id in range(count)
+    ]
+
+
+@pytest.mark.parametrize(
+    "params, expected",
+    [
+        (
+            {"vms": 2},
+            [
+                ({0: "0-3"}, "0", {0: "0,4", 1: "0,4", 2: "1,5", 3: "1,5"}, 14),
+                ({0: "0-3"}, "1", {0: "2,6", 1: "2,6", 2: "3,7", 3: "3,7"}, 14),
+            ],
+        ),
+        (
+            {"vms": 2, "layout": "1;0"},
+            [
+                ({0: "0-3"}, "1", {0: "2,6", 1: "2,6", 2: "3,7", 3: "3,7"}, 14),
+                ({0: "0-3"}, "0", {0: "0,4", 1: "0,4", 2: "1,5", 3: "1,5"}, 14),
+            ],
+        ),
+        (
+            {"vms": 4},
+            [
+                ({0: "0-1"}, "0", {0: "0,4", 1: "0,4"}, 7),
+                ({0: "0-1"}, "0", {0: "1,5", 1: "1,5"}, 7),
+                ({0: "0-1"}, "1", {0: "2,6", 1: "2,6"}, 7),
+                ({0: "0-1"}, "1", {0: "3,7", 1: "3,7"}, 7),
+            ],
+        ),
+        (
+            {"vms": 1},
+            [
+                (
+                    {0: "0-3", 1: "4-7"},
+                    "0-1",
+                    {
+                        0: "0,4",
+                        1: "0,4",
+                        2: "1,5",
+                        3: "1,5",
+                        4: "2,6",
+                        5: "2,6",
+                        6: "3,7",
+                        7: "3,7",
+                    },
+                    28,
+                ),
+            ],
+        ),
+    ],
+    ids=["one cell per VM", "layout", "half cell per VM", "one VM"],
+)
+def test_partition_configs(params, expected):
+    """
+    Test the virt_tuner.partition_configs() function
+    """
+    configs = virt_tuner.partition_configs(make_cells(2, 2), **params)
+    assert [
+        (
+            {cell_id: cell["cpus"] for cell_id, cell in config["cpu"]["numa"].items()},
+            config["numatune"]["memory"]["nodeset"],
+            config["cpu"]["tuning"]["vcpupin"],
+            int(config["mem"]["boot"].split(" ")[0]),
+        )
+        for config in configs
+    ] == expected
+
+
+def test_partition():
+    """
+    Test the virt_tuner.partition() function
+    """
+    config = virt_tuner.partition(make_cells(4, 2), vms=2, index=1)
+    assert config["cpu"]["topology"] == {"sockets": 2, "cores": 2, "threads": 2}
+    assert config["cpu"]["numa"][1]["distances"] == {0: 21, 1: 10}
+    assert config["numatune"]["memnodes"] == {
+        0: {"mode": "strict", "nodeset": "2"},
+        1: {"mode": "strict", "nodeset": "3"},
+    }
+
+
+@pytest.mark.parametrize(
+    "params",
+    [{"vms": 3}, {"vms": 5}, {"vms": 6}, {"layout": "0,1;1"}, {"layout": "2"}, {}],
+)
+def test_partition_errors(params):
+    """
+    Test the virt_tuner.partition() function with impossible partitions
+    """
+    with pytest.raises(ValueError):
+        virt_tuner.partition_configs(make_cells(2, 2), **params)
+
+
+def test_single_placement():
+    """
+    Test the memory policies of the single template on sub-NUMA clusters and far memory
+    """
+    cells = [
+        cell._replace(
+            distances={
+                other: (
+                    10 if other == cell.id else 11 if other // 2 == cell.id // 2 else 21
+                )
+                for other in range(4)
+            }
+        )
+        for cell in make_cells(4, 2)
+    ]
+    assert virt_tuner.single(cells)["numatune"]["memnodes"] == {
+        0: {"mode": "interleave", "nodeset": "0-1"},
+        1: {"mode": "interleave", "nodeset": "0-1"},
+        2: {"mode": "interleave", "nodeset": "2-3"},
+        3: {"mode": "interleave", "nodeset": "2-3"},
+    }
+
+    cells = [
+        cell._replace(distances={**cell.distances, 2: 14}) for cell in make_cells(2, 2)
+    ]
+    cells.append(
+        Cell(
+            2,
+            [],
+            32 * 1024**2,
+            {0: 14, 1: 14, 2: 10},
+            [{"size": "4 KiB", "count": 8 * 1024**2}],
+        )
+    )
+    config = virt_tuner.single(cells)
+    assert config["numatune"]["memnodes"] == {
+        0: {"mode": "strict", "nodeset": "0"},
+        1: {"mode": "strict", "nodeset": "1"},
+        2: {"mode": "preferred", "nodeset": "2"},
+    }
+    assert config["cpu"]["numa"][2] == {
+        "cpus": None,
+        "memory": "29 GiB",
+        "distances": {0: 14, 1: 14, 2: 10},
+    }
+
+    config = virt_tuner.partition(cells, layout="0,2")
+    assert config["cpu"]["topology"] == {"sockets": 1, "cores": 2, "threads": 2}
+    assert config["numatune"]["memnodes"][1] == {"mode": "preferred", "nodeset": "2"}
+    assert len(virt_tuner.partition_configs(cells, vms=2)) == 2
+
+
+def test_single_reuse_cells():
+    """
+    Test that the single template leaves the cells untouched and can reuse them
+    """
+    cells = make_cells(2, 2)
+    cpu_ids = [cpu["id"] for cell in cells for cpu in cell.cpus]
+    assert virt_tuner.single(cells) == virt_tuner.single(cells)
+    assert [cpu["id"] for cell in cells for cpu in cell.cpus] == cpu_ids
+
+
+def test_parse_parameters():
+    """
+    Test converting the template parameters
+    """
+    template = virt_tuner.templates["partition"]
+    assert virt_tuner.parse_parameters(template, ["vms=2", "layout=0;1"]) == {
+        "vms": 2,
+        "layout": "0;1",
+        "index": 0,
+        "housekeeping": 0,
+        "iothreads": 0,
+        "disk_io": None,
+        "net_queues": 0,
+        "llc": 0,
+    }
+    with pytest.raises(ValueError):
+        virt_tuner.parse_parameters(template, ["unknown=1"])
+
+
+def test_single_housekeeping():
+    """
+    Test reserving housekeeping cores with the single template
+    """
+    config = virt_tuner.single(make_cells(2, 4), housekeeping=1, iothreads=3)
+    assert config["cpu"]["topology"] == {"sockets": 2, "cores": 3, "threads": 2}
+    assert config["cpu"]["iothreads"] == 3
+    tuning = config["cpu"]["tuning"]
+    assert sorted(set(tuning["vcpupin"].values())) == [
+        "1,9",
+        "2,10",
+        "3,11",
+        "5,13",
+        "6,14",
+        "7,15",
+    ]
+    assert tuning["emulatorpin"] == "0,4,8,12"
+    assert tuning["iothreadpin"] == {1: "0,8", 2: "4,12", 3: "0,8"}
+    assert config["cpu"]["numa"][1]["cpus"] == "6-11"
+
+
+def test_partition_housekeeping():
+    """
+    Test reserving housekeeping cores with the partition template
+    """
+    configs = virt_tuner.partition_configs(make_cells(2, 3), vms=4, housekeeping=1)
+    assert [config["cpu"]["tuning"] for config in configs] == [
+        {"vcpupin": {0: "1,7", 1: "1,7"}, "emulatorpin": "0,6"},
+        {"vcpupin": {0: "2,8", 1: "2,8"}, "emulatorpin": "0,6"},
+        {"vcpupin": {0: "4,10", 1: "4,10"}, "emulatorpin": "3,9"},
+        {"vcpupin": {0: "5,11", 1: "5,11"}, "emulatorpin": "3,9"},
+    ]
+
+    with pytest.raises(ValueError):
+        virt_tuner.partition_configs(make_cells(2, 3), vms=2, housekeeping=3)
+
+
+def test_single_storage():
+    """
+    Test tuning the disks with the single template
+    """
+    config = virt_tuner.single(make_cells(2, 4), disk_io="io_uring")
+    assert config["cpu"]["iothreads"] == 2
+    assert config["storage"] == {
+        "iothreads": 2,
+        "queues": 8,
+        "cache": "none",
+        "io": "io_uring",
+    }
+    assert "storage" not in virt_tuner.single(make_cells(2, 4))
+
+    with pytest.raises(ValueError):
+        virt_tuner.single(make_cells(2, 4), disk_io="threads")
+
+
+def test_partition_network():
+    """
+    Test tuning the network interfaces with the partition template
+    """
+    cells = make_cells(2, 4)
+    cells[1] = cells[1]._replace(nics=("eth0", "br0"))
+    config = virt_tuner.partition(cells, layout="1", net_queues=32)
+    assert config["network"] == {
+        "queues": 8,
+        "rx_queue_size": 1024,
+        "tx_queue_size": 1024,
+        "nodes": {"eth0": 0, "br0": 0},
+    }
+    assert "network" not in virt_tuner.single(cells)
+
+
+def test_realtime():
+    """
+    Test the virt_tuner.realtime() function
+    """
+    config = virt_tuner.realtime(make_cells(2, 4), priority=10)
+    assert config["cpu"]["maximum"] == 12
+    tuning = config["cpu"]["tuning"]
+    assert tuning["vcpusched"] == {"0-11": {"scheduler": "fifo", "priority": 10}}
+    assert tuning["emulatorpin"] == "0,4,8,12"
+    assert config["mem"]["locked"]
+    assert config["mem"]["balloon"] is False
+    assert config["hypervisor_features"]["pmu"] is False
+
+    with pytest.raises(ValueError):
+        virt_tuner.realtime(make_cells(2, 4), housekeeping=0)
+    with pytest.raises(ValueError):
+        virt_tuner.realtime(make_cells(2, 4), priority=100)
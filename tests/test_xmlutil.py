@@ -2,11 +2,15 @@
 Test functions for module virt_tuner.xmlutil
 """
 
+import io
+import os
+import stat
 from xml.etree import ElementTree
 
 import pytest
 
 import virt_tuner.xmlutil
+from virt_tuner.xmlutil import Operation
 
 
 @pytest.fixture(name="doc")
@@ -247,3 +251,384 @@ def test_merge_config(doc):
     assert merged_doc.find("memoryBacking/hugepages/page[@size='1']").get("unit") == "G"
     assert merged_doc.find("clock/timer[@name='rtc']").get("tickpolicy") == "catchup"
     assert merged_doc.find("clock/timer[@name='hpet']").get("present") == "no"
+
+
+@pytest.mark.parametrize(
+    "segment, expected",
+    [
+        ("cpu", ("cpu", None, None, None)),
+        ("hint-dedicated", ("hint-dedicated", None, None, None)),
+        ("vcpupin[@vcpu='12']", ("vcpupin", "vcpu", "12", None)),
+        ('timer[@name="rtc"]', ("timer", "name", "rtc", None)),
+        ("page[2]", ("page", None, None, 2)),
+    ],
+)
+def test_parse_segment(segment, expected):
+    """
+    Test the parse_segment() function
+    """
+    assert virt_tuner.xmlutil.parse_segment(segment) == expected
+
+
+def test_get_node_indexed(doc):
+    """
+    Test that get_node() keeps its index in sync with the document
+    """
+    for vcpu in range(64):
+        virt_tuner.xmlutil.set_attribute(
+            doc, ["cputune", f"vcpupin[@vcpu='{vcpu}']"], "cpuset", vcpu
+        )
+    virt_tuner.xmlutil.set_attribute(
+        doc, ["cputune", "vcpupin[@vcpu='3']"], "cpuset", "3,35"
+    )
+    assert len(doc.findall("cputune/vcpupin")) == 64
+    assert doc.find("cputune/vcpupin[@vcpu='3']").get("cpuset") == "3,35"
+    assert virt_tuner.xmlutil.get_node(
+        doc, ["cputune", "vcpupin[@cpuset='3,35']"]
+    ) == doc.find("cputune/vcpupin[@vcpu='3']")
+
+    virt_tuner.xmlutil.remove_node(doc, ["cpu", "model"])
+    assert doc.find("cpu/model") is None
+    new_model = virt_tuner.xmlutil.get_node(doc, ["cpu", "model"])
+    assert doc.find("cpu/model") is new_model
+
+    # The removed descendants are forgotten too: their ids may be reused
+    index = virt_tuner.xmlutil.get_index(doc)
+    removed = {id(node) for node in doc.find("cputune").iter()}
+    virt_tuner.xmlutil.remove_node(doc, ["cputune"])
+    # pylint: disable-next=protected-access
+    assert not removed & (set(index._children) | set(index._parents))
+
+
+def test_remove_node_twice(doc):
+    """
+    Test removing nodes created again by the previous operations on the same document
+    """
+    plan = virt_tuner.xmlutil.compile_config({"mem": {"balloon": False}})
+    for _ in range(3):
+        virt_tuner.xmlutil.apply_plan(doc, plan)
+    assert [node.get("model") for node in doc.findall("devices/memballoon")] == [
+        "none"
+    ]
+
+    for flag in [True, False, True, False]:
+        virt_tuner.xmlutil.apply_plan(
+            doc, virt_tuner.xmlutil.compile_config({"mem": {"nosharepages": flag}})
+        )
+        assert len(doc.findall("memoryBacking/nosharepages")) == int(flag)
+
+
+def test_compile_config():
+    """
+    Test the compile_config() function and the merge plan serialization
+    """
+    config = {
+        "cpu": {
+            "maximum": 2,
+            "mode": "host-passthrough",
+            "tuning": {"vcpupin": {0: "0,2", 1: "1,3"}},
+        },
+        "mem": {"nosharepages": False, "hugepages": [{"size": "1 G"}]},
+    }
+    plan = virt_tuner.xmlutil.compile_config(config)
+
+    assert plan == (
+        Operation("text", ("vcpu",), None, "2"),
+        Operation("set", ("cpu",), "mode", "host-passthrough"),
+        Operation("unset", ("cpu",), "match", None),
+        Operation("set", ("cputune", "vcpupin[@vcpu='0']"), "cpuset", "0,2"),
+        Operation("set", ("cputune", "vcpupin[@vcpu='1']"), "cpuset", "1,3"),
+        Operation("remove", ("memoryBacking", "nosharepages"), None, None),
+        Operation("set", ("memoryBacking", "hugepages", "page[1]"), "size", "1"),
+        Operation("set", ("memoryBacking", "hugepages", "page[1]"), "unit", "G"),
+    )
+    serialized = virt_tuner.xmlutil.plan_to_json(plan)
+    assert virt_tuner.xmlutil.plan_from_json(serialized) == plan
+
+
+def test_merge_cpu_config_threads(doc):
+    """
+    Test merging the emulator and I/O threads pinning
+    """
+    virt_tuner.xmlutil.merge_cpu_config(
+        doc,
+        {
+            "iothreads": 2,
+            "tuning": {
+                "vcpupin": {0: "1,5"},
+                "emulatorpin": "0,4",
+                "iothreadpin": {1: "0,4", 2: "0,4"},
+            },
+        },
+    )
+    assert doc.find("iothreads").text == "2"
+    assert doc.find("cputune/emulatorpin").get("cpuset") == "0,4"
+    assert [
+        (node.get("iothread"), node.get("cpuset"))
+        for node in doc.findall("cputune/iothreadpin")
+    ] == [("1", "0,4"), ("2", "0,4")]
+
+
+def test_merge_plan():
+    """
+    Test applying the same merge plan on several documents
+    """
+    plan = virt_tuner.xmlutil.compile_config(
+        {"cpu": {"mode": "host-passthrough"}, "mem": {"nosharepages": False}}
+    )
+
+    for definition in [
+        "<domain><cpu mode='custom' match='exact'/></domain>",
+        "<domain><memoryBacking><nosharepages/></memoryBacking></domain>",
+    ]:
+        merged_doc = ElementTree.fromstring(
+            virt_tuner.xmlutil.merge_plan(definition, plan)
+        )
+        assert merged_doc.find("cpu").attrib == {"mode": "host-passthrough"}
+        assert merged_doc.find("memoryBacking/nosharepages") is None
+
+
+def test_merge_stream():
+    """
+    Test the merge_stream() function gives the same result as merge_config()
+    """
+    config = {"cpu": {"maximum": 2, "mode": "host-passthrough"}}
+    definition = b"<domain><cpu mode='custom' match='exact'/></domain>"
+    output = io.BytesIO()
+    virt_tuner.xmlutil.merge_stream(
+        io.BytesIO(definition), output, virt_tuner.xmlutil.compile_config(config)
+    )
+    expected = virt_tuner.xmlutil.merge_config(definition, config) + b"\n"
+    assert output.getvalue() == expected
+
+
+def test_merge_file(tmp_path):
+    """
+    Test that merge_file() doesn't leave partial files on errors
+    """
+    plan = virt_tuner.xmlutil.compile_config({"cpu": {"maximum": 2}})
+    output_path = tmp_path / "out.xml"
+    output_path.write_text("<domain/>")
+    (tmp_path / "broken.xml").write_text("<domain>")
+    (tmp_path / "valid.xml").write_text("<domain/>")
+
+    with pytest.raises(ElementTree.ParseError):
+        virt_tuner.xmlutil.merge_file(
+            str(tmp_path / "broken.xml"), str(output_path), plan
+        )
+    assert output_path.read_text() == "<domain/>"
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        "broken.xml",
+        "out.xml",
+        "valid.xml",
+    ]
+
+    virt_tuner.xmlutil.merge_file(str(tmp_path / "valid.xml"), str(output_path), plan)
+    assert ElementTree.parse(str(output_path)).getroot().find("vcpu").text == "2"
+
+
+def test_merge_file_mode(tmp_path):
+    """
+    Test that merge_file() keeps the permissions of the file it replaces
+    """
+    plan = virt_tuner.xmlutil.compile_config({"cpu": {"maximum": 2}})
+    (tmp_path / "valid.xml").write_text("<domain/>")
+    output_path = tmp_path / "out.xml"
+    output_path.write_text("<domain/>")
+    output_path.chmod(0o600)
+
+    virt_tuner.xmlutil.merge_file(str(tmp_path / "valid.xml"), str(output_path), plan)
+    assert stat.S_IMODE(output_path.stat().st_mode) == 0o600
+
+    new_path = tmp_path / "new.xml"
+    virt_tuner.xmlutil.merge_file(str(tmp_path / "valid.xml"), str(new_path), plan)
+    umask = os.umask(0)
+    os.umask(umask)
+    assert stat.S_IMODE(new_path.stat().st_mode) == 0o666 & ~umask
+
+
+def test_merge_storage():
+    """
+    Test tuning the disks and leaving the unknown devices alone
+    """
+    devices = """<devices>
+      <disk type='file' device='disk'>
+        <driver name='qemu' type='qcow2'/><target dev='vda' bus='virtio'/>
+      </disk>
+      <disk type='block' device='disk'><target dev='vdb' bus='virtio'/></disk>
+      <disk type='file' device='disk'><target dev='sda' bus='scsi'/></disk>
+      <disk type='network' device='disk'><target dev='vdc' bus='virtio'/></disk>
+      <disk type='file' device='cdrom'><target dev='hda' bus='ide'/></disk>
+      <disk type='file' device='disk'><target dev='hdb' bus='sata'/></disk>
+      <controller type='scsi' index='0' model='virtio-scsi'/>
+      <controller type='scsi' index='1' model='lsilogic'/>
+      <interface type='network'/>
+    </devices>"""
+    plan = virt_tuner.xmlutil.compile_config(
+        {"storage": {"iothreads": 2, "queues": 4, "cache": "none", "io": "native"}}
+    )
+    doc = ElementTree.fromstring(
+        virt_tuner.xmlutil.merge_plan(f"<domain>{devices}</domain>", plan)
+    )
+    drivers = [disk.find("driver") for disk in doc.findall("devices/disk")]
+    assert [driver.attrib if driver is not None else None for driver in drivers] == [
+        {
+            "name": "qemu",
+            "type": "qcow2",
+            "cache": "none",
+            "io": "native",
+            "iothread": "1",
+            "queues": "4",
+        },
+        {
+            "name": "qemu",
+            "cache": "none",
+            "io": "native",
+            "iothread": "2",
+            "queues": "4",
+        },
+        {"name": "qemu", "cache": "none", "io": "native"},
+        None,
+        None,
+        None,
+    ]
+    controllers = doc.findall("devices/controller")
+    assert controllers[0].find("driver").attrib == {"iothread": "1", "queues": "4"}
+    assert controllers[1].find("driver") is None
+
+    # Documents without devices are left alone
+    assert virt_tuner.xmlutil.merge_plan("<domain/>", plan) == b"<domain />"
+
+
+def test_merge_network():
+    """
+    Test tuning the virtio interfaces and placing them on the NUMA node of their device
+    """
+    devices = """<devices>
+      <controller type='pci' index='0' model='pcie-root'/>
+      <controller type='pci' index='1' model='pcie-root-port'/>
+      <interface type='bridge'>
+        <source bridge='br0'/><model type='virtio'/>
+        <address type='pci' domain='0x0000' bus='0x01' slot='0x00' function='0x0'/>
+      </interface>
+      <interface type='direct'>
+        <source dev='eth1' mode='passthrough'/><model type='virtio'/>
+      </interface>
+      <interface type='vhostuser'><model type='virtio'/></interface>
+      <interface type='network'>
+        <source network='default'/><model type='virtio'/><driver name='qemu'/>
+      </interface>
+      <interface type='user'><model type='virtio'/></interface>
+      <interface type='bridge'><source bridge='br0'/><model type='e1000e'/></interface>
+    </devices>"""
+    plan = virt_tuner.xmlutil.compile_config(
+        {
+            "network": {
+                "queues": 4,
+                "rx_queue_size": 1024,
+                "tx_queue_size": 1024,
+                "nodes": {"br0": 1, "eth1": 1},
+            }
+        }
+    )
+    tuned = virt_tuner.xmlutil.merge_plan(f"<domain>{devices}</domain>", plan)
+    doc = ElementTree.fromstring(tuned)
+    drivers = [iface.find("driver") for iface in doc.findall("devices/interface")]
+    assert [driver.attrib if driver is not None else None for driver in drivers] == [
+        {"name": "vhost", "queues": "4", "rx_queue_size": "1024"},
+        {"name": "vhost", "queues": "4", "rx_queue_size": "1024"},
+        {"queues": "4", "rx_queue_size": "1024", "tx_queue_size": "1024"},
+        {"name": "qemu"},
+        None,
+        None,
+    ]
+
+    controllers = [
+        (ctrl.get("index"), ctrl.get("model"), ctrl.findtext("target/node"))
+        for ctrl in doc.findall("devices/controller")
+    ]
+    assert controllers == [
+        ("0", "pcie-root", None),
+        ("1", "pcie-root-port", None),
+        ("2", "pcie-expander-bus", "1"),
+        ("3", "pcie-root-port", None),
+        ("4", "pcie-root-port", None),
+    ]
+    ports = doc.findall("devices/controller[@model='pcie-root-port']")
+    assert [port.find("address").get("bus") for port in ports[1:]] == ["0x02"] * 2
+    assert [port.find("address").get("slot") for port in ports[1:]] == [
+        "0x00",
+        "0x01",
+    ]
+    interfaces = doc.findall("devices/interface")
+    assert [iface.find("address").get("bus") for iface in interfaces[:2]] == [
+        "0x03",
+        "0x04",
+    ]
+    assert interfaces[2].find("address") is None
+
+    # The interfaces already on the right node are left alone
+    assert virt_tuner.xmlutil.merge_plan(tuned, plan) == tuned
+
+
+def test_merge_realtime():
+    """
+    Test merging the realtime scheduler, locked memory, PMU and memory balloon settings
+    """
+    plan = virt_tuner.xmlutil.compile_config(
+        {
+            "cpu": {
+                "tuning": {"vcpusched": {"0-3": {"scheduler": "fifo", "priority": 1}}}
+            },
+            "mem": {"locked": True, "balloon": False},
+            "hypervisor_features": {"pmu": False},
+        }
+    )
+    definition = """<domain><devices>
+      <memballoon model='virtio'><stats period='10'/></memballoon>
+    </devices></domain>"""
+    tuned = virt_tuner.xmlutil.merge_plan(definition, plan)
+    doc = ElementTree.fromstring(tuned)
+    assert doc.find("cputune/vcpusched").attrib == {
+        "vcpus": "0-3",
+        "scheduler": "fifo",
+        "priority": "1",
+    }
+    assert doc.find("memoryBacking/locked") is not None
+    assert doc.find("features/pmu").get("state") == "off"
+    memballoon = doc.find("devices/memballoon")
+    assert memballoon.attrib == {"model": "none"}
+    assert list(memballoon) == []
+    assert virt_tuner.xmlutil.merge_plan(tuned, plan) == tuned
+
+
+def test_merge_resctrl():
+    """
+    Test merging the cache and memory bandwidth allocations
+    """
+    plan = virt_tuner.xmlutil.compile_config(
+        {
+            "cpu": {
+                "tuning": {
+                    "cachetune": {
+                        "0-3": {0: {"level": 3, "type": "both", "size": "8192 KiB"}}
+                    },
+                    "memorytune": {"0-3": {0: 20}},
+                }
+            }
+        }
+    )
+    tuned = virt_tuner.xmlutil.merge_plan("<domain/>", plan)
+    doc = ElementTree.fromstring(tuned)
+    assert doc.find("cputune/cachetune[@vcpus='0-3']/cache").attrib == {
+        "id": "0",
+        "level": "3",
+        "type": "both",
+        "size": "8192",
+        "unit": "KiB",
+    }
+    assert doc.find("cputune/memorytune[@vcpus='0-3']/node").attrib == {
+        "id": "0",
+        "bandwidth": "20",
+    }
+    assert virt_tuner.xmlutil.merge_plan(tuned, plan) == tuned